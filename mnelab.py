@@ -4,11 +4,13 @@ from PyQt5.QtWidgets import QApplication
 import multiprocessing as mp
 import matplotlib.pyplot as plt
 from mnelab import MainWindow, Model
+from mnelab.utils.pool import get_pool
 
 plt.style.use('ggplot')
 
 if __name__ == "__main__":
     mp.set_start_method("spawn")  # required for Linux/macOS
+    get_pool()  # start worker process in the background
     matplotlib.use("Qt5Agg")
     app = QApplication(sys.argv)
     app.setApplicationName("MNELAB")
@@ -0,0 +1,93 @@
+"""Group statistics of batch results computed one file at a time."""
+import numpy as np
+
+
+class RunningStats:
+    """Running mean and variance of equally shaped arrays.
+
+    Arrays (e.g. the PSD or TFR of one file, per channel and frequency) are
+    added one at a time with Welford's algorithm, so that the results of all
+    files never have to be kept in memory. Partial statistics (e.g. computed
+    by different workers or in different runs) can be merged.
+
+    Parameters
+    ----------
+    count : int
+        Number of arrays the statistics are computed from.
+    mean : ndarray | None
+        Mean of the arrays.
+    m2 : ndarray | None
+        Sum of squared differences from the mean.
+    """
+    def __init__(self, count=0, mean=None, m2=None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    @classmethod
+    def from_array(cls, x):
+        """Create statistics of a single array."""
+        x = np.array(x, dtype=float)
+        return cls(1, x, np.zeros_like(x))
+
+    def _check_shape(self, shape):
+        if self.count > 0 and shape != self.mean.shape:
+            raise ValueError('Shape {} does not match shape {} of previous '
+                             'results.'.format(shape, self.mean.shape))
+
+    def update(self, x):
+        """Add an array to the statistics."""
+        x = np.asarray(x, dtype=float)
+        self._check_shape(x.shape)
+        if self.count == 0:
+            self.count, self.mean, self.m2 = 1, x.copy(), np.zeros_like(x)
+            return self
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        return self
+
+    def merge(self, other):
+        """Add partial statistics (Chan et al.'s parallel algorithm)."""
+        if other.count == 0:
+            return self
+        self._check_shape(other.mean.shape)
+        if self.count == 0:
+            self.count = other.count
+            self.mean, self.m2 = other.mean.copy(), other.m2.copy()
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * (other.count / count)
+        self.m2 += other.m2 + delta ** 2 * (self.count * other.count / count)
+        self.count = count
+        return self
+
+    @property
+    def variance(self):
+        """Sample variance (zero if computed from less than two arrays)."""
+        if self.count < 2:
+            return np.zeros_like(self.mean)
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        """Sample standard deviation."""
+        return np.sqrt(self.variance)
+
+    def save_hdf5(self, path, overwrite=True, **kwargs):
+        """Save the statistics (and additional items, e.g. freqs) as hdf5."""
+        from mne.externals.h5io import write_hdf5
+
+        out = dict(count=self.count, mean=self.mean, m2=self.m2,
+                   variance=self.variance, **kwargs)
+        write_hdf5(path, out, title='mnepython', overwrite=overwrite)
+
+    @classmethod
+    def read_hdf5(cls, path):
+        """Read statistics saved with save_hdf5."""
+        from mne.externals.h5io import read_hdf5
+
+        out = read_hdf5(path, title='mnepython')
+        return cls(out['count'], out['mean'], out['m2'])
@@ -21,6 +21,24 @@ class BatchDialog(QDialog):
         self.ui.listWidget.setSelectionMode(QListWidget.NoSelection)
         self.fnames = []
         self.savePath = ''
+        self.init_jobs()
+
+    def init_jobs(self):
+        """Add the number of parallel jobs above the start button."""
+        layout = QHBoxLayout()
+        layout.addWidget(QLabel("Parallel jobs"))
+        self.jobs = QSpinBox()
+        self.jobs.setRange(1, os.cpu_count() or 1)
+        self.jobs.setValue(self.jobs.maximum())
+        layout.addWidget(self.jobs)
+        layout.addStretch()
+        index = self.ui.verticalLayout.indexOf(self.ui.startBatch)
+        self.ui.verticalLayout.insertLayout(index, layout)
+
+    @property
+    def n_jobs(self):
+        """Number of files processed in parallel."""
+        return self.jobs.value()
 
     def set_bindings(self):
         self.ui.dirButton.clicked.connect(self.open_files)
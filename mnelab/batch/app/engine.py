@@ -0,0 +1,467 @@
+"""Parallel batch processing engine (independent of the GUI)."""
+import os
+import time
+import datetime
+import hashlib
+import json
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from .aggregate import RunningStats
+from .utils import _read, init_avg_tfr, init_epochs_psd, init_raw_psd
+from ...tfr.backend.raw_psd import RawPSD
+from ...tfr.backend.epochs_psd import EpochsPSD
+from ...tfr.backend.avg_epochs_tfr import AvgEpochsTFR
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def _parameters(pipeline):
+    """Return the parameters of a pipeline as stored in the manifest."""
+    params = {key: value for key, value in pipeline.items()
+              if key != 'save_path'}
+    if params.get('tfr') is not None:  # results do not depend on n_jobs
+        params['tfr'] = {key: value for key, value in params['tfr'].items()
+                         if key != 'n_jobs'}
+    return json.loads(json.dumps(params, sort_keys=True))
+
+
+def _hash(fname, block_size=1024 ** 2):
+    """Return the SHA-256 hash of the content of a file."""
+    sha256 = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def _fingerprint(fname, previous=None):
+    """Return size, modification time and hash of a file.
+
+    The hash of a previous entry is reused if size and modification time have
+    not changed.
+    """
+    stat = os.stat(fname)
+    fingerprint = dict(size=stat.st_size, mtime=stat.st_mtime)
+    if (previous is not None and previous['size'] == stat.st_size
+            and previous['mtime'] == stat.st_mtime):
+        fingerprint['sha256'] = previous['sha256']
+    else:
+        fingerprint['sha256'] = _hash(fname)
+    return fingerprint
+
+
+class Manifest:
+    """Record of the files processed in a save folder.
+
+    The manifest is saved as JSON after each file, so that an interrupted
+    batch can be resumed: files whose content and parameters have not changed
+    (and whose outputs still exist) are not processed again.
+
+    Parameters
+    ----------
+    save_path : str
+        Folder where the outputs (and the manifest) are saved.
+    """
+    def __init__(self, save_path):
+        self.fname = os.path.join(save_path, MANIFEST_NAME)
+        self.files = {}
+        if os.path.isfile(self.fname):
+            try:
+                with open(self.fname) as f:
+                    self.files = json.load(f)['files']
+            except (ValueError, KeyError):  # damaged, process all files
+                self.files = {}
+
+    def previous(self, fname, pipeline):
+        """Return the entry of a file processed with the same parameters.
+
+        Returns None if the file has not been processed with these parameters
+        or if one of its outputs is missing.
+        """
+        entry = self.files.get(os.path.abspath(fname))
+        if entry is None or entry['parameters'] != _parameters(pipeline):
+            return None
+        if not all(os.path.isfile(output)
+                   for output in entry['outputs'].values()):
+            return None
+        return entry
+
+    def record(self, fname, pipeline, result):
+        """Add the result of a file and save the manifest.
+
+        Files which could not be processed completely are removed, so that
+        they are processed again in the next run.
+        """
+        key = os.path.abspath(fname)
+        if result['failed']:
+            self.files.pop(key, None)
+        else:
+            entry = dict(input=key, type=result['type'],
+                         parameters=_parameters(pipeline),
+                         outputs=result['outputs'],
+                         duration=result['duration'], log=result['log'],
+                         date=datetime.datetime.now().isoformat())
+            entry.update(result['fingerprint'])
+            self.files[key] = entry
+        self.save()
+
+    def save(self):
+        """Save the manifest (replacing the previous file at once)."""
+        tmp = self.fname + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(dict(version=1, files=self.files), f, indent=2)
+        os.replace(tmp, self.fname)
+
+
+def _read_psd(fname, type):
+    """Read a PSD saved by process_file."""
+    if type == 'epochs':
+        return EpochsPSD().init_from_hdf(fname)
+    return RawPSD().init_from_hdf(fname)
+
+
+def _read_tfr(fname):
+    """Read a TFR saved by process_file."""
+    from mne.time_frequency import read_tfrs
+
+    return AvgEpochsTFR().init_from_average(read_tfrs(fname)[0])
+
+
+def _load_results(pipeline, previous, fingerprint, start, return_results):
+    """Load the outputs of a file which has already been processed."""
+    log = ['Unchanged since {}, results loaded from previous run'
+           .format(previous['date'])]
+    psd_stats, tfr_stats = RunningStats(), RunningStats()
+    psd, tfr = None, None
+    if pipeline.get('tfr') is not None:
+        tfr = _read_tfr(previous['outputs']['tfr'])
+        tfr_stats = RunningStats.from_array(tfr.tfr.data)
+    if pipeline.get('psd') is not None:
+        psd = _read_psd(previous['outputs']['psd'], previous['type'])
+        psd_stats = RunningStats.from_array(psd.data)
+    if not return_results:
+        psd, tfr = None, None
+    return dict(log=log, type=previous['type'], psd=psd, tfr=tfr,
+                psd_stats=psd_stats, tfr_stats=tfr_stats,
+                outputs=previous['outputs'], fingerprint=fingerprint,
+                failed=False, skipped=True,
+                duration=time.perf_counter() - start)
+
+
+def process_file(fname, pipeline, previous=None, return_results=True):
+    """Process a single file of a batch (in a worker process).
+
+    Parameters
+    ----------
+    fname : str
+        File name.
+    pipeline : dict
+        Processing steps: 'filter' ((low, high) or None), 'resample' (sampling
+        frequency or None), 'tfr' and 'psd' (parameters or None), and
+        'save_path' (folder where all outputs are saved).
+    previous : dict | None
+        Manifest entry of a previous run with the same parameters. If the
+        content of the file has not changed, its outputs are loaded instead of
+        being computed again.
+    return_results : bool
+        Whether the PSD and TFR objects are returned. Sending them back from
+        a worker process is expensive, and only one of them is needed as a
+        template of the group averages.
+
+    Returns
+    -------
+    result : dict
+        'log' (list of log lines), 'type' (data type), 'psd' and 'tfr'
+        (computed objects, or None if failed or not returned), 'psd_stats'
+        and 'tfr_stats' (partial
+        group statistics of this file, see RunningStats), 'outputs' (saved
+        files), 'fingerprint' (size, modification time and hash of the input
+        file), 'failed' (whether a step failed), 'skipped' (whether results
+        were loaded from a previous run) and 'duration' (in seconds).
+    """
+    start = time.perf_counter()
+    fingerprint = _fingerprint(fname, previous)
+    if previous is not None and fingerprint['sha256'] == previous['sha256']:
+        try:
+            return _load_results(pipeline, previous, fingerprint, start,
+                                 return_results)
+        except Exception:  # outputs cannot be read, process file again
+            pass
+
+    save_path = pipeline['save_path']
+    name, format = os.path.splitext(os.path.basename(fname))
+    log = []
+    outputs = {}
+    failed = False
+    psd, tfr = None, None
+    data, type = _read(fname)
+    ending = ''
+
+    # Filtering
+    if pipeline.get('filter') is not None:
+        try:
+            low, high = (float(f) for f in pipeline['filter'])
+            data.filter(low, high)
+            ending = ending + '_filtered_{}-{}'.format(low, high)
+            log.append('Filtered between {}-{} Hz'.format(low, high))
+        except Exception as e:
+            log.append('Error caught while filtering : ' + str(e))
+            failed = True
+
+    # Resampling
+    if pipeline.get('resample') is not None:
+        try:
+            sfreq = float(pipeline['resample'])
+            data.resample(sfreq)
+            ending = ending + '_resampled_{}'.format(sfreq)
+            log.append('Resampled to {} Hz'.format(sfreq))
+        except Exception as e:
+            log.append('Error caught while resampling : ' + str(e))
+            failed = True
+
+    if (pipeline.get('filter') is not None
+            or pipeline.get('resample') is not None):
+        save_name = os.path.join(save_path, name + ending + format)
+        data.save(save_name, overwrite=True)
+        outputs['data'] = save_name
+        log.append('file saved at {}'.format(save_name))
+
+    # Computing tfr
+    if pipeline.get('tfr') is not None:
+        try:
+            save_name = os.path.join(save_path, name + '_tfr.h5')
+            tfr = init_avg_tfr(data, pipeline['tfr'])
+            tfr.tfr.save(save_name, overwrite=True)
+            outputs['tfr'] = save_name
+            log.append('Tfr saved at: {}'.format(save_name))
+        except Exception as e:
+            tfr = None
+            log.append('Error caught while computing time-frequency : '
+                       + str(e))
+            failed = True
+
+    # Computing PSD
+    if pipeline.get('psd') is not None:
+        try:
+            save_name = os.path.join(save_path, name + '_psd.h5')
+            if type == 'raw' or type == 'evoked':
+                psd = init_raw_psd(data, pipeline['psd'])
+            elif type == 'epochs':
+                psd = init_epochs_psd(data, pipeline['psd'])
+            psd.save_hdf5(save_name, overwrite=True)
+            outputs['psd'] = save_name
+            log.append('Psd saved at: {}'.format(save_name))
+        except Exception as e:
+            psd = None
+            log.append('Error caught while computing PSD : ' + str(e))
+            failed = True
+
+    psd_stats, tfr_stats = RunningStats(), RunningStats()
+    if psd is not None:
+        psd_stats = RunningStats.from_array(psd.data)
+    if tfr is not None:
+        tfr_stats = RunningStats.from_array(tfr.tfr.data)
+    if not return_results:
+        psd, tfr = None, None
+    return dict(log=log, type=type, psd=psd, tfr=tfr,
+                psd_stats=psd_stats, tfr_stats=tfr_stats,
+                outputs=outputs, fingerprint=fingerprint, failed=failed,
+                skipped=False, duration=time.perf_counter() - start)
+
+
+def run_batch(fnames, pipeline, n_jobs=1, poll=None, poll_interval=0.1,
+              manifest=None):
+    """Process files in parallel worker processes.
+
+    Parameters
+    ----------
+    fnames : list of str
+        Files to process.
+    pipeline : dict
+        Processing steps (see process_file).
+    n_jobs : int
+        Number of worker processes.
+    poll : callable | None
+        Called regularly while waiting for results (e.g. to keep a GUI
+        responsive). If it returns False, files which have not been started
+        are cancelled and no more results are yielded.
+    poll_interval : float
+        Maximum time (in seconds) between two calls of poll.
+    manifest : Manifest | None
+        If given, unchanged files of previous runs are skipped and each result
+        is recorded as soon as it is available.
+
+    Yields
+    ------
+    index : int
+        Index of the file in fnames.
+    fname : str
+        File name.
+    result : dict
+        Result of process_file (in the order in which files are finished). If
+        processing failed, the log contains the error and the type is None.
+        PSD and TFR objects are only returned for the first file (see
+        GroupAverages).
+    """
+    executor = ProcessPoolExecutor(max_workers=max(1, n_jobs),
+                                   mp_context=mp.get_context('spawn'))
+    futures = {}
+    for index, fname in enumerate(fnames):
+        previous = None
+        if manifest is not None:
+            previous = manifest.previous(fname, pipeline)
+        future = executor.submit(process_file, fname, pipeline, previous,
+                                 index == 0)
+        futures[future] = index, fname
+    pending = set(futures)
+    aborted = False
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=poll_interval,
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                index, fname = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = dict(log=['Error caught while processing : '
+                                       + str(e)],
+                                  type=None, psd=None, tfr=None,
+                                  psd_stats=RunningStats(),
+                                  tfr_stats=RunningStats(), outputs={},
+                                  fingerprint=None, failed=True,
+                                  skipped=False, duration=0)
+                if manifest is not None:
+                    manifest.record(fname, pipeline, result)
+                yield index, fname, result
+            if poll is not None and not poll():
+                aborted = True
+                for future in pending:
+                    future.cancel()
+                break
+    finally:
+        # do not wait for running files if aborted
+        executor.shutdown(wait=not aborted)
+
+
+def open_log(save_path, fnames, pipeline):
+    """Open the log of a batch run (log.txt in the save folder).
+
+    Returns
+    -------
+    f : file
+        The log file, with a header describing the batch.
+    """
+    logpath = os.path.join(save_path, 'log.txt')
+    if os.path.isfile(logpath):
+        f = open(logpath, 'a')
+        f.write('\n\n\n\n')
+    else:
+        f = open(logpath, 'w')
+
+    now = datetime.datetime.now()
+    f.write('Batch Processing - {}\n'.format(now.strftime("%Y-%m-%d %H:%M")))
+    f.write('-------------------------------------------------------------\n')
+    f.write('Number of files : {}\n'.format(len(fnames)))
+    if pipeline.get('tfr') is not None:
+        f.write('TFR Parameters : {}\n'.format(pipeline['tfr']))
+    if pipeline.get('psd') is not None:
+        f.write('PSD Parameters : {}\n'.format(pipeline['psd']))
+    return f
+
+
+def write_result(f, index, fname, result):
+    """Write the result of a file to the log."""
+    f.write('\nFile {}: {} ({:.2f} s)\n'.format(index + 1, fname,
+                                               result['duration']))
+    for line in result['log']:
+        f.write(line + '\n')
+    f.flush()
+
+
+class GroupAverages:
+    """Group averages of the PSD and TFR results of a batch.
+
+    The first results are kept as templates of the averages. If no result
+    objects have been returned, the template is read from the outputs of a
+    file when the averages are saved.
+    """
+    def __init__(self):
+        self.psd_stats, self.tfr_stats = RunningStats(), RunningStats()
+        self.mean_psd, self.mean_tfr = None, None
+        self.psd_output, self.tfr_output = None, None
+        self.type = None
+        self.n_skipped = 0
+
+    def add(self, result, f):
+        """Add the result of a file (errors are written to the log f)."""
+        if result['type'] is not None:
+            self.type = result['type']
+        self.n_skipped += result['skipped']
+        try:
+            self.tfr_stats.merge(result['tfr_stats'])
+            if self.mean_tfr is None:
+                self.mean_tfr = result['tfr']
+            if self.tfr_output is None and result['tfr_stats'].count > 0:
+                self.tfr_output = result['outputs'].get('tfr')
+        except Exception as e:
+            f.write('Error caught while averaging TFR : ' + str(e) + '\n')
+        try:
+            self.psd_stats.merge(result['psd_stats'])
+            if self.mean_psd is None:
+                self.mean_psd = result['psd']
+            if self.psd_output is None and result['psd_stats'].count > 0:
+                self.psd_output = (result['outputs'].get('psd'),
+                                   result['type'])
+        except Exception as e:
+            f.write('Error caught while averaging PSD : ' + str(e) + '\n')
+
+    def save(self, save_path, f):
+        """Save group statistics and averages.
+
+        Returns
+        -------
+        mean_psd, mean_tfr : RawPSD | EpochsPSD | AvgEpochsTFR | None
+            The saved averages (None if not available).
+        """
+        mean_psd, mean_tfr = None, None
+        if self.psd_stats.count > 0:
+            try:
+                stats_name = os.path.join(save_path, 'group_psd_stats.h5')
+                if self.mean_psd is None:
+                    self.mean_psd = _read_psd(*self.psd_output)
+                self.psd_stats.save_hdf5(
+                    stats_name, freqs=self.mean_psd.freqs,
+                    ch_names=self.mean_psd.info['ch_names'])
+                self.mean_psd.data = self.psd_stats.mean
+                mean_psd_name = os.path.join(save_path, 'mean_psd.h5')
+                self.mean_psd.save_hdf5(mean_psd_name, overwrite=True)
+                f.write('\nMean of PSD over {} files saved at: {}\n'
+                        .format(self.psd_stats.count, mean_psd_name))
+                f.write('Group statistics of PSD saved at: {}\n'
+                        .format(stats_name))
+                mean_psd = self.mean_psd
+            except Exception as e:
+                f.write('\nError caught while averaging : ' + str(e) + '\n')
+
+        if self.tfr_stats.count > 0:
+            try:
+                stats_name = os.path.join(save_path, 'group_tfr_stats.h5')
+                if self.mean_tfr is None:
+                    self.mean_tfr = _read_tfr(self.tfr_output)
+                self.tfr_stats.save_hdf5(
+                    stats_name, freqs=self.mean_tfr.tfr.freqs,
+                    times=self.mean_tfr.tfr.times,
+                    ch_names=self.mean_tfr.tfr.ch_names)
+                self.mean_tfr.tfr.data = self.tfr_stats.mean
+                mean_tfr_name = os.path.join(save_path, 'mean_tfr.h5')
+                self.mean_tfr.tfr.save(mean_tfr_name, overwrite=True)
+                f.write('\nMean of TFR over {} files saved at: {}\n'
+                        .format(self.tfr_stats.count, mean_tfr_name))
+                f.write('Group statistics of TFR saved at: {}\n'
+                        .format(stats_name))
+                mean_tfr = self.mean_tfr
+            except Exception as e:
+                f.write('\nError caught while averaging : ' + str(e) + '\n')
+        return mean_psd, mean_tfr
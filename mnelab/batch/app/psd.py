@@ -36,6 +36,7 @@ class PSDDialog(QDialog):
         """Setup the boxes with names.
         """
         self.ui.psdMethod.addItem('welch')
+        self.ui.psdMethod.addItem('welch_fast')
         self.ui.psdMethod.addItem('multitaper')
 
     # ---------------------------------------------------------------------
@@ -72,7 +73,7 @@ class PSDDialog(QDialog):
         self.fmax.setText('40')
         self.fmin.setText('0')
 
-        if self.ui.psdMethod.currentText() == 'welch':
+        if self.ui.psdMethod.currentText() in ('welch', 'welch_fast'):
             self.ui.labels.addWidget(QLabel('FFT points'))
             self.ui.labels.addWidget(QLabel('Length of segments (points)'))
             self.ui.labels.addWidget(
@@ -86,6 +87,12 @@ class PSDDialog(QDialog):
             self.n_fft.setText('2048')
             self.n_per_seg.setText(str(int(int(self.n_fft.text()) / 2)))
             self.n_overlap.setText(str(int(int(self.n_fft.text()) / 4)))
+        if self.ui.psdMethod.currentText() == 'welch_fast':
+            self.ui.labels.addWidget(QLabel('Precision'))
+            self.dtype = QComboBox()
+            self.dtype.addItem('float64')
+            self.dtype.addItem('float32')
+            self.ui.lines.addWidget(self.dtype)
         if self.ui.psdMethod.currentText() == 'multitaper':
             self.ui.labels.addWidget(QLabel('Bandwidth (Hz)'))
             self.bandwidth = QLineEdit()
@@ -111,10 +118,12 @@ class PSDDialog(QDialog):
                 self.params['tmax'] = None
             if self.ui.psdMethod.currentText() == 'multitaper':
                 self.params['bandwidth'] = float(self.bandwidth.text())
-            if self.ui.psdMethod.currentText() == 'welch':
+            if self.ui.psdMethod.currentText() in ('welch', 'welch_fast'):
                 self.params['n_fft'] = int(self.n_fft.text())
                 self.params['n_per_seg'] = int(self.n_per_seg.text())
                 self.params['n_overlap'] = int(self.n_overlap.text())
+            if self.ui.psdMethod.currentText() == 'welch_fast':
+                self.params['dtype'] = self.dtype.currentText()
             return self.params
 
         except Exception as e:  # Print exception for parameters
@@ -1,3 +1,5 @@
+import os
+
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
@@ -99,6 +101,11 @@ class TimeFreqDialog(QDialog):
             self.ui.lines.addWidget(self.n_fft)
             self.width.setText('1')
             self.n_fft.setText('2048')
+        self.ui.labels.addWidget(QLabel('Parallel jobs (channels)'))
+        self.n_jobs = QLineEdit()
+        self.n_jobs.setValidator(QIntValidator(1, os.cpu_count() or 1))
+        self.ui.lines.addWidget(self.n_jobs)
+        self.n_jobs.setText('1')
 
     # ---------------------------------------------------------------------
     def read_tfr_parameters(self):
@@ -132,6 +139,7 @@ class TimeFreqDialog(QDialog):
                 self.params['n_fft'] = int(self.n_fft.text())
                 self.params['time_window'] = None
                 self.params['n_cycles'] = None
+            self.params['n_jobs'] = max(1, int(self.n_jobs.text() or 1))
 
             return self.params
 
@@ -50,8 +50,7 @@ def _read(fname):
         return raw, 'raw'
 
     elif ext in [".sef"]:
-        raw = read_sef(fname)
-        raw.load_data()
+        raw = read_sef(fname, preload=True)
         return raw, 'raw'
 
     raise ReadFileError()
@@ -75,14 +74,14 @@ def init_avg_tfr(data, tfr_params):
         method=tfr_params['method'],
         time_bandwidth=tfr_params.get('time_bandwidth', 4),
         width=tfr_params.get('width', 1),
-        n_fft=n_fft)
+        n_fft=n_fft, n_jobs=tfr_params.get('n_jobs', 1))
 
 
 # ---------------------------------------------------------------------
 def init_epochs_psd(data, tfr_params):
     """Initialize the instance of EpochsPSD."""
 
-    if tfr_params['method'] == 'welch':
+    if tfr_params['method'] in ('welch', 'welch_fast'):
         n_fft = tfr_params['n_fft']
         return EpochsPSD(
             data,
@@ -90,10 +89,11 @@ def init_epochs_psd(data, tfr_params):
             fmax=tfr_params['fmax'],
             tmin=tfr_params['tmin'],
             tmax=tfr_params['tmax'],
-            method='welch',
+            method=tfr_params['method'],
             n_fft=n_fft,
             n_per_seg=tfr_params.get('n_per_seg', n_fft),
-            n_overlap=tfr_params.get('n_overlap', 0))
+            n_overlap=tfr_params.get('n_overlap', 0),
+            dtype=tfr_params.get('dtype', 'float64'))
 
     if tfr_params['method'] == 'multitaper':
         return EpochsPSD(
@@ -110,17 +110,18 @@ def init_epochs_psd(data, tfr_params):
 def init_raw_psd(data, tfr_params):
     """Initialize the instance of RawPSD."""
 
-    if tfr_params['method'] == 'welch':
+    if tfr_params['method'] in ('welch', 'welch_fast'):
         return RawPSD(
             data,
             fmin=tfr_params['fmin'],
             fmax=tfr_params['fmax'],
             tmin=tfr_params['tmin'],
             tmax=tfr_params['tmax'],
-            method='welch',
+            method=tfr_params['method'],
             n_fft=tfr_params.get('n_fft', 2048),
             n_per_seg=tfr_params.get('n_per_seg', 2048),
-            n_overlap=tfr_params.get('n_overlap', 0))
+            n_overlap=tfr_params.get('n_overlap', 0),
+            dtype=tfr_params.get('dtype', 'float64'))
 
     if tfr_params['method'] == 'multitaper':
         return RawPSD(
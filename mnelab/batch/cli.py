@@ -0,0 +1,152 @@
+"""Command line batch processing (without GUI).
+
+The pipeline is described in a JSON (or YAML) file, for example::
+
+    {
+        "filter": {"low": 1, "high": 40},
+        "resample": 250,
+        "psd": {"method": "welch", "fmin": 1, "fmax": 40, "tmin": null,
+                "tmax": null, "n_fft": 2048, "n_per_seg": 2048,
+                "n_overlap": 0},
+        "tfr": {"method": "multitaper", "fmin": 4, "fmax": 40,
+                "time_window": null, "n_cycles": 3}
+    }
+
+All keys are optional. PSD and TFR parameters are those of the batch dialog
+(the TFR of each file can be computed in parallel for channels with an
+"n_jobs" TFR parameter). Files and the save folder can also be listed in the
+pipeline ("files" and "save_path"), and the number of parallel jobs (files)
+as "n_jobs".
+"""
+import argparse
+import json
+import os
+import sys
+
+try:
+    import yaml
+except ImportError:
+    have_yaml = False
+else:
+    have_yaml = True
+
+STEPS = ('filter', 'resample', 'psd', 'tfr')
+
+
+def read_spec(fname):
+    """Read a pipeline specification from a JSON or YAML file."""
+    with open(fname) as f:
+        if os.path.splitext(fname)[1].lower() in ('.yml', '.yaml'):
+            if not have_yaml:
+                raise ValueError('Reading YAML files requires PyYAML.')
+            return yaml.safe_load(f) or {}
+        return json.load(f)
+
+
+def spec_to_pipeline(spec, save_path):
+    """Convert a pipeline specification to the processing steps of a batch.
+
+    Parameters
+    ----------
+    spec : dict
+        Pipeline specification (see module docstring).
+    save_path : str
+        Folder where all outputs are saved.
+
+    Returns
+    -------
+    pipeline : dict
+        Processing steps (see mnelab.batch.app.engine.process_file).
+    """
+    unknown = set(spec) - set(STEPS) - {'files', 'save_path', 'n_jobs'}
+    if unknown:
+        raise ValueError('Unknown keys in pipeline: {}'
+                         .format(', '.join(sorted(unknown))))
+    pipeline = dict(save_path=save_path, filter=None, resample=None,
+                    tfr=None, psd=None)
+    filt = spec.get('filter')
+    if isinstance(filt, dict):
+        pipeline['filter'] = (filt.get('low'), filt.get('high'))
+    elif filt is not None:
+        low, high = filt
+        pipeline['filter'] = (low, high)
+    resample = spec.get('resample')
+    if isinstance(resample, dict):
+        pipeline['resample'] = resample['sfreq']
+    else:
+        pipeline['resample'] = resample
+    for step in ('psd', 'tfr'):
+        params = spec.get(step)
+        if params is not None:
+            if 'method' not in params:
+                raise ValueError('Missing method of {} parameters.'
+                                 .format(step.upper()))
+            params = dict(params)
+            params.setdefault('tmin', None)
+            params.setdefault('tmax', None)
+            if step == 'tfr':
+                params.setdefault('time_window', None)
+            pipeline[step] = params
+    return pipeline
+
+
+def main(argv=None):
+    """Run a batch from the command line."""
+    parser = argparse.ArgumentParser(
+        prog='mnelab-batch',
+        description='Process EEG/MEG files in parallel without GUI.')
+    parser.add_argument('pipeline', help='JSON or YAML pipeline file')
+    parser.add_argument('files', nargs='*', help='files to process')
+    parser.add_argument('-o', '--output', help='folder for all outputs '
+                        '(default: folder of the first file)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of parallel jobs (default: all cores)')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='process all files again, even if unchanged')
+    args = parser.parse_args(argv)
+
+    import matplotlib
+    matplotlib.use('Agg')  # no display required
+    from .app.engine import (GroupAverages, Manifest, open_log, run_batch,
+                             write_result)
+
+    try:
+        spec = read_spec(args.pipeline)
+        fnames = list(spec.get('files', [])) + args.files
+        if not fnames:
+            raise ValueError('No files to process.')
+        save_path = (args.output or spec.get('save_path')
+                     or os.path.dirname(os.path.abspath(fnames[0])))
+        pipeline = spec_to_pipeline(spec, save_path)
+    except (OSError, ValueError, TypeError, KeyError) as e:
+        parser.error(str(e))
+    n_jobs = args.jobs or spec.get('n_jobs') or os.cpu_count() or 1
+
+    os.makedirs(save_path, exist_ok=True)
+    f = open_log(save_path, fnames, pipeline)
+    averages = GroupAverages()
+    manifest = Manifest(save_path)
+    if args.no_resume:
+        manifest.files = {}
+    n_failed = 0
+    for n_done, (index, fname, result) in enumerate(
+            run_batch(fnames, pipeline, n_jobs=n_jobs, manifest=manifest)):
+        write_result(f, index, fname, result)
+        averages.add(result, f)
+        n_failed += result['failed']
+        status = ('skipped' if result['skipped'] else
+                  'failed' if result['failed'] else 'done')
+        print('[{}/{}] {} {} ({:.2f} s)'.format(
+            n_done + 1, len(fnames), fname, status, result['duration']),
+            flush=True)
+    if averages.n_skipped > 0:
+        f.write('\n{} unchanged files skipped (see {})\n'
+                .format(averages.n_skipped, manifest.fname))
+    averages.save(save_path, f)
+    f.close()
+    print('Log saved at {}'.format(os.path.join(save_path, 'log.txt')))
+    return 1 if n_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
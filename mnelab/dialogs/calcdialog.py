@@ -6,8 +6,8 @@ class CalcDialog(QDialog):
         super().__init__(parent)
         self.setWindowTitle(title)
         vbox = QVBoxLayout(self)
-        label = QLabel(message)
+        self.label = QLabel(message)
         button = QDialogButtonBox(QDialogButtonBox.Cancel)
         button.rejected.connect(self.close)
-        vbox.addWidget(label)
+        vbox.addWidget(self.label)
         vbox.addWidget(button)
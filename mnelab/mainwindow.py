@@ -1,6 +1,6 @@
-import multiprocessing as mp
 from sys import version_info
 from collections import Counter
+from functools import partial
 
 import matplotlib.pyplot as plt
 import mne
@@ -10,7 +10,8 @@ from PyQt5.QtCore import (pyqtSlot, QStringListModel, QModelIndex, QSettings,
 from PyQt5.QtGui import QKeySequence, QDropEvent
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QFileDialog, QSplitter,
                              QMessageBox, QListView, QAction, QLabel, QFrame,
-                             QStatusBar, QToolBar)
+                             QStatusBar, QToolBar, QInputDialog,
+                             QProgressBar, QPushButton)
 
 from .tfr.backend.avg_epochs_tfr import AvgEpochsTFR
 from .tfr.app.avg_epochs_tfr import AvgTFRWindow
@@ -20,6 +21,8 @@ from .tfr.backend.raw_psd import RawPSD
 from .tfr.app.raw_psd import RawPSDWindow
 
 from .utils.error import show_error
+from .utils.jobs import JobExecutor
+from .utils.pool import apply_async, restart_pool, shutdown_pool
 from .dialogs.calcdialog import CalcDialog
 from .dialogs.filterdialog import FilterDialog
 from .dialogs.findeventsdialog import FindEventsDialog
@@ -74,8 +77,12 @@ def read_settings():
     geometry = settings.value("geometry")
     state = settings.value("state")
 
+    memory_budget = settings.value("memory_budget")
+    if memory_budget is None:  # default is 0 (no limit)
+        memory_budget = 0
+
     return {"recent": recent, "statusbar": statusbar, "geometry": geometry,
-            "state": state}
+            "state": state, "memory_budget": int(memory_budget)}
 
 
 def write_settings(**kwargs):
@@ -100,6 +107,14 @@ class MainWindow(QMainWindow):
         self.model = model  # data model
         self.setWindowTitle("MNELAB")
 
+        # model operations run in the background one after another
+        self.jobs = JobExecutor(self)
+        self._last_job = None
+        self.jobs.started.connect(self._job_started)
+        self.jobs.finished.connect(self._job_finished)
+        self.jobs.failed.connect(self._job_failed)
+        self.jobs.progress.connect(self._job_progress)
+
         # restore settings
         settings = read_settings()
         self.recent = settings["recent"]  # list of recent files
@@ -111,6 +126,7 @@ class MainWindow(QMainWindow):
                       self.rect().center())  # center window
         if settings["state"]:
             self.restoreState(settings["state"])
+        self.model.memory_budget = settings["memory_budget"] * 1024 ** 2
 
         self.actions = {}  # contains all actions
 
@@ -120,6 +136,11 @@ class MainWindow(QMainWindow):
             "&Open...",
             lambda: self.open_file(model.load, "Open raw", SUPPORTED_FORMATS),
             QKeySequence.Open)
+        self.actions["open_file_lazy"] = file_menu.addAction(
+            "Open without &loading...",
+            lambda: self.open_file(partial(model.load, preload=False),
+                                   "Open raw without loading data",
+                                   SUPPORTED_FORMATS))
         self.recent_menu = file_menu.addMenu("Open recent")
         self.recent_menu.aboutToShow.connect(self._update_recent_menu)
         self.recent_menu.triggered.connect(self._load_recent)
@@ -127,7 +148,8 @@ class MainWindow(QMainWindow):
             self.recent_menu.setEnabled(False)
         self.actions["close_file"] = file_menu.addAction(
             "&Close",
-            self.model.remove_data,
+            lambda: self.run_job("Closing data set", self.model.remove_data,
+                                 index=self.model.index),
             QKeySequence.Close)
         self.actions["close_all"] = file_menu.addAction(
             "Close all",
@@ -147,8 +169,8 @@ class MainWindow(QMainWindow):
                                      "Import annotations", "*.csv *.mrk"))
         self.actions["import_ica"] = file_menu.addAction(
             "Import &ICA...",
-            lambda: self.open_file(model.import_ica, "Import ICA",
-                                   "*.fif *.fif.gz"))
+            lambda: self.import_file(model.import_ica, "Import ICA",
+                                     "*.fif *.fif.gz"))
         file_menu.addSeparator()
         self.actions["export_data"] = file_menu.addAction(
             "Export data...",
@@ -269,6 +291,8 @@ class MainWindow(QMainWindow):
         self.actions["statusbar"] = view_menu.addAction(
             "Statusbar", self._toggle_statusbar)
         self.actions["statusbar"].setCheckable(True)
+        self.actions["memory_budget"] = view_menu.addAction(
+            "Memory budget...", self.set_memory_budget)
 
         help_menu = self.menuBar().addMenu("&Help")
         self.actions["about"] = help_menu.addAction("&About", self.show_about)
@@ -276,9 +300,9 @@ class MainWindow(QMainWindow):
             "About &Qt", self.show_about_qt)
 
         # actions that are always enabled
-        self.always_enabled = ["open_file", "about", "about_qt", "quit",
-                               "statusbar", "open_batch", "open_tfr",
-                               "open_psd"]
+        self.always_enabled = ["open_file", "open_file_lazy", "about",
+                               "about_qt", "quit", "statusbar", "open_batch",
+                               "open_tfr", "open_psd", "memory_budget"]
 
         # set up data model for sidebar (list of open files)
         self.names = QStringListModel()
@@ -298,6 +322,16 @@ class MainWindow(QMainWindow):
 
         self.status_label = QLabel()
         self.statusBar().addPermanentWidget(self.status_label)
+        self.job_label = QLabel()
+        self.job_progress = QProgressBar()
+        self.job_progress.setMaximumWidth(150)
+        self.job_cancel = QPushButton("Cancel")
+        self.job_cancel.setToolTip("Cancel queued operations (the running "
+                                   "operation cannot be interrupted)")
+        self.job_cancel.clicked.connect(self.jobs.cancel)
+        for widget in (self.job_label, self.job_progress, self.job_cancel):
+            self.statusBar().addWidget(widget)
+            widget.hide()
         if settings["statusbar"]:
             self.statusBar().show()
             self.actions["statusbar"].setChecked(True)
@@ -309,6 +343,16 @@ class MainWindow(QMainWindow):
         self.data_changed()
 
     def data_changed(self):
+        # while background jobs modify the model, the view does not read it
+        # and data sets cannot be selected or modified
+        busy = self.jobs.busy
+        self.sidebar.setEnabled(not busy)
+        if busy:
+            for name, action in self.actions.items():
+                if name not in self.always_enabled:
+                    action.setEnabled(False)
+            return
+
         # update sidebar
         self.names.setStringList(self.model.names)
         self.sidebar.setCurrentIndex(self.names.index(self.model.index))
@@ -400,11 +444,49 @@ class MainWindow(QMainWindow):
         if len(self.model) > 0:
             self._add_recent(self.model.current["fname"])
 
+    def run_job(self, description, f, *args, index=None, history=(),
+                **kwargs):
+        """Run a model operation in the background.
+
+        Operations run in the order in which they are submitted, the view is
+        updated when all operations are finished (actions which use data sets
+        are disabled until then). An operation depends on the operation
+        queued before it (e.g. on the data set duplicated by auto_duplicate,
+        or on the index of a data set it inserts), so if an operation fails,
+        all operations queued after it are skipped.
+
+        Parameters
+        ----------
+        description : str
+            Description shown in the status bar.
+        f : callable
+            The operation (args and kwargs are passed to f).
+        index : int | None
+            Index of the data set the operation modifies, which is selected
+            before the operation runs. Operations therefore use the data set
+            which was shown in their dialog, even if previous operations of
+            the queue selected another one.
+        history : list of str
+            Commands added to the history once the operation has succeeded.
+        """
+        def run():
+            if index is not None and index != self.model.index:
+                self.model.select(index)
+            result = f(*args, **kwargs)
+            self.model.history.extend(history)
+            return result
+
+        depends_on = self._last_job if self.jobs.busy else None
+        job = self.jobs.submit(description, run, depends_on=depends_on)
+        self._last_job = job
+        self.data_changed()
+        return job
+
     def open_file(self, f, text, ffilter):
         """Open file."""
         fname = QFileDialog.getOpenFileName(self, text, filter=ffilter)[0]
         if fname:
-            f(fname)
+            self.run_job(text, f, fname)
 
     def export_file(self, f, text, ffilter):
         """Export to file."""
@@ -412,26 +494,23 @@ class MainWindow(QMainWindow):
         # text, filter=ffilter)[0]
         fname = QFileDialog.getSaveFileName(self, text, filter=ffilter)[0]
         if fname:
-            f(fname)
+            self.run_job(text, f, fname, index=self.model.index)
 
     def import_file(self, f, text, ffilter):
         """Import file."""
         fname = QFileDialog.getOpenFileName(self, text, filter=ffilter)[0]
         if fname:
-            try:
-                f(fname)
-            except LabelsNotFoundError as e:
-                QMessageBox.critical(self, "Channel labels not found", str(e))
-            except InvalidAnnotationsError as e:
-                QMessageBox.critical(self, "Invalid annotations", str(e))
+            self.run_job(text, f, fname, index=self.model.index)
 
     def close_all(self):
         """Close all currently open data sets."""
         msg = QMessageBox.question(self, "Close all data sets",
                                    "Close all data sets?")
         if msg == QMessageBox.Yes:
-            while len(self.model) > 0:
-                self.model.remove_data()
+            def remove_all():
+                while len(self.model) > 0:
+                    self.model.remove_data()
+            self.run_job("Closing all data sets", remove_all)
 
     def pick_channels(self):
         """Pick channels in current data set."""
@@ -446,9 +525,10 @@ class MainWindow(QMainWindow):
             picks = [item.data(0) for item in dialog.channels.selectedItems()]
             drops = set(channels) - set(picks)
             if drops:
-                self.auto_duplicate()
-                self.model.drop_channels(drops)
-                self.model.history.append(f"data.drop({drops})")
+                index = self.auto_duplicate()
+                self.run_job("Dropping channels", self.model.drop_channels,
+                             drops, index=index,
+                             history=[f"data.drop({drops})"])
 
     def channel_properties(self):
         """Show channel properties dialog."""
@@ -473,7 +553,9 @@ class MainWindow(QMainWindow):
                 types[new_label] = new_type
                 if dialog.model.item(i, 3).checkState() == Qt.Checked:
                     bads.append(info["ch_names"][i])
-            self.model.set_channel_properties(bads, renamed, types)
+            self.run_job("Setting channel properties",
+                         self.model.set_channel_properties, bads, renamed,
+                         types, index=self.model.index)
 
     def set_montage(self):
         """Set montage."""
@@ -485,13 +567,13 @@ class MainWindow(QMainWindow):
             if dialog.montage_path == '':
                 name = dialog.montages.selectedItems()[0].data(0)
                 montage = mne.channels.read_montage(name)
-                self.model.history.append("montage = mne.channels."
-                                          + ("read_montage({})").format(name))
+                history = ("montage = mne.channels."
+                           + ("read_montage({})").format(name))
             else:
                 from .utils.montage import xyz_to_montage
                 montage = xyz_to_montage(dialog.montage_path)
-                self.model.history.append("montage = xyz_to_montage({})"
-                                          .format(dialog.montage_path))
+                history = ("montage = xyz_to_montage({})"
+                           .format(dialog.montage_path))
             if self.model.current["raw"]:
                 ch_names = self.model.current["raw"].info["ch_names"]
             elif self.model.current["epochs"]:
@@ -500,7 +582,9 @@ class MainWindow(QMainWindow):
                 ch_names = self.model.current["evoked"].info["ch_names"]
             # check if at least one channel name matches a name in the montage
             if set(ch_names) & set(montage.ch_names):
-                self.model.set_montage(montage)
+                self.run_job("Setting montage", self.model.set_montage,
+                             montage, index=self.model.index,
+                             history=[history])
             else:
                 QMessageBox.critical(self, "No matching channel names",
                                      "Channel names defined in the montage do "
@@ -624,25 +708,25 @@ class MainWindow(QMainWindow):
         except Exception as e:
             psd = None
         if psd is not None:
-            self.model.current["psd"] = psd
-            self.data_changed()
+            self.run_job("Storing PSD", self.model.update_current, psd=psd,
+                         index=self.model.index)
 
     def open_psd(self):
         fname = QFileDialog.getOpenFileName(self, "Open TFR",
                                             filter="*.h5 *.hdf")[0]
         try:
-            psd = EpochsPSD().init_from_hdf(fname)
-            win = EpochsPSDWindow(psd, parent=None)
-            win.setWindowTitle(fname)
-            win.exec()
+            with EpochsPSD().init_from_hdf(fname, lazy=True) as psd:
+                win = EpochsPSDWindow(psd, parent=None)
+                win.setWindowTitle(fname)
+                win.exec()
         except Exception as e:
             print(e)
             try:
-                psd = RawPSD().init_from_hdf(fname)
-                win = RawPSDWindow(psd, parent=None)
-                win.setWindowModality(Qt.WindowModal)
-                win.setWindowTitle(fname)
-                win.exec()
+                with RawPSD().init_from_hdf(fname, lazy=True) as psd:
+                    win = RawPSDWindow(psd, parent=None)
+                    win.setWindowModality(Qt.WindowModal)
+                    win.setWindowTitle(fname)
+                    win.exec()
             except Exception:
                 pass
 
@@ -663,18 +747,18 @@ class MainWindow(QMainWindow):
         except Exception as e:
             tfr = None
         if tfr is not None:
-            self.model.current["tfr"] = tfr
-            self.data_changed()
+            self.run_job("Storing TFR", self.model.update_current, tfr=tfr,
+                         index=self.model.index)
 
     def open_tfr(self):
         try:
             fname = QFileDialog.getOpenFileName(self, "Open TFR",
                                                 filter="*.h5 *.hdf")[0]
-            avgTFR = AvgEpochsTFR().init_from_hdf(fname)
-            win = AvgTFRWindow(avgTFR, parent=None)
-            win.setWindowModality(Qt.WindowModal)
-            win.setWindowTitle(fname)
-            win.exec()
+            with AvgEpochsTFR().init_from_hdf(fname, lazy=True) as avgTFR:
+                win = AvgTFRWindow(avgTFR, parent=None)
+                win.setWindowModality(Qt.WindowModal)
+                win.setWindowTitle(fname)
+                win.exec()
         except Exception as e:
             print(e)
 
@@ -815,37 +899,36 @@ class MainWindow(QMainWindow):
                 random_state=random_state,
                 max_iter=max_iter)
 
-            pool = mp.Pool(1)
             kwds = {"reject_by_annotation": exclude_bad_segments,
                     "decim": decim}
-            res = pool.apply_async(func=ica.fit,
-                                   args=(data,),
-                                   kwds=kwds, callback=lambda x: calc.accept())
+            res = apply_async(func=ica.fit,
+                              args=(data,),
+                              kwds=kwds, callback=lambda x: calc.accept())
             if not calc.exec_():
-                pool.terminate()
+                restart_pool()
             else:
-                self.auto_duplicate()
-                self.model.current["ica"] = res.get(timeout=1)
-                self.model.history.append(
+                history = [
                     "ica=ICA("
                     + ("method={} ,").format(dialog.methods[method])
                     + ("n_components={}, ").format(n_components)
                     + ("max_pca_components={}, ").format(max_pca_components)
                     + ("n_pca_components={}, ").format(n_pca_components)
                     + ("random_state={}, ").format(random_state)
-                    + ("max_iter={})").format(max_iter))
-                self.model.history.append(
+                    + ("max_iter={})").format(max_iter),
                     "ica.fit("
                     + ("inst={}, ").format(inst_type)
                     + ("decim={}, ").format(decim)
                     + ("reject_by_annotation={})"
-                       .format(exclude_bad_segments)))
-                self.data_changed()
+                       .format(exclude_bad_segments))]
+                index = self.auto_duplicate()
+                self.run_job("Storing ICA", self.model.update_current,
+                             ica=res.get(timeout=1), index=index,
+                             history=history)
 
     def apply_ica(self):
-        """Set reference."""
-        self.auto_duplicate()
-        self.model.apply_ica()
+        """Apply ICA."""
+        index = self.auto_duplicate()
+        self.run_job("Applying ICA", self.model.apply_ica, index=index)
 
     def resample(self):
         """Resample data."""
@@ -853,15 +936,9 @@ class MainWindow(QMainWindow):
         if dialog.exec_():
             sfreq = dialog.sfreq
             if sfreq is not None:
-                self.auto_duplicate()
-                if self.model.current['raw']:
-                    self.model.current['raw'].resample(sfreq)
-                elif self.model.current['epochs']:
-                    self.model.current['epochs'].resample(sfreq)
-                elif self.model.current['evoked']:
-                    self.model.current['evoked'].resample(sfreq)
-                self.model.current["name"] += " (resampled)"
-                self.data_changed()
+                index = self.auto_duplicate()
+                self.run_job("Resampling", self.model.resample, sfreq,
+                             index=index)
 
     def filter_data(self):
         """Filter data."""
@@ -872,8 +949,9 @@ class MainWindow(QMainWindow):
         dialog = FilterDialog(self, israw)
         if dialog.exec_():
             if dialog.low or dialog.high or dialog.notch_freqs:
-                self.auto_duplicate()
-                self.model.filter(dialog.low, dialog.high, dialog.notch_freqs)
+                index = self.auto_duplicate()
+                self.run_job("Filtering", self.model.filter, dialog.low,
+                             dialog.high, dialog.notch_freqs, index=index)
 
     def find_events(self):
         info = self.model.current["raw"].info
@@ -892,22 +970,22 @@ class MainWindow(QMainWindow):
             uint_cast = dialog.uint_cast.isChecked()
             min_dur = dialog.minduredit.value()
             shortest_event = dialog.shortesteventedit.value()
-            self.model.find_events(stim_channel=stim_channel,
-                                   consecutive=consecutive,
-                                   initial_event=initial_event,
-                                   uint_cast=uint_cast,
-                                   min_duration=min_dur,
-                                   shortest_event=shortest_event)
+            self.run_job("Finding events", self.model.find_events,
+                         stim_channel=stim_channel, consecutive=consecutive,
+                         initial_event=initial_event, uint_cast=uint_cast,
+                         min_duration=min_dur, shortest_event=shortest_event,
+                         index=self.model.index)
 
     def interpolate_bads(self):
         """Interpolate bad channels."""
-        self.auto_duplicate()
-        self.model.interpolate_bads()
+        index = self.auto_duplicate()
+        self.run_job("Interpolating bad channels", self.model.interpolate_bads,
+                     index=index)
 
     def add_events(self):
         """Setup the events in the data as a STIM channel."""
-        self.auto_duplicate()
-        self.model.add_events()
+        index = self.auto_duplicate()
+        self.run_job("Adding events", self.model.add_events, index=index)
 
     def epoch_data(self):
         """Cut raw data into epochs."""
@@ -937,24 +1015,26 @@ class MainWindow(QMainWindow):
                 else:
                     baseline = None
 
-                self.auto_duplicate()
-                self.model.epoch_data(selected, tmin, tmax, baseline)
+                index = self.auto_duplicate()
+                self.run_job("Epoching", self.model.epoch_data, selected, tmin,
+                             tmax, baseline, index=index)
 
     def evoke_data(self):
         """Compute the mean of epochs."""
-        self.auto_duplicate()
-        self.model.evoke_data()
+        index = self.auto_duplicate()
+        self.run_job("Averaging epochs", self.model.evoke_data, index=index)
 
     def set_reference(self):
         """Set reference."""
         dialog = ReferenceDialog(self)
         if dialog.exec_():
-            self.auto_duplicate()
+            index = self.auto_duplicate()
             if dialog.average.isChecked():
-                self.model.set_reference("average")
+                ref = "average"
             else:
                 ref = [c.strip() for c in dialog.channellist.text().split(",")]
-                self.model.set_reference(ref)
+            self.run_job("Setting reference", self.model.set_reference, ref,
+                         index=index)
 
     def open_batch(self):
         """Open batch processing dialog."""
@@ -989,15 +1069,29 @@ class MainWindow(QMainWindow):
         QMessageBox.aboutQt(self, "About Qt")
 
     def auto_duplicate(self):
+        """Duplicate the current data set before it is modified if needed.
+
+        Returns
+        -------
+        index : int
+            Index of the data set to modify (the duplicate is inserted after
+            the current data set).
+        """
+        index = self.model.index
         # if current data is stored in a file create a new data set
         if self.model.current["fname"]:
-            self.model.duplicate_data()
+            self.run_job("Duplicating data set", self.model.duplicate_data,
+                         index=index)
+            return index + 1
         # otherwise ask the user
         else:
             msg = QMessageBox.question(self, "Overwrite existing data set",
                                        "Overwrite existing data set?")
             if msg == QMessageBox.No:  # create new data set
-                self.model.duplicate_data()
+                self.run_job("Duplicating data set",
+                             self.model.duplicate_data, index=index)
+                return index + 1
+        return index
 
     def _add_recent(self, fname):
         """Add a file to recent file list.
@@ -1040,8 +1134,8 @@ class MainWindow(QMainWindow):
             Index of the selected row.
         """
         if selected.row() != self.model.index:
-            self.model.index = selected.row()
-            self.data_changed()
+            self.run_job("Selecting data set", self.model.select,
+                         selected.row())
 
     @pyqtSlot(QModelIndex, QModelIndex)
     def _update_names(self, start, stop):
@@ -1057,7 +1151,7 @@ class MainWindow(QMainWindow):
 
     @pyqtSlot(QAction)
     def _load_recent(self, action):
-        self.model.load(action.text())
+        self.run_job("Open raw", self.model.load, action.text())
 
     @pyqtSlot()
     def _toggle_statusbar(self):
@@ -1067,6 +1161,50 @@ class MainWindow(QMainWindow):
             self.statusBar().hide()
         write_settings(statusbar=not self.statusBar().isHidden())
 
+    @pyqtSlot()
+    def set_memory_budget(self):
+        """Set maximum memory used by all data sets.
+
+        Least recently used data sets are spilled to disk when this budget is
+        exceeded.
+        """
+        budget, ok = QInputDialog.getInt(
+            self, "Memory budget", "Memory budget in MB (0 for no limit):",
+            (self.model.memory_budget or 0) // 1024 ** 2, 0, 2 ** 31 - 1)
+        if ok:
+            self.model.memory_budget = budget * 1024 ** 2
+            write_settings(memory_budget=budget)
+            self.run_job("Freeing memory", self.model.evict)
+
+    @pyqtSlot(object)
+    def _job_started(self, job):
+        self.job_label.setText(job.description + "...")
+
+    @pyqtSlot(int, int)
+    def _job_progress(self, done, total):
+        busy = done < total
+        for widget in (self.job_label, self.job_progress, self.job_cancel):
+            widget.setVisible(busy)
+        # only queued jobs can be cancelled
+        self.job_cancel.setEnabled(total - done > 1)
+        # number of finished jobs (busy indicator if only one job is queued)
+        self.job_progress.setRange(0, total if total > 1 else 0)
+        self.job_progress.setValue(done)
+
+    @pyqtSlot(object)
+    def _job_finished(self, job):
+        self.data_changed()
+
+    @pyqtSlot(object, object)
+    def _job_failed(self, job, error):
+        self.data_changed()
+        if isinstance(error, LabelsNotFoundError):
+            QMessageBox.critical(self, "Channel labels not found", str(error))
+        elif isinstance(error, InvalidAnnotationsError):
+            QMessageBox.critical(self, "Invalid annotations", str(error))
+        else:
+            show_error(job.description + " failed", info=str(error))
+
     @pyqtSlot(QDropEvent)
     def dragEnterEvent(self, event):
         if event.mimeData().hasUrls():
@@ -1078,7 +1216,7 @@ class MainWindow(QMainWindow):
         if mime.hasUrls():
             urls = mime.urls()
             for url in urls:
-                self.model.load(url.toLocalFile())
+                self.run_job("Open raw", self.model.load, url.toLocalFile())
 
     @pyqtSlot(QEvent)
     def closeEvent(self, event):
@@ -1090,6 +1228,8 @@ class MainWindow(QMainWindow):
             Close event.
         """
         write_settings(geometry=self.saveGeometry(), state=self.saveState())
+        self.jobs.shutdown()
+        shutdown_pool()
         if self.model.history:
             print("\nCommand History")
             print("===============")
@@ -4,6 +4,9 @@ from collections import Counter, defaultdict
 from functools import wraps
 from copy import deepcopy
 from datetime import datetime
+from tempfile import TemporaryDirectory
+import threading
+import weakref
 import numpy as np
 from numpy.core.records import fromarrays
 from scipy.io import savemat
@@ -12,7 +15,7 @@ import matplotlib.pyplot as plt
 
 from .utils.montage import eeg_to_montage
 from .utils.export import export_sef
-from .utils.error import show_error
+from .utils.memory import DATA_KEYS, dataset_buffers
 from .philistine.io import write_raw_brainvision
 
 SUPPORTED_FORMATS = "*.bdf *.edf *.fif *.vhdr *.set *.sef"
@@ -41,14 +44,50 @@ class AddReferenceError(Exception):
 
 
 def data_changed(f):
-    """Call self.view.data_changed method after function call."""
+    """Call self.view.data_changed method after function call.
+
+    The memory of the current data set is updated as well (see
+    Model._update_memory), because the function might have modified it. When
+    called in a background job, the view is not updated (this is up to the
+    code running the job).
+    """
     @wraps(f)
     def wrapper(*args, **kwargs):
-        f(*args, **kwargs)
-        args[0].view.data_changed()
+        try:
+            f(*args, **kwargs)
+        finally:
+            args[0]._update_memory()
+            if threading.current_thread() is threading.main_thread():
+                args[0].view.data_changed()
     return wrapper
 
 
+def _share(inst):
+    """Copy Raw, Epochs or Evoked object without copying its data.
+
+    The data array is shared between inst and the copy and made read-only, so
+    that it has to be unshared (copied) before it can be modified.
+    """
+    data = getattr(inst, "_data", None)
+    if not isinstance(data, np.ndarray):  # not loaded
+        return deepcopy(inst)
+    inst._data = None
+    try:
+        copy = deepcopy(inst)
+    finally:
+        inst._data = data
+    data.flags.writeable = False
+    copy._data = data
+    return copy
+
+
+def _unshare(inst):
+    """Copy a shared (read-only) data array so that it can be modified."""
+    data = getattr(inst, "_data", None)
+    if isinstance(data, np.ndarray) and not data.flags.writeable:
+        inst._data = data.copy()
+
+
 class Model:
     """Data model for MNELAB."""
     def __init__(self):
@@ -56,6 +95,10 @@ class Model:
         self.data = []     # list of data sets
         self.index = -1    # index of currently active data set
         self.history = []  # command history
+        self.memory_budget = None  # maximum size (in bytes) of all data sets
+        self._spill_dir = None  # temporary directory for spilled data sets
+        self._n_spilled = 0
+        self._n_accessed = 0  # counter to order data sets by last access
 
     @data_changed
     def insert_data(self, dataset):
@@ -68,6 +111,19 @@ class Model:
         """Update/overwrite data set at current index."""
         self.current = dataset
 
+    @data_changed
+    def update_current(self, **kwargs):
+        """Update entries (e.g. ica, psd, tfr) of the current data set."""
+        self.current.update(kwargs)
+
+    @data_changed
+    def select(self, index):
+        """Select data set at index as current data set.
+
+        A data set which has been spilled to disk is loaded again.
+        """
+        self.index = index
+
     @data_changed
     def remove_data(self):
         """Remove data set at current index."""
@@ -81,11 +137,94 @@ class Model:
 
     @data_changed
     def duplicate_data(self):
-        """Duplicate current data set."""
-        self.insert_data(deepcopy(self.current))
+        """Duplicate current data set.
+
+        Data arrays of raw, epochs and evoked are shared between both data sets
+        until one of them modifies its data (copy-on-write). PSD and TFR
+        results are shared as well, all other entries are copied.
+        """
+        dataset = defaultdict(lambda: None)
+        for key, value in self.current.items():
+            if key in ("raw", "epochs", "evoked") and value is not None:
+                dataset[key] = _share(value)
+            elif key in ("psd", "tfr"):
+                dataset[key] = value
+            else:
+                dataset[key] = deepcopy(value)
+        self.insert_data(dataset)
         self.current["fname"] = None
         self.current["ftype"] = None
 
+    def spill_data(self, index):
+        """Move data of a data set to a temporary file.
+
+        Raw and epochs data are saved to a temporary FIF file and replaced by
+        objects which are not preloaded, so that the memory can be released.
+        Data is read from the temporary file when it is needed again.
+
+        Parameters
+        ----------
+        index : int
+            Index of the data set (usually not the current one).
+        """
+        dataset = self.data[index]
+        for key, read in (("raw", mne.io.read_raw_fif),
+                          ("epochs", mne.read_epochs)):
+            inst = dataset[key]
+            if inst is None or not inst.preload:
+                continue
+            if self._spill_dir is None:
+                self._spill_dir = TemporaryDirectory(prefix="mnelab-")
+            self._n_spilled += 1
+            suffix = "raw" if key == "raw" else "epo"
+            fname = join(self._spill_dir.name,
+                         "{}-{}.fif".format(self._n_spilled, suffix))
+            inst.save(fname, fmt="double", overwrite=True, verbose=False)
+            dataset[key] = read(fname, preload=False, verbose=False)
+            dataset["spilled"] = True
+        dataset["buffers"] = None
+
+    def evict(self):
+        """Spill least recently used data sets until memory budget is met.
+
+        The current data set is never spilled.
+        """
+        if not self.memory_budget:
+            return
+        current = self._buffers(self.current) if self.current else {}
+        accessed = []
+        for index, item in enumerate(self.data):
+            if index == self.index or not any(
+                    getattr(item[key], "preload", False)
+                    for key in ("raw", "epochs")):
+                continue
+            # spilling data shared with the current data set frees no memory
+            if set(self._buffers(item)) - set(current):
+                accessed.append((item["accessed"] or 0, index))
+        for _, index in sorted(accessed):
+            if self.nbytes <= self.memory_budget:
+                break
+            self.spill_data(index)
+
+    def _update_memory(self):
+        """Update memory accounting after the current data set has changed.
+
+        The current data set is loaded again if it has been spilled to disk and
+        is marked as most recently used, then other data sets are evicted if
+        the memory budget is exceeded.
+        """
+        dataset = self.current
+        if dataset is not None:
+            if dataset["spilled"]:
+                for key in ("raw", "epochs"):
+                    if dataset[key] is not None:
+                        dataset[key].load_data()
+                dataset["spilled"] = False
+            dataset["buffers"] = None
+            self._n_accessed += 1
+            dataset["accessed"] = self._n_accessed
+        self.evict()
+
     @property
     def names(self):
         """Return list of all data set names."""
@@ -93,16 +232,29 @@ class Model:
 
     @property
     def nbytes(self):
-        """Return size (in bytes) of all data sets."""
-        sum = 0
+        """Return size (in bytes) of all data sets.
+
+        Buffers shared between data sets are only counted once.
+        """
+        buffers = {}
         for item in self.data:
-            if item["raw"]:
-                sum += item["raw"].get_data().nbytes
-            elif item["epochs"]:
-                sum += item["epochs"].get_data().nbytes
-            elif item["evoked"]:
-                sum += item["evoked"].data.nbytes
-        return sum
+            buffers.update(self._buffers(item))
+        return sum(buffers.values())
+
+    def _buffers(self, dataset):
+        """Return the sizes of the memory buffers of a data set.
+
+        Arrays are cached in the data set (as weak references, so that ids of
+        freed arrays are never used) until it is modified through the model.
+        """
+        cached = dataset["buffers"]
+        arrays = {} if cached is None else {key: ref() for key, ref
+                                             in cached.items()}
+        if cached is None or any(array is None for array in arrays.values()):
+            arrays = dataset_buffers(dataset)
+            dataset["buffers"] = {key: weakref.ref(array)
+                                  for key, array in arrays.items()}
+        return {key: array.nbytes for key, array in arrays.items()}
 
     @property
     def current(self):
@@ -114,6 +266,7 @@ class Model:
 
     @current.setter
     def current(self, value):
+        value["buffers"] = None
         self.data[self.index] = value
 
     def __len__(self):
@@ -121,8 +274,19 @@ class Model:
         return len(self.data)
 
     @data_changed
-    def load(self, fname):
-        """Load data set from file."""
+    def load(self, fname, preload=True):
+        """Load data set from file.
+
+        Parameters
+        ----------
+        fname : str
+            File name.
+        preload : bool | str
+            If True, load all data into memory. If False, the data set only
+            holds a reference to the file and samples are read from disk when
+            needed (operations that modify the data load it on demand). If a
+            string, data is loaded into a memory-mapped file with this name.
+        """
         name, ext = splitext(split(fname)[-1])
         ftype = ext[1:].upper()
         montage = None
@@ -131,25 +295,26 @@ class Model:
             raise ValueError("File format {} is not supported.".format(ftype))
 
         if ext.lower() in [".edf", ".bdf"]:
-            raw = mne.io.read_raw_edf(fname, preload=True)
+            raw = mne.io.read_raw_edf(fname, preload=preload)
             self.history.append(
-                "raw = mne.io.read_raw_edf('{}', preload=True)".format(fname))
+                "raw = mne.io.read_raw_edf('{}', preload={!r})"
+                .format(fname, preload))
         elif ext in [".fif"]:
             try:
-                raw = mne.io.read_raw_fif(fname, preload=True)
+                raw = mne.io.read_raw_fif(fname, preload=preload)
                 montage = eeg_to_montage(raw)
                 self.history.append(
                     "raw = mne.io.read_raw_fif('{}', ".format(fname)
-                    + "preload=True)")
+                    + "preload={!r})".format(preload))
             except ValueError:
                 raw = None
                 try:
-                    epochs = mne.read_epochs(fname, preload=True)
+                    epochs = mne.read_epochs(fname, preload=bool(preload))
                     evoked = None
                     montage = eeg_to_montage(epochs)
                     self.history.append(
-                        "epochs = mne.read_epochs('{}', preload=True)"
-                        .format(fname))
+                        "epochs = mne.read_epochs('{}', preload={!r})"
+                        .format(fname, bool(preload)))
                 except ValueError:
                     evoked = mne.read_evokeds(fname)
                     epochs = None
@@ -159,26 +324,39 @@ class Model:
                         .format(fname))
 
         elif ext in [".vhdr"]:
-            raw = mne.io.read_raw_brainvision(fname, preload=True)
+            raw = mne.io.read_raw_brainvision(fname, preload=preload)
             self.history.append(
-                "raw = mne.io.read_raw_brainvision('{}',  preload=True)"
-                .format(fname))
+                "raw = mne.io.read_raw_brainvision('{}', preload={!r})"
+                .format(fname, preload))
         elif ext in [".set"]:
-            raw = mne.io.read_raw_eeglab(fname, preload=True)
+            raw = mne.io.read_raw_eeglab(fname, preload=preload)
             self.history.append(
-                "raw = mne.io.read_raw_eeglab('{}', preload=True)"
-                .format(fname))
+                "raw = mne.io.read_raw_eeglab('{}', preload={!r})"
+                .format(fname, preload))
         elif ext in [".sef"]:
             from .utils.read import read_sef
-            raw = read_sef(fname)
-            raw.load_data()
+            raw = read_sef(fname, preload=preload)
             self.history.append(
-                "raw = read_sef'{}', preload=True)".format(fname))
+                "raw = read_sef('{}', preload={!r})".format(fname, preload))
 
         self.insert_data(defaultdict(lambda: None, name=name, fname=fname,
                                      ftype=ftype, raw=raw, epochs=epochs,
                                      isApplied=False, montage=montage))
 
+    def _preload(self, inst, name):
+        """Load lazily opened data into memory before modifying it."""
+        if not getattr(inst, "preload", True):
+            inst.load_data()
+            self.history.append("{}.load_data()".format(name))
+
+    def _writable(self, inst, name):
+        """Load data and copy it if shared before modifying it in place."""
+        self._preload(inst, name)
+        _unshare(inst)
+        for dataset in self.data:
+            if any(dataset[key] is inst for key in DATA_KEYS):
+                dataset["buffers"] = None
+
     @data_changed
     def find_events(self, stim_channel, consecutive=True, initial_event=True,
                     uint_cast=True, min_duration=0, shortest_event=0):
@@ -218,13 +396,8 @@ class Model:
             elif ext == ".vhdr":
                 if self.current["raw"].info["bads"] != []:
                     self.export_bads(join(split(fname)[0], name + "_bads.csv"))
-                    raw_to_save = self.current["raw"].copy()
-                    raw_to_save.info["bads"] = []
-                    write_raw_brainvision(
-                        raw_to_save, fname)
-                else:
-                    write_raw_brainvision(
-                        self.current["raw"], fname)
+                # bad channels are exported as well (listed in the csv file)
+                write_raw_brainvision(self.current["raw"], fname, exclude=())
         elif self.current["epochs"]:
             if ext == ".fif":
                 self.current["epochs"].save(fname)
@@ -365,7 +538,6 @@ class Model:
                    "present in the data: " + ",".join(unknown))
             self.current["raw"].info["bads"] += known
             self.history.append(('raw.info["bads"] += {}').format(known))
-            self.view.data_changed()
             raise LabelsNotFoundError(msg)
         else:
             self.current["raw"].info["bads"] += bads
@@ -509,6 +681,8 @@ class Model:
             reference = ",".join(reference)
 
         size_disk = f"{getsize(fname) / 1024 ** 2:.2f} MB" if fname else "-"
+        size_memory = sum(self._buffers(self.current).values())
+        size_memory = f"{size_memory / 1024 ** 2:.2f} MB"
 
         if ica is not None:
             method = ica.method.title()
@@ -541,8 +715,8 @@ class Model:
                 "File name": fname if fname else "-",
                 "File type": ftype if ftype else "-",
                 "Size on disk": size_disk,
-                "Size in memory": "{:.2f} MB".format(
-                    raw.get_data().nbytes / 1024**2),
+                "Size in memory": (size_memory if raw.preload
+                                   else "- (not loaded)"),
                 "Data type": "MNE Raw",
                 "Channels": "{} (".format(nchan) + ", ".join(
                     [" ".join([str(v), k.upper()]) for k, v in chans]) + ")",
@@ -563,14 +737,14 @@ class Model:
                 "File name": fname if fname else "-",
                 "File type": ftype if ftype else "-",
                 "Size on disk": size_disk,
-                "Size in memory": "{:.2f} MB".format(
-                    epochs.get_data().nbytes / 1024**2),
+                "Size in memory": (size_memory if epochs.preload
+                                   else "- (not loaded)"),
                 "Data type": "MNE Epochs",
                 "Channels": "{} (".format(nchan) + ", ".join(
                     [" ".join([str(v), k.upper()]) for k, v in chans]) + ")",
                 "Samples": len(epochs.times),
                 "Sampling frequency": "{:.2f} Hz".format(epochs.info['sfreq']),
-                "Number of Epochs": str(epochs.get_data().shape[0]),
+                "Number of Epochs": str(len(epochs.events)),
                 "Length": "{:.2f} s".format(
                     epochs.times[-1] - epochs.times[0]),
                 "Reference": reference if reference else "-",
@@ -585,8 +759,7 @@ class Model:
                 "File name": fname if fname else "-",
                 "File type": ftype if ftype else "-",
                 "Size on disk": size_disk,
-                "Size in memory": "{:.2f} MB".format(
-                    evoked.data.nbytes / 1024**2),
+                "Size in memory": size_memory,
                 "Data type": "MNE Evoked",
                 "Channels": "{} (".format(nchan) + ", ".join(
                     [" ".join([str(v), k.upper()]) for k, v in chans]) + ")",
@@ -669,25 +842,24 @@ class Model:
             data = self.current["evoked"]
             type = 'evoked'
 
+        self._writable(data, type)
         data.filter(low, high)
         self.history.append(type + ".filter({}, {})".format(low, high))
         self.current["name"] += " (Filter {}-{})".format(low, high)
         if notch_freqs is not None and type == 'raw':
-            try:
-                data.notch_filter(notch_freqs)
-                self.history.append(
-                    type + ".notch_filter({})".format(notch_freqs))
-                self.current["name"] += " (Notch {})".format(notch_freqs)
-            except Exception as e:
-                show_error('Error', info=str(e))
+            data.notch_filter(notch_freqs)
+            self.history.append(type + ".notch_filter({})".format(notch_freqs))
+            self.current["name"] += " (Notch {})".format(notch_freqs)
 
     @data_changed
     def apply_ica(self):
         if self.current["raw"]:
+            self._writable(self.current["raw"], "raw")
             self.current["ica"].apply(self.current["raw"])
             self.history.append("ica.apply(inst=raw, exclude={})"
                                 .format(self.current["ica"].exclude))
         if self.current["epochs"]:
+            self._writable(self.current["epochs"], "epochs")
             self.current["ica"].apply(self.current["epochs"])
             self.history.append("ica.apply(inst=epochs, exclude={})"
                                 .format(self.current["ica"].exclude))
@@ -698,14 +870,32 @@ class Model:
     def interpolate_bads(self):
         if self.current["raw"]:
             if eeg_to_montage(self.current["raw"]) is not None:
+                self._writable(self.current["raw"], "raw")
                 self.current["raw"].interpolate_bads(reset_bads=True)
                 self.current["name"] += " (Interpolated)"
                 self.history.append("raw.interpolate_bads(reset_bads=True)")
         else:
             if eeg_to_montage(self.current["epochs"]) is not None:
+                self._writable(self.current["epochs"], "epochs")
                 self.current["epochs"].interpolate_bads(reset_bads=True)
                 self.history.append("epochs.interpolate_bads(reset_bads=True)")
 
+    @data_changed
+    def resample(self, sfreq):
+        """Resample data."""
+        if self.current["raw"]:
+            self._preload(self.current["raw"], "raw")
+            self.current["raw"].resample(sfreq)
+            self.history.append("raw.resample({})".format(sfreq))
+        elif self.current["epochs"]:
+            self._preload(self.current["epochs"], "epochs")
+            self.current["epochs"].resample(sfreq)
+            self.history.append("epochs.resample({})".format(sfreq))
+        elif self.current["evoked"]:
+            self.current["evoked"].resample(sfreq)
+            self.history.append("evoked.resample({})".format(sfreq))
+        self.current["name"] += " (resampled)"
+
     @data_changed
     def add_events(self):
         from mne import Annotations
@@ -747,6 +937,12 @@ class Model:
 
     @data_changed
     def set_reference(self, ref):
+        if self.current["raw"]:
+            self._writable(self.current["raw"], "raw")
+        elif self.current["epochs"]:
+            self._writable(self.current["epochs"], "epochs")
+        elif self.current["evoked"]:
+            self._writable(self.current["evoked"], "evoked")
         if ref == "average":
             self.current["reference"] = ref
             self.current["name"] += " (average ref)"
@@ -17,7 +17,6 @@ import numpy as np
 
 # TODO: include boundaries in MNE annotation as segment markers
 #       in write_raw_brainvision
-# TODO: expose support for different numeric formats
 # TODO: support export to vectorized data
 # TODO: allow arbitrary names for vmrk and eeg
 # TODO: epochs exporter using segment markers
@@ -33,8 +32,12 @@ supported_formats = {
 
 supported_orients = set(['multiplexed'])
 
+# number of time points written at once
+_block_size = 65536
 
-def write_raw_brainvision(raw, vhdr_fname, events=True):
+
+def write_raw_brainvision(raw, vhdr_fname, events=True,
+                          format='binary_float32', exclude='bads'):
     """Write raw data to BrainVision format.
 
     Parameters
@@ -47,6 +50,12 @@ def write_raw_brainvision(raw, vhdr_fname, events=True):
     events : boolean or ndarray
         If ndarry, events to write in marker file. Otherwise, boolean indicator
         to extract and write events from raw.
+    format : str
+        Numeric format of the data file, one of the keys of supported_formats.
+        With 'binary_int16', the resolution of each channel is chosen so that
+        its largest absolute value uses the full int16 range.
+    exclude : list of str | 'bads'
+        Channels to exclude (passed to mne.pick_types).
 
     Notes
     -----
@@ -65,16 +74,16 @@ def write_raw_brainvision(raw, vhdr_fname, events=True):
     produced by BrainProducts devices generally only contain EEG and a few 
     auxiliary channels. The stimulus channel is not exported as channel data, 
     but, in line with BrainVision convention, the events array can be exported to 
-    the vmrk file. Channels marked as bad are also not exported, in line with 
-    MNE's default behavior of generally ignoring bad channels. As the current 
+    the vmrk file. Channels marked as bad are also not exported by default, in
+    line with MNE's default behavior of generally ignoring bad channels. As the current 
     MNE readers do not do much with the channel-level annotations in the 
     vhdr file, it is not really desireable to depend on encoding channel-type 
     or "goodness" there. As such any information related to channel type or 
     badness is lost upon export. 
     
-    If you really want to export unsupported 
-    datatypes or bad channels, then create a copy, mark everything as good and 
-    of type 'eeg', and export. Be aware that the metadata will have to be 
+    If you really want to export bad channels, pass exclude=(). To export
+    unsupported datatypes, create a copy, mark everything of type 'eeg', and
+    export. Be aware that the metadata will have to be 
     corrected the next time the data is read. Other options are to use the 
     private member functions directly that write each of the constituent files 
     (understanding that their API is not guaranteed to be stable) or use the 
@@ -100,12 +109,54 @@ def write_raw_brainvision(raw, vhdr_fname, events=True):
     else:
         raise ValueError('events must be boolean or 3 x n_events ndarray.')   # noqa: E501
 
-    # eliminate the stim channel
-    raw = raw.copy().pick_types(eeg=True, eog=True, meg=True, misc=True)
+    _check_format('multiplexed', format)
+
+    # eliminate the stim channel, data is only read block by block later on
+    picks = mne.pick_types(raw.info, eeg=True, eog=True, meg=True, misc=True,
+                           exclude=exclude)
+    resolutions = _get_resolutions(raw, picks, format)
 
     _write_vmrk_file(vmrk_fname, eeg_fname, events)
-    _write_vhdr_file(vhdr_fname, vmrk_fname, eeg_fname, raw)
-    _write_bveeg_file(eeg_fname, raw)
+    _write_vhdr_file(vhdr_fname, vmrk_fname, eeg_fname, raw, picks,
+                     resolutions, format=format)
+    _write_bveeg_file(eeg_fname, raw, picks, resolutions, format=format)
+
+
+def _check_format(orientation, format):
+    """Check that orientation and numeric format are supported."""
+    if orientation.lower() not in supported_orients:
+        errmsg = ('Orientation {} not supported.'.format(orientation) +
+                  'Currently supported orientations are: ' +
+                  ', '.join(supported_orients))
+        raise ValueError(errmsg)
+
+    if format.lower() not in supported_formats:
+        errmsg = ('Data format {} not supported.'.format(format) +
+                  'Currently supported formats are: ' +
+                  ', '.join(supported_formats))
+        raise ValueError(errmsg)
+
+
+def _iter_blocks(raw, picks):
+    """Iterate over the picked data in blocks of time points."""
+    for start in range(0, raw.n_times, _block_size):
+        stop = min(start + _block_size, raw.n_times)
+        yield raw.get_data(picks, start, stop)
+
+
+def _get_resolutions(raw, picks, format='binary_float32'):
+    """Get the resolution of each channel in µV."""
+    if format.lower() != 'binary_int16':
+        # 0.1 µV is the resolution in the BV files this is being tested on
+        return np.full(len(picks), 0.1)
+
+    # use the full int16 range for the largest absolute value of each channel
+    maxabs = np.zeros(len(picks))
+    for data in _iter_blocks(raw, picks):
+        np.maximum(maxabs, np.abs(data).max(axis=1), out=maxabs)
+    resolutions = maxabs * 1e6 / np.iinfo(np.int16).max
+    resolutions[resolutions == 0] = 0.1  # flat channels
+    return resolutions
 
 
 def _write_vmrk_file(vmrk_fname, eeg_fname, events):
@@ -136,23 +187,12 @@ def _write_vmrk_file(vmrk_fname, eeg_fname, events):
                                                     events[r, 0]), file=fout)
 
 
-def _write_vhdr_file(vhdr_fname, vmrk_fname, eeg_fname, raw,
-                     orientation='multiplexed',
+def _write_vhdr_file(vhdr_fname, vmrk_fname, eeg_fname, raw, picks,
+                     resolutions, orientation='multiplexed',
                      format='binary_float32'):
     """Write BrainvVision header file."""
     fmt = format.lower()
-
-    if orientation.lower() not in supported_orients:
-        errmsg = ('Orientation {} not supported.'.format(orientation) +
-                  'Currently supported orientations are: ' +
-                  ', '.join(supported_orients))
-        raise ValueError(errmsg)
-
-    if fmt not in supported_formats:
-        errmsg = ('Data format {} not supported.'.format(format) +
-                  'Currently supported formats are: ' +
-                  ', '.join(supported_formats))
-        raise ValueError(errmsg)
+    _check_format(orientation, format)
 
     with codecs.open(vhdr_fname, 'w', encoding='utf-8') as fout:
         print(r'Brain Vision Data Exchange Header File Version 1.0', file=fout)  # noqa: E501
@@ -170,14 +210,14 @@ def _write_vhdr_file(vhdr_fname, vmrk_fname, eeg_fname, raw,
             print(r'Data orientation: MULTIPLEXED=ch1,pt1, ch2,pt1 ...', file=fout)  # noqa: E501
             print(r'DataOrientation=MULTIPLEXED', file=fout)
 
-        print(r'NumberOfChannels={}'.format(len(raw.ch_names)), file=fout)  # noqa: E501
+        print(r'NumberOfChannels={}'.format(len(picks)), file=fout)  # noqa: E501
         print(r'; Sampling interval in microseconds', file=fout)
         print(r'SamplingInterval={}'.format(float(1e6 / raw.info['sfreq'])), file=fout)  # noqa: E501
         print(r'', file=fout)
 
         if 'binary' in format.lower():
             print(r'[Binary Infos]', file=fout)
-            print(r'BinaryFormat={}'.format(supported_formats[format]), file=fout)  # noqa: E501
+            print(r'BinaryFormat={}'.format(supported_formats[fmt]), file=fout)  # noqa: E501
             print(r'', file=fout)
 
         print(r'[Channel Infos]', file=fout)
@@ -185,49 +225,40 @@ def _write_vhdr_file(vhdr_fname, vmrk_fname, eeg_fname, raw,
         print(r'; <Resolution in microvolts>,<Future extensions..', file=fout)
         print(r'; Fields are delimited by commas, some fields might be omitted (empty).', file=fout)  # noqa: E501
         print(r'; Commas in channel names are coded as "\1".', file=fout)
-        for i, ch in enumerate(raw.ch_names, start=1):
-            # not sure 0.1 µV is a sensible default resolution or if there is a
-            # good way to determine this based on the values in the array, but
-            #  this is the resolution in the BV files this is being tested on
-            print(r'Ch{}={},,0.1'.format(i, ch), file=fout)
+        for i, (pick, res) in enumerate(zip(picks, resolutions), start=1):
+            print(r'Ch{}={},,{!r}'.format(i, raw.ch_names[pick], float(res)),
+                  file=fout)
 
         print(r'', file=fout)
         print(r'[Comment]', file=fout)
         print(r'', file=fout)
 
 
-def _write_bveeg_file(eeg_fname, raw, orientation='multiplexed',
-                      format='binary_float32'):
+def _write_bveeg_file(eeg_fname, raw, picks, resolutions,
+                      orientation='multiplexed', format='binary_float32'):
     """Write BrainVision data file."""
     fmt = format.lower()
-
-    if orientation.lower() not in supported_orients:
-        errmsg = ('Orientation {} not supported.'.format(orientation) +
-                  'Currently supported orientations are: ' +
-                  ', '.join(supported_orients))
-        raise ValueError(errmsg)
-
-    if fmt not in supported_formats:
-        errmsg = ('Data format {} not supported.'.format(format) +
-                  'Currently supported formats are: ' +
-                  ', '.join(supported_formats))
-        raise ValueError(errmsg)
+    _check_format(orientation, format)
 
     if fmt[:len('binary')] == 'binary':
-        dtype = np.dtype(format.lower()[len('binary') + 1:])
+        dtype = np.dtype(fmt[len('binary') + 1:])
     else:
         errmsg = 'Cannot map data format {} to NumPy dtype'.format(format)
         raise ValueError(errmsg)
 
-    # ndarry.tofile uses column-major order
-    # the multiplicative factor here is dependent on resolution
-    # for 0.1 µV, this works out to 1e7
+    # data is in V and resolutions in µV
+    # for 0.1 µV, the multiplicative factor works out to 1e7
+    scale = (1e6 / np.asarray(resolutions))[:, np.newaxis]
     # multiplexed:
-    #    channel changes fast and channel is first axis -> C order
+    #    channel changes fast -> write transposed blocks in C order
     with open(eeg_fname, 'wb') as fout:
-        # skip the stim channel and scale
-        data = raw._data * 1e7
-        fout.write(data.astype(dtype=dtype).ravel(order='F').tobytes())
+        for data in _iter_blocks(raw, picks):
+            data *= scale
+            if dtype.kind == 'i':
+                info = np.iinfo(dtype)
+                np.rint(data, out=data)
+                np.clip(data, info.min, info.max, out=data)
+            data.T.astype(dtype.newbyteorder('<')).tofile(fout)
 
 
 def _anonymize_bv(vmrk_fname):
@@ -0,0 +1,12 @@
+import pytest
+
+import mnelab.utils.cache
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path_factory, monkeypatch):
+    """Keep the caches of each test in a temporary folder."""
+    path = tmp_path_factory.mktemp("cache")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(path))
+    monkeypatch.setattr(mnelab.utils.cache, "_psd_cache", None)
+    return path
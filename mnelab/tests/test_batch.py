@@ -0,0 +1,137 @@
+import os
+import json
+
+import numpy as np
+import mne
+
+from mnelab.batch.app.aggregate import RunningStats
+from mnelab.batch.app.engine import GroupAverages, Manifest, run_batch
+from mnelab.batch.cli import main
+
+
+def _make_files(tmpdir, n_files):
+    """Save small raw data sets."""
+    info = mne.create_info(["Fz", "Cz", "Pz", "Oz"], 256., "eeg")
+    fnames = []
+    for i in range(n_files):
+        data = np.random.RandomState(i).randn(4, 2560) * 1e-5
+        fname = str(tmpdir.join("sub{}_raw.fif".format(i)))
+        mne.io.RawArray(data, info).save(fname)
+        fnames.append(fname)
+    return fnames
+
+
+def test_run_batch(tmpdir):
+    """Test if all files are processed in parallel and saved."""
+    fnames = _make_files(tmpdir, 3)
+    out = tmpdir.mkdir("out")
+    pipeline = dict(save_path=str(out), filter=("1", "40"), resample=None,
+                    tfr=None, psd=dict(method="welch", fmin=1., fmax=40.,
+                                       tmin=None, tmax=None, n_fft=256,
+                                       n_per_seg=256, n_overlap=0))
+    results = list(run_batch(fnames, pipeline, n_jobs=2))
+    assert sorted(index for index, _, _ in results) == [0, 1, 2]
+    for index, fname, result in results:
+        assert fname == fnames[index]
+        assert result["type"] == "raw"
+        assert result["psd_stats"].mean.shape[0] == 4
+        assert result["psd_stats"].count == 1
+        assert (result["psd"] is not None) == (index == 0)
+        assert not any("Error" in line for line in result["log"])
+        name = "sub{}_raw".format(index)
+        assert os.path.isfile(str(out.join(name + "_psd.h5")))
+        assert os.path.isfile(str(out.join(name + "_filtered_1.0-40.0.fif")))
+
+
+def test_run_batch_abort(tmpdir):
+    """Test if files are no longer processed when poll returns False."""
+    fnames = _make_files(tmpdir, 3)
+    pipeline = dict(save_path=str(tmpdir), filter=None, resample=None,
+                    tfr=None, psd=None)
+    results = list(run_batch(fnames, pipeline, n_jobs=1, poll=lambda: False))
+    assert len(results) < 3
+
+
+def test_running_stats(tmpdir):
+    """Test if merged running statistics match those of all arrays."""
+    x = np.random.RandomState(0).randn(10, 4, 5)
+    first, second = RunningStats(), RunningStats()
+    for array in x[:3]:
+        first.update(array)
+    for array in x[3:]:
+        second.merge(RunningStats.from_array(array))
+    stats = RunningStats().merge(first).merge(second)
+    assert stats.count == 10
+    assert np.allclose(stats.mean, x.mean(axis=0))
+    assert np.allclose(stats.variance, x.var(axis=0, ddof=1))
+
+    fname = str(tmpdir.join("stats.h5"))
+    stats.save_hdf5(fname)
+    stats = RunningStats.read_hdf5(fname)
+    assert stats.count == 10
+    assert np.allclose(stats.variance, x.var(axis=0, ddof=1))
+
+
+def test_run_batch_resume(tmpdir):
+    """Test if unchanged files are skipped when a batch is run again."""
+    fnames = _make_files(tmpdir, 2)
+    out = tmpdir.mkdir("out")
+    pipeline = dict(save_path=str(out), filter=None, resample=None, tfr=None,
+                    psd=dict(method="welch", fmin=1., fmax=40., tmin=None,
+                             tmax=None, n_fft=256, n_per_seg=256,
+                             n_overlap=0))
+    first = {index: result for index, _, result
+             in run_batch(fnames, pipeline, manifest=Manifest(str(out)))}
+    assert not any(result["skipped"] for result in first.values())
+
+    os.utime(fnames[0])  # touched, but content has not changed
+    raw = mne.io.read_raw_fif(fnames[1], preload=True).crop(0, 5)
+    raw.save(fnames[1], overwrite=True)
+    second = {index: result for index, _, result
+              in run_batch(fnames, pipeline, manifest=Manifest(str(out)))}
+    assert second[0]["skipped"] and not second[1]["skipped"]
+    assert np.allclose(second[0]["psd_stats"].mean, first[0]["psd"].data)
+
+    pipeline["psd"]["fmax"] = 30.
+    third = run_batch(fnames, pipeline, manifest=Manifest(str(out)))
+    assert not any(result["skipped"] for _, _, result in third)
+
+
+def test_resume_tfr_average(tmpdir):
+    """Test if the TFR average is saved when all files are resumed."""
+    info = mne.create_info(["Fz", "Cz", "Pz", "Oz"], 256., "eeg")
+    fnames = []
+    for i in range(2):
+        data = np.random.RandomState(i).randn(5, 4, 512) * 1e-5
+        fnames.append(str(tmpdir.join("sub{}-epo.fif".format(i))))
+        mne.EpochsArray(data, info).save(fnames[-1])
+    out = tmpdir.mkdir("out")
+    pipeline = dict(save_path=str(out), filter=None, resample=None, psd=None,
+                    tfr=dict(method="multitaper", fmin=4., fmax=20.,
+                             freq_step=2., time_window=None, n_cycles=3.))
+    list(run_batch(fnames, pipeline, manifest=Manifest(str(out))))
+    averages = GroupAverages()
+    with open(str(tmpdir.join("log.txt")), "w") as f:
+        for _, _, result in run_batch(fnames, pipeline,
+                                      manifest=Manifest(str(out))):
+            assert result["skipped"]
+            averages.add(result, f)
+        _, mean_tfr = averages.save(str(out), f)
+    assert mean_tfr is not None
+    tfr = mne.time_frequency.read_tfrs(str(out.join("mean_tfr.h5")))[0]
+    assert tfr.data.shape == mean_tfr.tfr.data.shape
+
+
+def test_cli(tmpdir):
+    """Test if the command line runs the pipeline of a JSON file."""
+    fnames = _make_files(tmpdir, 2)
+    spec = str(tmpdir.join("pipeline.json"))
+    with open(spec, "w") as f:
+        json.dump(dict(filter=dict(low=1, high=40),
+                       psd=dict(method="welch", fmin=1, fmax=40, n_fft=256,
+                                n_per_seg=256, n_overlap=0)), f)
+    out = str(tmpdir.join("out"))
+    assert main([spec] + fnames + ["-o", out, "-j", "2"]) == 0
+    stats = RunningStats.read_hdf5(os.path.join(out, "group_psd_stats.h5"))
+    assert stats.count == 2
+    assert os.path.isfile(os.path.join(out, "manifest.json"))
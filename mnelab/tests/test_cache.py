@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import mne
+
+import mnelab.utils.cache
+from mnelab.utils.cache import DiskCache, fingerprint
+from mnelab.tfr.backend.raw_psd import RawPSD
+from mnelab.tfr.backend.epochs_psd import EpochsPSD
+
+
+def test_disk_cache_lru(tmpdir):
+    """Test if least recently used results are removed above the limit."""
+    cache = DiskCache(str(tmpdir))
+    cache.put("a", data=np.zeros(100))
+    cache.max_size = 3.5 * tmpdir.join("a.npz").size()  # three results
+    for key in "abc":
+        cache.put(key, data=np.zeros(100))
+        os.utime(str(tmpdir.join(key + ".npz")), (0, ord(key)))
+    cache.get("a")  # now most recently used
+    cache.put("d", data=np.zeros(100))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("d") is not None
+
+
+def test_fingerprint():
+    """Test if fingerprints change with data modified in place."""
+    data = np.random.RandomState(0).randn(4, 100000)
+    key = fingerprint(data[1])
+    assert fingerprint(data[1].copy()) == key
+    data[1, 1] += 1
+    assert fingerprint(data[1]) != key
+    assert fingerprint(data[1], "b") != fingerprint(data[1], "a")
+
+
+def test_psd_cache(tmpdir, monkeypatch):
+    """Test if a PSD is computed once for the same data and parameters."""
+    cache = DiskCache(str(tmpdir))
+    monkeypatch.setattr(mnelab.utils.cache, "_psd_cache", cache)
+    info = mne.create_info(["Fz", "Cz", "Pz", "Oz"], 256., "eeg")
+    raw = mne.io.RawArray(np.random.RandomState(0).randn(4, 2560), info)
+
+    psd = RawPSD(raw, fmin=1, fmax=40, method="welch", n_fft=256)
+    assert len(tmpdir.listdir()) == 4  # one result per channel
+    cached = RawPSD(raw, fmin=1, fmax=40, method="welch", n_fft=256)
+    assert len(tmpdir.listdir()) == 4
+    assert np.array_equal(psd.data, cached.data)
+
+    raw._data[0] += 1  # only this channel is computed again
+    changed = RawPSD(raw, fmin=1, fmax=40, method="welch", n_fft=256)
+    assert len(tmpdir.listdir()) == 5
+    assert np.array_equal(psd.data[1:], changed.data[1:])
+    RawPSD(raw, fmin=1, fmax=30, method="welch", n_fft=256)
+    assert len(tmpdir.listdir()) == 9
+
+
+def test_psd_cache_modified(tmpdir, monkeypatch):
+    """Test if a PSD is computed again when any value has been modified."""
+    cache = DiskCache(str(tmpdir))
+    monkeypatch.setattr(mnelab.utils.cache, "_psd_cache", cache)
+    info = mne.create_info(["Fz", "Cz"], 256., "eeg")
+    data = np.random.RandomState(0).randn(3, 2, 50000)
+    epochs = mne.EpochsArray(data, info)
+
+    psd = EpochsPSD(epochs, fmin=1, fmax=40, method="welch_fast")
+    epochs._data[1, 1, 0] += 1  # not part of a strided sample of the values
+    changed = EpochsPSD(epochs, fmin=1, fmax=40, method="welch_fast")
+    assert len(tmpdir.listdir()) == 3  # channel Cz is computed again
+    assert not np.array_equal(psd.data[:, 1], changed.data[:, 1])
+
+
+def test_psd_picks(tmpdir, monkeypatch):
+    """Test if channels added to the picks are computed and ordered."""
+    cache = DiskCache(str(tmpdir))
+    monkeypatch.setattr(mnelab.utils.cache, "_psd_cache", cache)
+    info = mne.create_info(["Fz", "Cz", "Pz", "Oz"], 256., "eeg")
+    data = np.random.RandomState(0).randn(3, 4, 512)
+    epochs = mne.EpochsArray(data, info)
+
+    psd = EpochsPSD(epochs, fmin=1, fmax=40, method="multitaper",
+                    picks=[1, 3])
+    assert len(tmpdir.listdir()) == 2
+    full = EpochsPSD(epochs, fmin=1, fmax=40, method="multitaper",
+                     picks=[3, 0, 1, 2])
+    assert len(tmpdir.listdir()) == 4
+    assert np.allclose(full.data[:, [2, 0]], psd.data)
+    expected, _ = mne.time_frequency.psd_multitaper(
+        epochs, fmin=1, fmax=40, bandwidth=4., normalization="full")
+    assert np.allclose(full.data, expected[:, [3, 0, 1, 2]])
@@ -0,0 +1,59 @@
+import numpy as np
+import mne
+
+from mnelab.utils.read import read_sef
+from mnelab.utils.export import export_sef, write_sef
+from mnelab.philistine.io import write_raw_brainvision
+
+
+def _make_raw():
+    """Create a small raw data set."""
+    info = mne.create_info(["Fz", "Cz", "Pz", "Oz"], 256., "eeg")
+    data = np.random.RandomState(42).randn(4, 1000) * 1e-5
+    return mne.io.RawArray(data, info)
+
+
+def test_sef_roundtrip(tmpdir):
+    """Test if exported SEF files are read back lazily and correctly."""
+    raw = _make_raw()
+    fname = str(tmpdir.join("test.sef"))
+    export_sef(fname, raw)
+
+    sef = read_sef(fname)
+    assert not sef.preload
+    assert sef.ch_names == raw.ch_names
+    assert sef.n_times == raw.n_times
+    expected = raw.get_data().astype(np.float32)
+    assert np.allclose(sef.get_data(picks=[1, 3], start=100, stop=200),
+                       expected[[1, 3], 100:200])
+    sef.load_data()
+    assert np.allclose(sef.get_data(), expected)
+
+
+def test_write_sef_blocks(tmpdir):
+    """Test if writing in blocks yields the same file as a single block."""
+    data = _make_raw().get_data()
+    ch_names = ["Fz", "Cz", "Pz", "Oz"]
+    fnames = [str(tmpdir.join(name)) for name in ("a.sef", "b.sef")]
+    for fname, block_size in zip(fnames, (7, 10000)):
+        write_sef(fname, ch_names, 256., data.shape[1],
+                  lambda start, stop: data[:, start:stop],
+                  block_size=block_size)
+    with open(fnames[0], "rb") as f1, open(fnames[1], "rb") as f2:
+        assert f1.read() == f2.read()
+    assert np.allclose(read_sef(fnames[0]).get_data(), data)
+
+
+def test_brainvision_int16(tmpdir):
+    """Test if BrainVision int16 export uses per-channel resolutions."""
+    raw = _make_raw()
+    raw._data[0] *= 100
+    raw.info["bads"] = ["Cz"]
+    fname = str(tmpdir.join("test.vhdr"))
+    write_raw_brainvision(raw, fname, format="binary_int16")
+
+    bv = mne.io.read_raw_brainvision(fname, preload=True)
+    assert bv.ch_names == ["Fz", "Pz", "Oz"]
+    expected = raw.get_data(picks=[0, 2, 3])
+    maxabs = np.abs(expected).max(axis=1, keepdims=True)
+    assert np.all(np.abs(bv.get_data() - expected) <= maxabs / 32767)
@@ -0,0 +1,60 @@
+import time
+
+from mnelab.utils.jobs import JobExecutor
+
+
+def test_job_order(qtbot):
+    """Test if jobs run in order and report progress."""
+    jobs = JobExecutor()
+    results, progress = [], []
+    jobs.progress.connect(lambda done, total: progress.append((done, total)))
+
+    def work(i):
+        time.sleep(0.01)
+        results.append(i)
+        return i
+
+    with qtbot.waitSignal(jobs.finished) as blocker:
+        for i in range(3):
+            job = jobs.submit("Job {}".format(i), work, i)
+        qtbot.waitUntil(lambda: not jobs.busy)
+    assert results == [0, 1, 2]
+    assert job.result == 2
+    assert progress[-1] == (3, 3)
+    assert blocker.args[0].result in (0, 1, 2)
+
+
+def test_job_cancel(qtbot):
+    """Test if queued jobs are cancelled and errors are reported."""
+    jobs = JobExecutor()
+    results = []
+
+    def fail():
+        time.sleep(0.1)
+        raise ValueError("failed")
+
+    with qtbot.waitSignal(jobs.failed) as blocker:
+        jobs.submit("Failing", fail)
+        jobs.submit("Appending", results.append, 1)
+        jobs.cancel()
+    assert isinstance(blocker.args[1], ValueError)
+    qtbot.waitUntil(lambda: not jobs.busy)
+    assert results == []
+
+
+def test_job_depends_on(qtbot):
+    """Test if jobs depending on a failed job are skipped."""
+    jobs = JobExecutor()
+    results = []
+
+    def fail():
+        time.sleep(0.1)
+        raise ValueError("failed")
+
+    failing = jobs.submit("Failing", fail)
+    skipped = jobs.submit("Appending", results.append, 1, depends_on=failing)
+    jobs.submit("Appending", results.append, 2, depends_on=skipped)
+    jobs.submit("Appending", results.append, 3)
+    qtbot.waitUntil(lambda: not jobs.busy)
+    assert results == [3]
+    assert skipped.skipped and skipped.error is None
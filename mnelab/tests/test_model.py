@@ -0,0 +1,79 @@
+import numpy as np
+import mne
+
+from mnelab import Model
+
+
+class _View:
+    """Minimal view which counts data changes."""
+    def __init__(self):
+        self.changes = 0
+
+    def data_changed(self):
+        self.changes += 1
+
+
+def test_nbytes(tmpdir):
+    """Test if memory is accounted without reading the data."""
+    info = mne.create_info(["Fz", "Cz", "Pz", "Oz"], 256., "eeg")
+    raw = mne.io.RawArray(np.zeros((4, 1000)), info)
+    fname = str(tmpdir.join("test_raw.fif"))
+    raw.save(fname)
+
+    model = Model()
+    model.view = _View()
+    model.load(fname, preload=False)
+    assert model.nbytes < raw._data.nbytes
+    model._writable(model.current["raw"], "raw")  # loads data
+    assert model.nbytes >= raw._data.nbytes
+    model.duplicate_data()  # data is shared
+    assert model.nbytes < 2 * raw._data.nbytes
+    model.filter(1, 40, None)  # data is copied before filtering
+    assert model.nbytes >= 2 * raw._data.nbytes
+    model.current["raw"]._data = np.zeros((4, 3000))  # old array is freed
+    assert model.nbytes >= 4 * raw._data.nbytes
+
+
+def test_copy_on_write(tmpdir):
+    """Test if duplicated data sets share data until it is modified."""
+    info = mne.create_info(["Fz", "Cz", "Pz", "Oz"], 256., "eeg")
+    data = np.random.RandomState(42).randn(4, 1000) * 1e-5
+    fname = str(tmpdir.join("test_raw.fif"))
+    mne.io.RawArray(data, info).save(fname)
+
+    model = Model()
+    model.view = _View()
+    model.load(fname)
+    original = model.current["raw"]
+    model.duplicate_data()
+    assert model.current["raw"]._data is original._data
+    model.filter(1, 40, None)
+    assert model.current["raw"]._data is not original._data
+    assert np.allclose(original.get_data(), data, atol=1e-12)
+
+    model.spill_data(0)
+    spilled = model.data[0]["raw"]
+    assert not spilled.preload
+    assert np.allclose(spilled.get_data(), data, atol=1e-12)
+
+
+def test_evict(tmpdir):
+    """Test if least recently used data sets are spilled to disk."""
+    info = mne.create_info(["Fz", "Cz", "Pz", "Oz"], 256., "eeg")
+    data = np.random.RandomState(42).randn(4, 1000) * 1e-5
+    fname = str(tmpdir.join("test_raw.fif"))
+    mne.io.RawArray(data, info).save(fname)
+
+    model = Model()
+    model.view = _View()
+    model.load(fname)
+    nbytes = model.nbytes
+    model.load(fname)
+    model.load(fname)
+    model.select(0)  # data set 1 is now least recently used
+    model.memory_budget = 2.5 * nbytes
+    model.evict()
+    assert [item["raw"].preload for item in model.data] == [True, False, True]
+    model.select(1)  # reloaded, data set 2 is spilled
+    assert [item["raw"].preload for item in model.data] == [True, True, False]
+    assert np.allclose(model.current["raw"].get_data(), data, atol=1e-12)
@@ -0,0 +1,47 @@
+import multiprocessing as mp
+from multiprocessing.shared_memory import SharedMemory
+import os
+import time
+
+import numpy as np
+import pytest
+
+from mnelab.utils.pool import (apply_async, get_pool, restart_pool,
+                               shutdown_pool)
+
+
+def _slow_copy(x):
+    time.sleep(0.5)
+    return x.copy()
+
+
+def test_pool_reuse():
+    """Test if the worker process is reused until the pool is restarted."""
+    pid = get_pool().apply(os.getpid)
+    assert get_pool().apply(os.getpid) == pid
+    assert restart_pool().apply(os.getpid) != pid
+    shutdown_pool()
+
+
+def test_shared_memory_release():
+    """Test if shared memory is freed once it is no longer used."""
+    x = np.arange(2 ** 18, dtype=float)  # passed in shared memory
+    res = apply_async(_slow_copy, (x,))
+    name = res._inputs[0].name
+    with pytest.raises(mp.TimeoutError):
+        res.get(timeout=0.01)
+    SharedMemory(name=name).close()  # still used by the running task
+    assert np.array_equal(res.get(), x)
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=name)
+
+    # result of a dropped task
+    res = apply_async(_slow_copy, (x,))
+    res._result.wait()
+    name = res._result.get().name
+    restart_pool()
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=name)
+    with pytest.raises(mp.TimeoutError):
+        res.get(timeout=0.01)
+    shutdown_pool()
@@ -0,0 +1,164 @@
+import os
+
+import h5py
+import numpy as np
+import mne
+import pytest
+from mne.externals.h5io import write_hdf5
+
+from mnelab.tfr.backend.avg_epochs_tfr import AvgEpochsTFR
+from mnelab.tfr.backend.epochs_psd import EpochsPSD
+from mnelab.tfr.backend.results import (LazyArray, ResultStore, read_results,
+                                        write_results)
+
+
+def _epochs():
+    names = ["Fz", "Cz", "Pz", "Oz", "C3", "C4", "P3", "P4", "O1", "O2",
+             "F3", "F4"]  # more than 10 channels to check the order
+    info = mne.create_info(names, 100., "eeg", montage="standard_1020")
+    data = np.random.RandomState(0).randn(4, len(names), 300)
+    return mne.EpochsArray(data, info, verbose=False)
+
+
+def test_psd_layout(tmpdir):
+    """Test if a PSD is saved as one chunked and compressed dataset."""
+    epochs = _epochs()
+    psd = EpochsPSD(epochs, fmin=1, fmax=40, method="welch", n_fft=128)
+    fname = str(tmpdir.join("psd.hdf"))
+    psd.save_hdf5(fname)
+    with h5py.File(fname, "r") as f:
+        assert f["data"].shape == psd.data.shape
+        assert f["data"].compression == "gzip"
+        assert f["data"].chunks is not None
+
+    loaded = EpochsPSD().init_from_hdf(fname)
+    assert loaded.info["ch_names"] == epochs.ch_names
+    assert np.array_equal(loaded.data, psd.data)
+    assert np.array_equal(loaded.freqs, psd.freqs)
+    assert (loaded.method, loaded.n_fft) == ("welch", 128)
+
+
+def test_band_mean(tmpdir):
+    """Test if band means of a PSD are those of its data."""
+    psd = EpochsPSD(_epochs(), fmin=1, fmax=40, method="welch", n_fft=128)
+    fname = str(tmpdir.join("psd.hdf"))
+    psd.save_hdf5(fname)
+    with EpochsPSD().init_from_hdf(fname, lazy=True) as lazy:
+        for inst in (psd, lazy):
+            assert np.allclose(inst.band_mean(2, 9, 1),
+                               psd.data[1, :, 2:9].mean(axis=-1))
+            assert np.allclose(inst.band_mean(2, 9),
+                               psd.data[:, :, 2:9].mean(axis=(0, 2)))
+        assert isinstance(lazy.data, LazyArray)
+
+
+def test_channel_types(tmpdir):
+    """Test if channel types are stored as codes and read back."""
+    ch_types = ["eeg", "eog", "stim", "mag", "grad", "eeg"]
+    info = mne.create_info(["C{}".format(i) for i in range(6)], 100.,
+                           ch_types)
+    fname = str(tmpdir.join("psd.hdf"))
+    write_results(fname, "raw_psd", np.ones((6, 3)), np.arange(3.), info,
+                  "welch")
+    with h5py.File(fname, "r") as f:
+        assert f["ch_types"].dtype == np.uint8
+    results = read_results(fname)
+    assert results["ch_types"] == ch_types
+    assert results["ch_names"] == info["ch_names"]
+
+
+def test_lazy_tfr(tmpdir):
+    """Test if slices of a TFR opened lazily are read from the file."""
+    tfr = AvgEpochsTFR(_epochs(), np.arange(5., 15.), 3., method="morlet")
+    fname = str(tmpdir.join("tfr.hdf"))
+    tfr.save_hdf5(fname)
+
+    lazy = AvgEpochsTFR().init_from_hdf(fname, lazy=True)
+    assert isinstance(lazy.tfr.data, LazyArray)
+    assert lazy.tfr.data.shape == tfr.tfr.data.shape
+    data = tfr.tfr.data
+    for index in [(3,), (slice(None), 2), (Ellipsis, -1), ([7, 0, 7], 1),
+                  (slice(None), [], slice(2, 5)), (slice(None, None, -2),)]:
+        assert np.array_equal(lazy.tfr.data[index], data[index])
+    assert np.array_equal(np.asarray(lazy.itc.data), tfr.itc.data)
+
+    # the file can be read while it is open, and is released by close
+    assert np.array_equal(read_results(fname)["data"], data)
+    lazy.close()
+    assert lazy.store.closed
+    tfr.save_hdf5(fname)
+
+
+def test_result_store(tmpdir):
+    """Test if a result store can no longer be read once closed."""
+    psd = EpochsPSD(_epochs(), fmin=1, fmax=40, method="welch", n_fft=128)
+    fname = str(tmpdir.join("psd.hdf"))
+    psd.save_hdf5(fname)
+    with ResultStore(fname) as store, ResultStore(fname) as other:
+        assert np.array_equal(store.read(lazy=True)["data"][1], psd.data[1])
+        assert np.array_equal(other.read()["freqs"], psd.freqs)
+    with pytest.raises(ValueError):
+        store.read()
+
+
+def test_replace_open_file(tmpdir, monkeypatch):
+    """Test if a file which cannot be replaced is reported and kept."""
+    psd = EpochsPSD(_epochs(), fmin=1, fmax=40, method="welch", n_fft=128)
+    fname = str(tmpdir.join("psd.hdf"))
+    psd.save_hdf5(fname)
+
+    def replace(src, dst):  # as on Windows while dst is open
+        raise PermissionError(13, "Access is denied")
+
+    monkeypatch.setattr(os, "replace", replace)
+    with pytest.raises(PermissionError, match="close it"):
+        psd.save_hdf5(fname)
+    assert tmpdir.listdir() == [tmpdir.join("psd.hdf")]
+
+
+def test_lazy_topomap(tmpdir, monkeypatch):
+    """Test if a topomap of a lazy TFR reads only its time-frequency window."""
+    tfr = AvgEpochsTFR(_epochs(), np.arange(5., 15.), 3., method="morlet")
+    fname = str(tmpdir.join("tfr.hdf"))
+    tfr.save_hdf5(fname)
+
+    sizes = []
+    getitem = LazyArray.__getitem__
+
+    def counted(self, index):
+        data = getitem(self, index)
+        sizes.append(data.size)
+        return data
+
+    monkeypatch.setattr(LazyArray, "__getitem__", counted)
+    with AvgEpochsTFR().init_from_hdf(fname, lazy=True) as lazy:
+        power = lazy.band_mean(1., 1.2, 7., 8.)
+    times = (tfr.tfr.times >= 1.) & (tfr.tfr.times <= 1.2)
+    expected = tfr.tfr.data[:, 2:4][..., times].mean(axis=(1, 2))
+    assert np.allclose(power, expected)
+    assert sizes == [12 * 2 * times.sum()]
+
+
+def test_read_legacy_tfr(tmpdir):
+    """Test if TFR files of previous versions are read."""
+    epochs = _epochs()
+    tfr = AvgEpochsTFR(epochs, np.arange(5., 15.), 3., method="morlet")
+    # one dict per channel, as written by previous versions
+    data = [{name: name, "tfr": tfr.tfr.data[i], "itc": tfr.itc.data[i]}
+            for i, name in enumerate(tfr.info["ch_names"])]
+    fname = str(tmpdir.join("tfr.hdf"))
+    write_hdf5(fname, dict(freqs=tfr.tfr.freqs, times=tfr.tfr.times,
+                           data=data, info=tfr.info, method=tfr.method,
+                           parameters=tfr.params), title="mnepython")
+
+    results = read_results(fname)
+    assert results["kind"] == "tfr"
+    assert results["ch_types"] == ["eeg"] * len(epochs.ch_names)
+    loaded = AvgEpochsTFR().init_from_hdf(fname)
+    assert loaded.info["ch_names"] == epochs.ch_names
+    assert np.array_equal(loaded.tfr.data, tfr.tfr.data)
+    assert np.array_equal(loaded.itc.data, tfr.itc.data)
+    assert loaded.method == "morlet"
+
+    loaded.save_hdf5(fname)  # converted to the current layout
+    assert np.array_equal(read_results(fname)["itc"], tfr.itc.data)
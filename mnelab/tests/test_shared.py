@@ -0,0 +1,42 @@
+import numpy as np
+import mne
+
+from mnelab.utils.pool import apply_async, shutdown_pool
+from mnelab.utils.shared import SharedArray, SharedProgress, share, attach
+
+
+def test_share_raw():
+    """Test if the data of a raw object is moved to shared memory."""
+    data = np.random.RandomState(42).randn(4, 100000)
+    raw = mne.io.RawArray(data, mne.create_info(4, 1000., "eeg"))
+    created = []
+    shared = share(raw, created)
+    assert isinstance(shared._data, SharedArray)
+    assert raw._data is not shared._data  # original object is not changed
+    attached = attach(shared)
+    assert np.array_equal(attached.get_data(), data)
+    del attached, shared
+    for item in created:
+        item.unlink()
+
+
+def test_apply_async():
+    """Test if large arguments are passed to the worker process."""
+    data = np.arange(1e6)
+    assert apply_async(np.sum, (data,)).get() == data.sum()
+    shutdown_pool()
+
+
+def _count(progress, n):
+    progress.start(n)
+    for _ in range(n):
+        progress.update()
+
+
+def test_shared_progress():
+    """Test if progress updated in the worker process is seen."""
+    progress = SharedProgress()
+    apply_async(_count, (progress, 5)).get()
+    assert (progress.done, progress.total) == (5, 5)
+    progress.unlink()
+    shutdown_pool()
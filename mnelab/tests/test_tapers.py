@@ -0,0 +1,46 @@
+import numpy as np
+import mne
+from mne.time_frequency import (psd_multitaper, tfr_multitaper, multitaper,
+                                tfr)
+
+from mnelab.tfr.backend import tapers
+from mnelab.tfr.backend.avg_epochs_tfr import chunked_tfr
+from mnelab.tfr.backend.tapers import clear_taper_cache, multitaper_wavelets
+
+
+def test_taper_cache(monkeypatch):
+    """Test if tapers are computed once and results do not change."""
+    calls = []
+    dpss_windows = multitaper.dpss_windows
+
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return dpss_windows(*args, **kwargs)
+
+    monkeypatch.setattr(multitaper, "dpss_windows", counted)
+    info = mne.create_info(["Fz", "Cz"], 100., "eeg")
+    epochs = mne.EpochsArray(np.random.RandomState(0).randn(3, 2, 300), info)
+    freqs = np.array([10., 20.])
+    expected = tfr_multitaper(epochs, freqs, freqs / 5, return_itc=False)
+    expected_psds, _ = psd_multitaper(epochs, 5, 40, bandwidth=2.,
+                                      normalization="full")
+
+    clear_taper_cache()
+    del calls[:]
+    power, _ = chunked_tfr(epochs, freqs, freqs / 5, method="multitaper")
+    Ws = multitaper_wavelets(100., freqs, freqs / 5)
+    chunked_tfr(epochs, freqs, freqs / 5, method="multitaper", Ws=Ws)
+    assert len(calls) == 1  # same window length for both freqs
+    assert np.allclose(power.data, expected.data)
+    assert multitaper.dpss_windows is counted  # MNE is not modified
+    assert tfr.dpss_windows is dpss_windows
+
+    for _ in range(2):
+        psds, _ = tapers.psd_multitaper(epochs, 5, 40, bandwidth=2.,
+                                        normalization="full")
+    assert len(calls) == 2
+    assert np.allclose(psds, expected_psds)
+
+    monkeypatch.setattr(tapers, "MAX_NBYTES", 0)
+    multitaper_wavelets(100., freqs, 2.)
+    assert len(tapers._cache) == 1
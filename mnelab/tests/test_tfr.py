@@ -0,0 +1,70 @@
+import numpy as np
+import mne
+import pytest
+from mne.time_frequency import tfr_morlet, tfr_multitaper
+
+from mnelab.tfr.backend import avg_epochs_tfr
+from mnelab.tfr.backend.avg_epochs_tfr import (AvgEpochsTFR, chunked_tfr,
+                                               _auto_chunk_size)
+from mnelab.utils.shared import SharedProgress
+
+
+@pytest.mark.parametrize("method", ["morlet", "multitaper"])
+def test_chunked_tfr(method, tmpdir):
+    """Test if power and ITC computed in blocks of epochs are correct."""
+    info = mne.create_info(["Fz", "Cz", "Pz"], 100., "eeg")
+    data = np.random.RandomState(0).randn(7, 3, 200)
+    epochs = mne.EpochsArray(data, info)
+    freqs = np.array([8., 12., 20.])
+    if method == "morlet":
+        power, itc = tfr_morlet(epochs, freqs, 3., use_fft=True, picks=[0, 2])
+    else:
+        power, itc = tfr_multitaper(epochs, freqs, 3., picks=[0, 2])
+
+    for chunk_size in (1, 3, 7):
+        chunked = chunked_tfr(epochs, freqs, 3., method=method, picks=[0, 2],
+                              chunk_size=chunk_size)
+        assert chunked[0].ch_names == ["Fz", "Pz"]
+        assert chunked[0].nave == 7
+        assert np.allclose(chunked[0].data, power.data)
+        assert np.allclose(chunked[1].data, itc.data)
+
+    # epochs read from disk block by block
+    fname = str(tmpdir.join("test-epo.fif"))
+    epochs.save(fname)
+    epochs = mne.read_epochs(fname, preload=False)
+    progress = SharedProgress()
+    chunked = chunked_tfr(epochs, freqs, 3., method=method, picks=[0, 2],
+                          chunk_size=2, progress=progress)
+    assert np.allclose(chunked[0].data, power.data)
+    assert np.allclose(chunked[1].data, itc.data)
+    assert (progress.done, progress.total) == (8, 8)  # 2 channels, 4 blocks
+    progress.unlink()
+
+
+def test_auto_chunk_size(monkeypatch):
+    """Test if blocks of epochs are smaller with more tapers."""
+    info = mne.create_info(["Fz", "Cz"], 100., "eeg")
+    epochs = mne.EpochsArray(np.zeros((100, 2, 50)), info)
+    freqs = np.arange(5., 15.)
+    assert _auto_chunk_size(epochs, freqs, [0, 1]) is None
+    monkeypatch.setattr(avg_epochs_tfr, "MAX_TFR_NBYTES", 16 * 2 * 10 * 50 * 6)
+    assert _auto_chunk_size(epochs, freqs, [0, 1]) == 6
+    assert _auto_chunk_size(epochs, freqs, [0, 1], "multitaper", 4.) == 2
+
+
+@pytest.mark.parametrize("method", ["morlet", "multitaper", "stockwell"])
+def test_parallel_channels(method):
+    """Test if channels computed in parallel threads are combined."""
+    info = mne.create_info(["Fz", "Cz", "Pz", "Oz"], 100., "eeg")
+    epochs = mne.EpochsArray(np.random.RandomState(0).randn(5, 4, 256), info)
+    freqs = np.array([8., 12., 20.])
+    expected = AvgEpochsTFR(epochs, freqs, 3., method=method, n_fft=256)
+    progress = SharedProgress()
+    tfr = AvgEpochsTFR(epochs, freqs, 3., method=method, n_fft=256,
+                       n_jobs=3, progress=progress)
+    assert (progress.done, progress.total) == (4, 4)
+    assert tfr.tfr.ch_names == ["Fz", "Cz", "Pz", "Oz"]
+    assert np.allclose(tfr.tfr.data, expected.tfr.data)
+    assert np.allclose(tfr.itc.data, expected.itc.data)
+    progress.unlink()
@@ -0,0 +1,50 @@
+import numpy as np
+import mne
+from mne.time_frequency import psd_array_welch, psd_welch
+
+from mnelab.tfr.backend.epochs_psd import EpochsPSD
+from mnelab.tfr.backend.welch import psd_array_welch_fast, psd_welch_fast
+
+
+def test_welch_fast():
+    """Test if the fast Welch PSD matches the PSD computed by MNE."""
+    x = np.random.RandomState(0).randn(3, 4, 3000)
+    for n_fft, n_per_seg, n_overlap in [(256, None, 0), (255, 200, 50)]:
+        expected, freqs = psd_array_welch(x, 250., 1, 100, n_fft=n_fft,
+                                          n_per_seg=n_per_seg,
+                                          n_overlap=n_overlap)
+        psds, fast_freqs = psd_array_welch_fast(
+            x, 250., 1, 100, n_fft=n_fft, n_per_seg=n_per_seg,
+            n_overlap=n_overlap, block_size=10000)  # several blocks
+        assert np.allclose(psds, expected)
+        assert np.allclose(fast_freqs, freqs)
+        psds, _ = psd_array_welch_fast(x, 250., 1, 100, n_fft=n_fft,
+                                       n_per_seg=n_per_seg,
+                                       n_overlap=n_overlap, dtype="float32")
+        assert psds.dtype == np.float32
+        assert np.allclose(psds, expected, rtol=1e-4)
+
+
+def test_welch_fast_epochs():
+    """Test if epochs processed in blocks match the PSD computed by MNE."""
+    info = mne.create_info(["Fz", "Cz", "Pz"], 256., "eeg")
+    data = np.random.RandomState(0).randn(5, 3, 768)
+    epochs = mne.EpochsArray(data, info, tmin=-1)
+    expected, _ = psd_welch(epochs, 1, 40, tmin=-0.5, tmax=1.5, picks=[0, 2])
+    psds, _ = psd_welch_fast(epochs, 1, 40, tmin=-0.5, tmax=1.5,
+                             picks=[0, 2], block_size=10000)  # 1 epoch
+    assert np.allclose(psds, expected)
+    psd = EpochsPSD(epochs, fmin=1, fmax=40, tmin=-0.5, tmax=1.5,
+                    method="welch_fast", picks=[0, 2], dtype="float32")
+    assert psd.data.dtype == np.float32
+    assert np.allclose(psd.data, expected, rtol=1e-4)
+
+
+def test_welch_fast_annotations():
+    """Test if segments of bad annotations are ignored."""
+    info = mne.create_info(["Fz", "Cz", "Pz"], 256., "eeg")
+    raw = mne.io.RawArray(np.random.RandomState(0).randn(3, 5120), info)
+    raw.set_annotations(mne.Annotations([4], [3], ["bad"]))
+    expected, _ = psd_welch(raw, 1, 40, tmin=1, tmax=18, picks=[0, 2])
+    psds, _ = psd_welch_fast(raw, 1, 40, tmin=1, tmax=18, picks=[0, 2])
+    assert np.allclose(psds, expected)
@@ -16,12 +16,11 @@ class PSDDialog(QDialog):
         self.ui.setupUi(self)
         self.ui.retranslateUi(self)
         self.data = data
-        try:
-            if len(data.get_data().shape) == 3:
-                self.type = 'epochs'
-            else:
-                self.type = 'raw'
-        except AttributeError:
+        if isinstance(data, mne.BaseEpochs):
+            self.type = 'epochs'
+        elif isinstance(data, mne.io.BaseRaw):
+            self.type = 'raw'
+        else:
             self.type = 'evoked'
         self.setup_ui()
 
@@ -37,6 +36,7 @@ class PSDDialog(QDialog):
         """Setup the boxes with names.
         """
         self.ui.psdMethod.addItem('welch')
+        self.ui.psdMethod.addItem('welch_fast')
         self.ui.psdMethod.addItem('multitaper')
         chans = Counter([mne.io.pick.channel_type(self.data.info, i)
                          for i in range(self.data.info["nchan"])])
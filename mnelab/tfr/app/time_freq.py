@@ -17,10 +17,9 @@ class TimeFreqDialog(QDialog):
         self.ui.setupUi(self)
         self.ui.retranslateUi(self)
         self.data = data
-        try:
-            if len(data.get_data().shape) == 3:
-                self.type = 'epochs'
-        except AttributeError:
+        if isinstance(data, mne.BaseEpochs):
+            self.type = 'epochs'
+        else:
             self.type = 'evoked'
         self.setup_ui()
 
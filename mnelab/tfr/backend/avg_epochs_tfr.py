@@ -1,4 +1,6 @@
-import h5py
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count
+
 import numpy as np
 import mne
 
@@ -6,6 +8,10 @@ from matplotlib.pyplot import imshow
 from numpy import log, mean
 from .util import eeg_to_montage
 
+# maximum size of the time-frequency decomposition of all epochs (in bytes),
+# larger data sets are processed in blocks of epochs
+MAX_TFR_NBYTES = 512 * 1024 ** 2
+
 
 class AvgEpochsTFR:
     """
@@ -26,10 +32,20 @@ class AvgEpochsTFR:
     # ------------------------------------------------------------------------
     def __init__(self, epochs=None, freqs=None, n_cycles=None,
                  method='multitaper', time_bandwidth=4., n_fft=512, width=1,
-                 picks=None, type='all'):
+                 picks=None, type='all', chunk_size=None, n_jobs=1,
+                 progress=None):
         """
         Initialize the class with an instance of EpochsTFR corresponding
         to the method.
+
+        Channels are computed in n_jobs parallel threads, and each computed
+        channel is counted in progress (a SharedProgress) if given.
+
+        With the multitaper and morlet methods, epochs can be processed in
+        blocks of chunk_size epochs, so that memory does not depend on the
+        number of epochs. By default, blocks are used only when epochs are
+        not loaded in memory or when the decomposition of all epochs would
+        exceed MAX_TFR_NBYTES.
         """
         self.cmap = 'jet'
         self.method = method
@@ -111,50 +127,63 @@ class AvgEpochsTFR:
                 self.head_pos = None
                 self.with_coord = []
 
+            if chunk_size is None and not self.evoked:
+                chunk_size = _auto_chunk_size(epochs, freqs, self.picks,
+                                              method, time_bandwidth)
+
             if method == 'multitaper':
-                from mne.time_frequency import tfr_multitaper
+                from .tapers import multitaper_wavelets
                 self.params = dict(freqs=freqs, n_cycles=n_cycles,
                                    time_bandwidth=time_bandwidth)
-
+                # wavelets of cached tapers, used for all blocks and channels
+                Ws = multitaper_wavelets(epochs.info['sfreq'], freqs,
+                                         n_cycles, time_bandwidth)
+                data = epochs
+                if self.evoked:  # power of a single epoch
+                    data = mne.EpochsArray(epochs.data[np.newaxis],
+                                           epochs.info, tmin=epochs.times[0],
+                                           verbose=False)
+                self.tfr, self.itc = chunked_tfr(
+                    data, freqs, n_cycles, method='multitaper',
+                    picks=self.picks, chunk_size=chunk_size, n_jobs=n_jobs,
+                    progress=progress, Ws=Ws)
                 if self.evoked:
-                    self.tfr, self.itc = tfr_multitaper(
-                        epochs, freqs, n_cycles,
-                        time_bandwidth=time_bandwidth,
-                        picks=self.picks), None
-                else:
-                    self.tfr, self.itc = tfr_multitaper(
-                        epochs, freqs, n_cycles,
-                        time_bandwidth=time_bandwidth,
-                        picks=self.picks, return_itc=True)
+                    self.itc = None
 
             if method == 'morlet':
                 from mne.time_frequency import tfr_morlet
                 self.params = dict(freqs=freqs, n_cycles=n_cycles)
                 if self.evoked:
-                    self.tfr, self.itc = tfr_morlet(
-                        epochs, freqs, n_cycles,
-                        picks=self.picks), None
+                    self.tfr, self.itc = channel_tfr(
+                        tfr_morlet, epochs, self.picks, n_jobs=n_jobs,
+                        progress=progress, freqs=freqs, n_cycles=n_cycles,
+                        return_itc=False), None
+                elif chunk_size is not None:
+                    self.tfr, self.itc = chunked_tfr(
+                        epochs, freqs, n_cycles, method='morlet',
+                        picks=self.picks, chunk_size=chunk_size,
+                        n_jobs=n_jobs, progress=progress)
                 else:
-                    self.tfr, self.itc = tfr_morlet(
-                        epochs, freqs, n_cycles,
-                        picks=self.picks, return_itc=True)
+                    self.tfr, self.itc = channel_tfr(
+                        tfr_morlet, epochs, self.picks, n_jobs=n_jobs,
+                        progress=progress, freqs=freqs, n_cycles=n_cycles,
+                        return_itc=True)
 
             if method == 'stockwell':
                 from mne.time_frequency import tfr_stockwell
                 # The stockwell function does not handle picks like the two
-                # other ones ...
-                picked_ch_names = [epochs.info['ch_names'][i]
-                                   for i in self.picks]
-                picked = epochs.copy().pick_channels(picked_ch_names)
+                # other ones, so channels are picked by channel_tfr
                 self.params = dict(fmin=freqs[0], fmax=freqs[-1], n_fft=n_fft,
                                    width=width)
                 if self.evoked:
-                    self.tfr, self.itc = tfr_stockwell(
-                        picked, fmin=freqs[0], fmax=freqs[-1],
+                    self.tfr, self.itc = channel_tfr(
+                        tfr_stockwell, epochs, self.picks, n_jobs=n_jobs,
+                        progress=progress, fmin=freqs[0], fmax=freqs[-1],
                         n_fft=n_fft, width=width), None
                 else:
-                    self.tfr, self.itc = tfr_stockwell(
-                        picked, fmin=freqs[0], fmax=freqs[-1],
+                    self.tfr, self.itc = channel_tfr(
+                        tfr_stockwell, epochs, self.picks, n_jobs=n_jobs,
+                        progress=progress, fmin=freqs[0], fmax=freqs[-1],
                         n_fft=n_fft, width=width, return_itc=True)
         else:
             # Only for initializing an empty class...
@@ -164,107 +193,43 @@ class AvgEpochsTFR:
     # ------------------------------------------------------------------------
     def init(self, epochs=None, freqs=None, n_cycles=None,
              method='multitaper', time_bandwidth=4., n_fft=512, width=1,
-             picks=None, type='all'):
+             picks=None, type='all', chunk_size=None, n_jobs=1,
+             progress=None):
         """Init and returns."""
 
         self.__init__(epochs=epochs, freqs=freqs, n_cycles=n_cycles,
                       method=method, time_bandwidth=time_bandwidth,
-                      n_fft=n_fft, width=width, picks=picks, type=type)
+                      n_fft=n_fft, width=width, picks=picks, type=type,
+                      chunk_size=chunk_size, n_jobs=n_jobs,
+                      progress=progress)
         return self
 
     # ------------------------------------------------------------------------
-    def init_from_hdf(self, fname):
-        """Init from hdf file."""
-        channel_types = mne.io.pick.get_channel_types()
-
-        # Start by initializing everything
-        f = h5py.File(fname, 'r+')
-        dic = f['mnepython']
-        freqs = dic['key_freqs'][()]
-        times = dic['key_times'][()]
-        method = ''.join([chr(x) for x in dic['key_method'][()]])
-        chs = dic['key_info']['key_chs']
-        tfr_data = np.zeros((
-            len([ch for ch in chs.keys()]), len(freqs), len(times)))
-        itc_data = np.copy(tfr_data)
-        names = []
-        locs = []
-        ch_types = []
-        for i, key in enumerate(chs.keys()):
-            tfr_data[i, :, :] = dic['key_data'][key]['key_tfr'][()]
-            try:    # Simply try to get the itc data if it exists
-                itc_data[i, :, :] = dic['key_data'][key]['key_itc'][()]
-            except Exception:
-                pass
-            ch = chs[key]
-            ch_val = ch['key_kind'][()][0]
-            for t, rules in channel_types.items():
-                for key, vals in rules.items():
-                    try:
-                        if ch['key_' + key] not in np.array(vals):
-                            break
-                    except Exception:
-                        break
-                else:
-                    ch_types.append(t)
-            name = ''.join([chr(x) for x in ch['key_ch_name']])
-            loc = ch['key_loc'][()][0:3]
-            names.append(name)
-            locs.append(loc)
-        locs = np.array(locs)
-        self.picks = [i for i in range(len(names))]
-        montage = mne.channels.Montage(locs, names, 'custom',
-                                       [i for i in range(len(locs))])
-        # First we create variable head_pos for a correct plotting
-        self.pos = montage.get_pos2d()
-
-        scale = 1 / (self.pos.max(axis=0) - self.pos.min(axis=0))
-        center = 0.5 * (self.pos.max(axis=0) + self.pos.min(axis=0))
-        self.head_pos = {'scale': scale, 'center': center}
-
-        # Handling of possible channels without any known coordinates
-        no_coord_channel = False
-        try:
-            names = montage.ch_names
-            indices = self.picks
-            self.pos = self.pos[indices, :]
-        except Exception as e:
-            print(e)
-            no_coord_channel = True
-
-        # If there is not as much positions as the number of Channels
-        # we have to eliminate some channels from the data of topomaps
-        if no_coord_channel:
-            from mne.channels import read_montage
-            from numpy import array
-
-            index = 0
-            self.pos = []           # positions
-            # index in the self.data of channels with coordinates
-            self.with_coord = []
-
-            for i in self.picks:
-                ch_name = epochs.info['ch_names'][i]
-                try:
-                    ch_montage = read_montage(
-                        montage.kind, ch_names=[ch_name])
-                    coord = ch_montage.get_pos2d()
-                    self.pos.append(coord[0])
-                    self.with_coord.append(index)
-                except Exception as e:
-                    print(e)
-                index += 1
-            self.pos = array(self.pos)
-
-        else:
-            self.with_coord = [i for i in range(len(self.picks))]
+    def init_from_hdf(self, fname, lazy=False):
+        """Init from hdf file.
 
-        self.info = mne.create_info(names, 1, montage=montage,
-                                    ch_types='eeg')
-        # eeg is just a trick to not raise valueError...
+        If lazy is True, data are read from the file when they are displayed
+        (see results.LazyArray) until close is called.
+        """
+        from .results import open_results
+        from .util import channels_layout
+
+        self.close()
+        results, self.store = open_results(fname, 'tfr', lazy=lazy)
+        freqs = results['freqs']
+        times = results['times']
+        self.method = results['method']
+        self.params = results['parameters']
+        tfr_data = results['data']
+        itc_data = results['itc']
+        names = results['ch_names']
+        self.picks = [i for i in range(len(names))]
+        self.info, self.pos, self.head_pos = channels_layout(
+            names, results['locs'])
+        self.with_coord = [i for i in range(len(self.picks))]
         self.tfr = mne.time_frequency.AverageTFR(
             self.info, tfr_data, times, freqs, len(self.picks))
-        if np.count_nonzero(itc_data):
+        if itc_data is not None:
             self.evoked = False
             self.itc = mne.time_frequency.AverageTFR(
                 self.info, itc_data, times, freqs, len(self.picks))
@@ -273,6 +238,38 @@ class AvgEpochsTFR:
             self.itc = None
         return self
 
+    # ------------------------------------------------------------------------
+    def init_from_average(self, tfr):
+        """Init from an AverageTFR (e.g. read with mne read_tfrs)."""
+        from .util import channels_layout
+
+        self.close()
+        self.method = (tfr.method or 'multitaper').split('-')[0]
+        self.params = {}
+        self.picks = [i for i in range(len(tfr.ch_names))]
+        locs = np.array([ch['loc'][:3] for ch in tfr.info['chs']])
+        _, self.pos, self.head_pos = channels_layout(tfr.ch_names, locs)
+        self.info = tfr.info
+        self.with_coord = [i for i in range(len(self.picks))]
+        self.tfr, self.itc = tfr, None
+        self.evoked = True
+        return self
+
+    # ------------------------------------------------------------------------
+    def close(self):
+        """Close the file of results read with init_from_hdf."""
+        store = getattr(self, 'store', None)
+        if store is not None:
+            store.close()
+
+    # ------------------------------------------------------------------------
+    def __enter__(self):
+        return self
+
+    # ------------------------------------------------------------------------
+    def __exit__(self, *args):
+        self.close()
+
     # ------------------------------------------------------------------------
     def plot_time_freq(self, index_channel, ax,
                        vmin=None, vmax=None, log_display=False):
@@ -328,25 +325,240 @@ class AvgEpochsTFR:
         return ax.imshow(data, extent=extent, aspect='auto',
                          origin='lower', vmax=vmax, vmin=vmin, cmap=self.cmap)
 
+    # ------------------------------------------------------------------------
+    def band_mean(self, tmin, tmax, fmin, fmax):
+        """
+        Returns the power of each channel averaged over the times between tmin
+        and tmax and the frequencies between fmin and fmax (as
+        AverageTFR.plot_topomap). Only this window of the data is read, which
+        matters for results read lazily.
+        """
+        from mne.utils import _time_mask
+
+        times = np.flatnonzero(_time_mask(self.tfr.times, tmin, tmax))
+        freqs = np.flatnonzero(_time_mask(self.tfr.freqs, fmin, fmax))
+        data = self.tfr.data[:, freqs[0]:freqs[-1] + 1,
+                             times[0]:times[-1] + 1]
+        return mean(mean(data, axis=2), axis=1)
+
+    # ------------------------------------------------------------------------
+    def plot_topomap(self, tmin, tmax, fmin, fmax, axes=None,
+                     vmin=None, vmax=None):
+        """
+        Plot the map of the power averaged over a time-frequency window. This
+        function will return an error if the class is not initialized with
+        the coordinates of the different electrodes.
+        """
+        from mne.viz import plot_topomap
+
+        if not self.with_coord:
+            raise ValueError('No coordinates for topomap')
+        values = self.band_mean(tmin, tmax, fmin, fmax)[self.with_coord]
+        return plot_topomap(values, self.pos, axes=axes,
+                            vmin=vmin, vmax=vmax, show=False,
+                            cmap=self.cmap, head_pos=self.head_pos,
+                            outlines='skirt', contours=3)
+
     # ------------------------------------------------------------------------
     def save_hdf5(self, path, overwrite=True):
         """Save data as hdf5 file."""
-        from mne.externals.h5io import write_hdf5
+        from .results import write_results
+
+        write_results(path, 'tfr', self.tfr.data, self.tfr.freqs, self.info,
+                      self.method, self.params, times=self.tfr.times,
+                      itc=None if self.evoked else self.itc.data,
+                      overwrite=overwrite)
+
+
+# ---------------------------------------------------------------------
+def _auto_chunk_size(epochs, freqs, picks, method='morlet',
+                     time_bandwidth=4.):
+    """Return the number of epochs processed at once (None for all)
 
-        if self.evoked:
-            data = [{self.info['ch_names'][i]: self.info['ch_names'][i],
-                     'tfr': self.tfr.data[i, :, :]}
-                    for i in range(len(self.info['ch_names']))]
+    The decomposition of an epoch has one complex value per channel,
+    frequency, time and taper. Epochs which are not loaded are always read in
+    blocks.
+    """
+    n_tapers = 1
+    if method == 'multitaper':
+        n_tapers = max(1, int(np.floor(time_bandwidth - 1)))
+    n_epochs = len(epochs.events)
+    per_epoch = (16 * n_tapers * len(picks) * len(freqs)
+                 * len(epochs.times))
+    if epochs.preload and n_epochs * per_epoch <= MAX_TFR_NBYTES:
+        return None
+    return int(max(1, min(n_epochs, MAX_TFR_NBYTES // per_epoch)))
+
+
+# ---------------------------------------------------------------------
+def _cwt(x, Ws):
+    """Convolve signals with wavelets (as mne.time_frequency.tfr.cwt)
+
+    Convolutions are computed with FFTs of a power of 2 length and centered
+    as with mode='same'. The FFT of each signal is computed once for all
+    wavelets.
+
+    Returns
+    -------
+    coefs : ndarray, shape (n_signals, n_wavelets, n_times)
+        The decompositions of the signals.
+    """
+    from scipy.fftpack import fft, ifft
+
+    n_times = x.shape[-1]
+    size = n_times + max(W.size for W in Ws) - 1
+    fsize = 2 ** int(np.ceil(np.log2(size)))
+    fft_x = fft(x, fsize, axis=-1)
+    coefs = np.empty((len(x), len(Ws), n_times), dtype=np.complex128)
+    for index, W in enumerate(Ws):
+        start = (W.size - 1) // 2
+        coefs[:, index] = ifft(fft_x * fft(W, fsize),
+                               axis=-1)[:, start:start + n_times]
+    return coefs
+
+
+# ---------------------------------------------------------------------
+def chunked_tfr(epochs, freqs, n_cycles, method='morlet', time_bandwidth=4.,
+                picks=None, chunk_size=64, zero_mean=True, n_jobs=1,
+                progress=None, Ws=None):
+    """Compute average power and ITC of epochs in blocks of epochs
+
+    For each block, the power and the unit phasors of the decomposition (of
+    each taper) are added to running sums, so that memory depends on the
+    size of a block only. Epochs which are not loaded are read from disk
+    block by block (all epochs form one block if chunk_size is None). Results
+    are those of tfr_morlet (computed with FFT) and tfr_multitaper with
+    return_itc=True. Channels of each block are computed in n_jobs threads,
+    and counted in progress for each block. Wavelets computed
+    before (e.g. by tapers.multitaper_wavelets, as a list of wavelets for
+    each taper) can be passed as Ws, instead of being computed from the
+    parameters.
+
+    Returns
+    -------
+    power, itc : AverageTFR
+        The average power and the inter-trial coherence
+    """
+    from mne import pick_info
+    from mne.io.pick import _picks_to_idx
+    from mne.time_frequency import AverageTFR, morlet
+    from .tapers import multitaper_wavelets
+
+    picks = _picks_to_idx(epochs.info, picks, 'data', with_ref_meg=False)
+    freqs = np.asarray(freqs, dtype=float)
+    sfreq = epochs.info['sfreq']
+    if method not in ('morlet', 'multitaper'):
+        raise ValueError('Chunked computation requires the morlet or '
+                         'multitaper method, got {}'.format(method))
+    if Ws is None and method == 'morlet':
+        Ws = [morlet(sfreq, freqs, n_cycles=n_cycles, zero_mean=zero_mean)]
+    elif Ws is None:
+        Ws = multitaper_wavelets(sfreq, freqs, n_cycles,
+                                 time_bandwidth=time_bandwidth,
+                                 zero_mean=zero_mean)
+    if chunk_size is None:
+        chunk_size = max(1, len(epochs.events))
+    n_times = len(epochs.times)
+    if len(Ws[0][0]) > n_times:
+        raise ValueError('At least one of the wavelets is longer than the '
+                         'signal. Use a longer signal or shorter wavelets.')
+
+    shape = (len(picks), len(freqs), n_times)
+    power = np.zeros(shape)
+    plf = np.zeros((len(Ws),) + shape, dtype=np.complex128)
+    n_blocks = -(-len(epochs.events) // chunk_size)
+    if progress is not None:
+        progress.start(len(picks) * n_blocks)
+    n_epochs = 0
+    for start in range(0, len(epochs.events), chunk_size):
+        if epochs.preload:
+            data = epochs._data[start:start + chunk_size]
         else:
-            data = [{self.info['ch_names'][i]: self.info['ch_names'][i],
-                     'tfr': self.tfr.data[i, :, :],
-                     'itc': self.itc.data[i, :, :]}
-                    for i in range(len(self.info['ch_names']))]
-
-        out = dict(freqs=self.tfr.freqs,
-                   times=self.tfr.times,
-                   data=data,
-                   info=self.info,
-                   method=self.method,
-                   parameters=self.params)
-        write_hdf5(path, out, title='mnepython', overwrite=overwrite)
+            data = epochs[start:start + chunk_size].get_data()
+        n_epochs += len(data)
+
+        def accumulate(index):
+            for taper, W in enumerate(Ws):
+                coefs = _cwt(data[:, picks[index]], W)
+                magnitude = np.abs(coefs)
+                power[index] += (magnitude ** 2).sum(axis=0)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    plf[taper, index] += np.nan_to_num(
+                        coefs / magnitude).sum(axis=0)
+            if progress is not None:
+                progress.update()
+
+        _map_threads(accumulate, range(len(picks)), n_jobs)
+    power /= n_epochs * len(Ws)
+    itc = np.abs(plf).mean(axis=0) / n_epochs
+
+    info = pick_info(epochs.info, picks)
+    return (AverageTFR(info, power, epochs.times.copy(), freqs, n_epochs,
+                       method='%s-power' % method),
+            AverageTFR(info, itc, epochs.times.copy(), freqs, n_epochs,
+                       method='%s-itc' % method))
+
+
+# ---------------------------------------------------------------------
+def _map_threads(func, items, n_jobs=1):
+    """Return the results of func for all items, computed in n_jobs threads
+
+    FFTs and convolutions release the GIL, so channels are computed in
+    parallel without copying the data to other processes.
+    """
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = cpu_count() or 1
+    if n_jobs == 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(func, items))
+
+
+# ---------------------------------------------------------------------
+def _pick_channel(inst, data, pick):
+    """Return evoked or epochs of a single channel of data (not copied)"""
+    info = mne.pick_info(inst.info, [pick])
+    if hasattr(inst, 'data'):
+        return mne.EvokedArray(data[pick:pick + 1], info,
+                               tmin=inst.times[0], nave=inst.nave,
+                               verbose=False)
+    return mne.EpochsArray(data[:, pick:pick + 1], info,
+                           tmin=inst.times[0], verbose=False)
+
+
+# ---------------------------------------------------------------------
+def channel_tfr(func, inst, picks, n_jobs=1, progress=None, **kwargs):
+    """Compute a TFR channel by channel in n_jobs threads
+
+    func is one of the mne.time_frequency functions (tfr_morlet,
+    tfr_multitaper or tfr_stockwell), called with kwargs for each channel.
+    Computed channels are counted in progress.
+
+    Returns
+    -------
+    power : AverageTFR
+        The average power of all channels
+    itc : AverageTFR | None
+        The inter-trial coherence (if return_itc is True)
+    """
+    from mne.time_frequency import AverageTFR
+
+    if progress is not None:
+        progress.start(len(picks))
+    data = inst.data if hasattr(inst, 'data') else inst.get_data()
+
+    def compute(pick):
+        out = func(_pick_channel(inst, data, pick), **kwargs)
+        if progress is not None:
+            progress.update()
+        return out if isinstance(out, tuple) else (out,)
+
+    results = _map_threads(compute, picks, n_jobs)
+    info = mne.pick_info(inst.info, picks)
+    outs = []
+    for tfrs in zip(*results):
+        data = np.concatenate([tfr.data for tfr in tfrs])
+        outs.append(AverageTFR(info, data, tfrs[0].times, tfrs[0].freqs,
+                               tfrs[0].nave, comment=tfrs[0].comment,
+                               method=tfrs[0].method))
+    return outs[0] if len(outs) == 1 else tuple(outs)
@@ -2,7 +2,14 @@ import matplotlib.pyplot as plt
 from numpy import mean, log
 import mne
 import numpy as np
-import h5py
+
+
+# ----------------------------------------------------------------------------
+def _cumsum(data):
+    """Return cumulative sums along frequencies (with a first sum of 0)"""
+    cumsum = np.zeros(data.shape[:-1] + (data.shape[-1] + 1,))
+    np.cumsum(data, axis=-1, out=cumsum[..., 1:])
+    return cumsum
 
 
 class EpochsPSD:
@@ -22,13 +29,17 @@ class EpochsPSD:
 
     info        (mne Infos)    : info of the epochs
 
-    method      (str)          : method used for PSD (multitaper or welch)
+    method      (str)          : method used for PSD (multitaper, welch or
+                                  welch_fast)
 
     data        (numpy arr.)   : dataset with all the psds data of size
                                   (n_epochs, n_channels, n_freqs)
 
     freqs       (arr.)         : list containing the frequencies of the psds
 
+    avg_data    (numpy arr.)   : psds averaged over epochs, of size
+                                  (n_channels, n_freqs)
+
     Methods
     =========
     __init__                   : Compute all the PSD of each epoch
@@ -36,6 +47,10 @@ class EpochsPSD:
     plot_topomap               : Plot the map of the power for a given
                                   frequency and epoch
 
+    band_mean                  : Return the power averaged over a
+                                  frequency band, for an epoch or averaged
+                                  over epochs
+
     plot_topomap_band          : Plot the map of the power for a given band
                                   frequency and epoch
 
@@ -59,7 +74,7 @@ class EpochsPSD:
         Computes the PSD of the epochs with the correct method multitaper or
         welch
         """
-        from .util import eeg_to_montage
+        from .util import eeg_to_montage, compute_psd
 
         if epochs is not None:
             if type == 'eeg':
@@ -76,6 +91,7 @@ class EpochsPSD:
             self.n_fft = kwargs.get('n_fft', 256)
             self.n_per_seg = kwargs.get('n_per_seg', self.n_fft)
             self.n_overlap = kwargs.get('n_overlap', 0)
+            self.dtype = kwargs.get('dtype', 'float64')
             self.cmap = 'jet'
 
             if picks is not None:
@@ -139,32 +155,11 @@ class EpochsPSD:
                 self.head_pos = None
                 self.with_coord = []
 
-            if method == 'multitaper':
-                from mne.time_frequency import psd_multitaper
-
-                self.data, self.freqs = psd_multitaper(
-                    epochs,
-                    fmin=fmin,
-                    fmax=fmax,
-                    tmin=tmin,
-                    tmax=tmax,
-                    normalization='full',
-                    bandwidth=self.bandwidth,
-                    picks=self.picks)
-
-            if method == 'welch':
-                from mne.time_frequency import psd_welch
-
-                self.data, self.freqs = psd_welch(
-                    epochs,
-                    fmin=fmin,
-                    fmax=fmax,
-                    tmin=tmin,
-                    tmax=tmax,
-                    n_fft=self.n_fft,
-                    n_overlap=self.n_overlap,
-                    n_per_seg=self.n_per_seg,
-                    picks=self.picks)
+            self.data, self.freqs = compute_psd(
+                epochs, method, fmin=fmin, fmax=fmax, tmin=tmin, tmax=tmax,
+                picks=self.picks, bandwidth=self.bandwidth, n_fft=self.n_fft,
+                n_per_seg=self.n_per_seg, n_overlap=self.n_overlap,
+                dtype=self.dtype)
 
         else:
             self.freqs = None
@@ -181,93 +176,47 @@ class EpochsPSD:
         return self
 
     # ------------------------------------------------------------------------
-    def init_from_hdf(self, fname):
-        """Init the class from an hdf file."""
-        channel_types = mne.io.pick.get_channel_types()
-
-        # Start by initializing everything
-        f = h5py.File(fname, 'r+')
-        dic = f['mnepython']
-        self.freqs = dic['key_freqs'][()]
-        chs = dic['key_info']['key_chs']
-        n_epochs, n_freqs = dic['key_data']['idx_0']['idx_1'][()].shape
-        self.data = np.zeros((
-            n_epochs,
-            len([elem for elem in chs.keys()]),
-            n_freqs))
-        self.method = ''.join([chr(x) for x in dic['key_method'][()]])
-        names = []
-        locs = []
-        ch_types = []
-        for i, key in enumerate(chs.keys()):
-            self.data[:, i, :] = dic['key_data'][key]['idx_1'][()]
-            ch = chs[key]
-            ch_val = ch['key_kind'][()][0]
-            for t, rules in channel_types.items():
-                for key, vals in rules.items():
-                    try:
-                        if ch['key_' + key] not in np.array(vals):
-                            break
-                    except Exception:
-                        break
-                else:
-                    ch_types.append(t)
-            name = ''.join([chr(x) for x in ch['key_ch_name']])
-            loc = ch['key_loc'][()][0:3]
-            names.append(name)
-            locs.append(loc)
-        locs = np.array(locs)
-        self.picks = [i for i in range(len(names))]
-        montage = mne.channels.Montage(locs, names, 'custom',
-                                       [i for i in range(len(locs))])
-        # First we create variable head_pos for a correct plotting
-        self.pos = montage.get_pos2d()
-
-        scale = 1 / (self.pos.max(axis=0) - self.pos.min(axis=0))
-        center = 0.5 * (self.pos.max(axis=0) + self.pos.min(axis=0))
-        self.head_pos = {'scale': scale, 'center': center}
+    def init_from_hdf(self, fname, lazy=False):
+        """Init the class from an hdf file.
 
-        # Handling of possible channels without any known coordinates
-        no_coord_channel = False
-        try:
-            names = montage.ch_names
-            indices = self.picks
-            self.pos = self.pos[indices, :]
-        except Exception as e:
-            print(e)
-            no_coord_channel = True
-
-        # If there is not as much positions as the number of Channels
-        # we have to eliminate some channels from the data of topomaps
-        if no_coord_channel:
-            from mne.channels import read_montage
-            from numpy import array
-
-            index = 0
-            self.pos = []           # positions
-            # index in the self.data of channels with coordinates
-            self.with_coord = []
-
-            for i in self.picks:
-                ch_name = epochs.info['ch_names'][i]
-                try:
-                    ch_montage = read_montage(
-                        montage.kind, ch_names=[ch_name])
-                    coord = ch_montage.get_pos2d()
-                    self.pos.append(coord[0])
-                    self.with_coord.append(index)
-                except Exception as e:
-                    print(e)
-                index += 1
-            self.pos = array(self.pos)
+        If lazy is True, data are read from the file when they are displayed
+        (see results.LazyArray) until close is called.
+        """
+        from .results import open_results
+        from .util import channels_layout
+
+        self.close()
+        results, self.store = open_results(fname, 'epochs_psd', lazy=lazy)
+        self.freqs = results['freqs']
+        self.data = results['data']
+        self.method = results['method']
+        for key, value in results['parameters'].items():
+            setattr(self, key, value)
+        names = results['ch_names']
+        self.picks = [i for i in range(len(names))]
+        self.info, self.pos, self.head_pos = channels_layout(
+            names, results['locs'])
+        self.with_coord = [i for i in range(len(self.picks))]
+        if results['avg_data'] is not None:  # not computed again from data
+            self._cache_data = self.data
+            self._cache = dict(avg_data=results['avg_data'])
+        return self
 
-        else:
-            self.with_coord = [i for i in range(len(self.picks))]
+    # ------------------------------------------------------------------------
+    def close(self):
+        """Close the file of results read with init_from_hdf."""
+        store = getattr(self, 'store', None)
+        if store is not None:
+            store.close()
 
-        self.info = mne.create_info(names, 1, montage=montage,
-                                    ch_types='eeg')
+    # ------------------------------------------------------------------------
+    def __enter__(self):
         return self
 
+    # ------------------------------------------------------------------------
+    def __exit__(self, *args):
+        self.close()
+
     # ------------------------------------------------------------------------
     def __str__(self):
         """Return informations about the instance"""
@@ -278,7 +227,7 @@ class EpochsPSD:
         string.format(len(self.info['chs']), self.method,
                       self.fmin, self.fmax, len(self.freqs),
                       self.tmin, self.tmax)
-        if self.method == 'welch':
+        if self.method in ('welch', 'welch_fast'):
             string = (string + 'n_fft:{}, n_per_seg:{}, n_overlap:{}\n')
             string.format(self.n_fft, self.n_per_seg, self.n_overlap)
         else:
@@ -289,7 +238,7 @@ class EpochsPSD:
     def recap(self):
         """Returns a quick recap"""
 
-        if self.method == 'welch':
+        if self.method in ('welch', 'welch_fast'):
             string = ('Computed with Welch method, '
                       + 'n_fft: {}, n_per_seg: {}, n_overlap: {}\n')
             string.format(self.n_fft, self.n_per_seg, self.n_overlap)
@@ -298,6 +247,45 @@ class EpochsPSD:
             string.format(self.bandwidth)
         return string
 
+    # ------------------------------------------------------------------------
+    def _cached(self, name, compute):
+        """Return a result computed from data, kept until data change"""
+        if getattr(self, '_cache_data', None) is not self.data:
+            self._cache = {}
+            self._cache_data = self.data
+        if name not in self._cache:
+            self._cache[name] = compute()
+        return self._cache[name]
+
+    # ------------------------------------------------------------------------
+    @property
+    def avg_data(self):
+        """PSD averaged over epochs (computed once)"""
+        return self._cached('avg_data', lambda: mean(self.data, axis=0))
+
+    # ------------------------------------------------------------------------
+    def band_mean(self, freq_index_min, freq_index_max, epoch_index=None):
+        """
+        Returns the power of each channel averaged over the frequencies
+        self.freqs[freq_index_min:freq_index_max], for the epoch epoch_index
+        or averaged over epochs if epoch_index is None. Means are differences
+        of cumulative sums along frequencies, which are computed once, so
+        that they take the same time for any band.
+        """
+        start, stop, _ = slice(freq_index_min, freq_index_max).indices(
+            len(self.freqs))
+        if stop <= start:
+            return np.full(self.data.shape[1], np.nan)
+        if epoch_index is None:
+            cumsum = self._cached('avg_cumsum',
+                                  lambda: _cumsum(self.avg_data))
+        elif isinstance(self.data, np.ndarray):
+            cumsum = self._cached('cumsum',
+                                  lambda: _cumsum(self.data))[epoch_index]
+        else:  # data are read lazily, only the band of the epoch is read
+            return mean(self.data[epoch_index, :, start:stop], axis=-1)
+        return (cumsum[:, stop] - cumsum[:, start]) / (stop - start)
+
     # ------------------------------------------------------------------------
     def plot_topomap(self, epoch_index, freq_index,
                      axes=None, log_display=False):
@@ -329,10 +317,8 @@ class EpochsPSD:
         """
         from mne.viz import plot_topomap
 
-        psd_values = self.data[epoch_index,
-                               self.with_coord,
-                               freq_index_min: freq_index_max]
-        psd_mean = mean(psd_values, axis=1)
+        psd_mean = self.band_mean(freq_index_min, freq_index_max,
+                                  epoch_index)[self.with_coord]
         if log_display:
             psd_mean = 10 * log(psd_mean)
         return plot_topomap(psd_mean, self.pos, axes=axes,
@@ -353,10 +339,8 @@ class EpochsPSD:
         """
         from mne.viz import plot_topomap
 
-        psd_values = self.data[:, self.with_coord,
-                               freq_index_min: freq_index_max]
-        psd_mean = mean(psd_values, axis=2)   # average over frequency band
-        psd_mean = mean(psd_mean,   axis=0)   # average over epochs
+        psd_mean = self.band_mean(freq_index_min,
+                                  freq_index_max)[self.with_coord]
         if log_display:
             psd_mean = 10 * log(psd_mean)
         return plot_topomap(psd_mean, self.pos, axes=axes,
@@ -378,7 +362,7 @@ class EpochsPSD:
             self.freqs[freq_index_min], self.freqs[freq_index_max],
             self.data.shape[1] + 1,                              1
         ]
-        mat = mean(self.data[:, :, freq_index_min: freq_index_max], axis=0)
+        mat = self.avg_data[:, freq_index_min: freq_index_max]
         if log_display:
             mat = 10 * log(mat)
         if axes is not None:
@@ -437,7 +421,7 @@ class EpochsPSD:
         channel_index, between the values corresponding to freq_index_max
         and freq_index_min.
         """
-        psd = mean(self.data[:, channel_index, :], axis=0)
+        psd = self.avg_data[channel_index, :]
         if log_display:
             psd = 10 * log(psd)
         if axes is not None:
@@ -475,8 +459,7 @@ class EpochsPSD:
         from matplotlib.cm import jet
         from numpy import linspace
 
-        psds = mean(self.data[:, :, freq_index_min: freq_index_max],
-                    axis=0)
+        psds = self.avg_data[:, freq_index_min: freq_index_max]
         if log_display:
             psds = 10 * log(psds)
         nchan = len(self.picks)
@@ -513,67 +496,33 @@ class EpochsPSD:
         """
         Save the entire matrix in a sef file
         """
-        import numpy as np
-        import struct
+        from ...utils.export import write_sef
 
-        n_channels = len(self.info['ch_names'])
         num_freq_frames = len(self.freqs)
         freq_step = (self.freqs[-1] - self.freqs[0]) / num_freq_frames
         sfreq = float(1 / freq_step)
 
-        f = open(path, 'wb')
-        for car in 'SE01':
-            f.write(struct.pack('c', bytes(car, 'ASCII')))
-        f.write(struct.pack('I', n_channels))
-        f.write(struct.pack('I', 0))
-        f.write(struct.pack('I', num_freq_frames))
-        f.write(struct.pack('f', sfreq))
-        f.write(struct.pack('H', 0))
-        f.write(struct.pack('H', 0))
-        f.write(struct.pack('H', 0))
-        f.write(struct.pack('H', 0))
-        f.write(struct.pack('H', 0))
-        f.write(struct.pack('H', 0))
-        f.write(struct.pack('H', 0))
-
-        for name in self.info['ch_names']:
-            n = 0
-            for car in name:
-                f.write(struct.pack('c', bytes(car, 'ASCII')))
-                n += 1
-            while n < 8:
-                f.write(struct.pack('x'))
-                n += 1
-
-        data = self.data.astype(np.float32)
-        data = np.reshape(np.mean(data, axis=0),
-                          n_channels * num_freq_frames,
-                          order='F')
-        data.tofile(f)
-        f.close()
+        write_sef(path, self.info['ch_names'], sfreq, num_freq_frames,
+                  lambda start, stop: self.avg_data[:, start:stop])
 
     # ------------------------------------------------------------------------
     def save_hdf5(self, path, overwrite=True):
         """Save data as hdf5 file."""
-        from mne.externals.h5io import write_hdf5
+        from .results import write_results
 
         if self.method == 'multitaper':
             params = dict(bandwidth=self.bandwidth,
                           tmin=self.tmin, tmax=self.tmax,
                           fmin=self.fmin, fmax=self.fmax)
-        if self.method == 'welch':
+        if self.method in ('welch', 'welch_fast'):
             params = dict(n_fft=self.n_fft,
                           n_per_seg=self.n_per_seg,
                           n_overlap=self.n_overlap,
                           tmin=self.tmin, tmax=self.tmax,
                           fmin=self.fmin, fmax=self.fmax)
+            if self.method == 'welch_fast':
+                params['dtype'] = self.dtype
 
-        print(self.info['ch_names'])
-        data = [[self.info['ch_names'][i], self.data[:, i, :]]
-                for i in range(len(self.info['ch_names']))]
-
-        out = dict(freqs=self.freqs, data=data,
-                   avg_data=mean(self.data, axis=0),
-                   info=self.info, method=self.method,
-                   parameters=params)
-        write_hdf5(path, out, title='mnepython', overwrite=overwrite)
+        write_results(path, 'epochs_psd', self.data, self.freqs, self.info,
+                      self.method, params, avg_data=self.avg_data,
+                      overwrite=overwrite)
@@ -2,7 +2,6 @@ import matplotlib.pyplot as plt
 from numpy import log
 import mne
 import numpy as np
-import h5py
 
 
 class RawPSD:
@@ -22,7 +21,8 @@ class RawPSD:
 
     info        (mne Infos)    : info of the raw data
 
-    method      (str)          : method used for PSD (multitaper or welch)
+    method      (str)          : method used for PSD (multitaper, welch or
+                                  welch_fast)
 
     data        (numpy arr.)   : dataset with all the psds data of shape
                                   (n_channels, n_freqs)
@@ -53,7 +53,7 @@ class RawPSD:
         Computes the PSD of the raw file with the correct method, multitaper
         or welch.
         """
-        from .util import eeg_to_montage
+        from .util import eeg_to_montage, compute_psd
 
         if raw is not None:
             if type == 'eeg':
@@ -70,6 +70,7 @@ class RawPSD:
             self.n_fft = kwargs.get('n_fft', 256)
             self.n_per_seg = kwargs.get('n_per_seg', self.n_fft)
             self.n_overlap = kwargs.get('n_overlap', 0)
+            self.dtype = kwargs.get('dtype', 'float64')
             self.cmap = 'jet'
 
             if picks is not None:
@@ -134,32 +135,11 @@ class RawPSD:
                 self.head_pos = None
                 self.with_coord = []
 
-            if method == 'multitaper':
-                from mne.time_frequency import psd_multitaper
-
-                self.data, self.freqs = psd_multitaper(
-                    raw,
-                    fmin=fmin,
-                    fmax=fmax,
-                    tmin=tmin,
-                    tmax=tmax,
-                    normalization='full',
-                    bandwidth=self.bandwidth,
-                    picks=self.picks)
-
-            if method == 'welch':
-                from mne.time_frequency import psd_welch
-
-                self.data, self.freqs = psd_welch(
-                    raw,
-                    fmin=fmin,
-                    fmax=fmax,
-                    tmin=tmin,
-                    tmax=tmax,
-                    n_fft=self.n_fft,
-                    n_overlap=self.n_overlap,
-                    n_per_seg=self.n_per_seg,
-                    picks=self.picks)
+            self.data, self.freqs = compute_psd(
+                raw, method, fmin=fmin, fmax=fmax, tmin=tmin, tmax=tmax,
+                picks=self.picks, bandwidth=self.bandwidth, n_fft=self.n_fft,
+                n_per_seg=self.n_per_seg, n_overlap=self.n_overlap,
+                dtype=self.dtype)
         else:
             self.data = None
             self.freqs = None
@@ -175,91 +155,44 @@ class RawPSD:
         return self
 
     # ------------------------------------------------------------------------
-    def init_from_hdf(self, fname):
-        """Init the class from an hdf file."""
-        channel_types = mne.io.pick.get_channel_types()
-
-        # Start by initializing everything
-        f = h5py.File(fname, 'r+')
-        dic = f['mnepython']
-        self.freqs = dic['key_freqs'][()]
-        self.method = ''.join([chr(x) for x in dic['key_method'][()]])
-        chs = dic['key_info']['key_chs']
-        self.data = np.zeros((
-            len([elem for elem in chs.keys()]),
-            len(self.freqs)))
-        names = []
-        locs = []
-        ch_types = []
-        for i, key in enumerate(chs.keys()):
-            self.data[i, :] = dic['key_data'][key]['idx_1'][()]
-            ch = chs[key]
-            ch_val = ch['key_kind'][()][0]
-            for t, rules in channel_types.items():
-                for key, vals in rules.items():
-                    try:
-                        if ch['key_' + key] not in np.array(vals):
-                            break
-                    except Exception:
-                        break
-                else:
-                    ch_types.append(t)
-            name = ''.join([chr(x) for x in ch['key_ch_name']])
-            loc = ch['key_loc'][()][0:3]
-            names.append(name)
-            locs.append(loc)
-        locs = np.array(locs)
-        self.picks = [i for i in range(len(names))]
-        montage = mne.channels.Montage(locs, names, 'custom',
-                                       [i for i in range(len(locs))])
-        # First we create variable head_pos for a correct plotting
-        self.pos = montage.get_pos2d()
-
-        scale = 1 / (self.pos.max(axis=0) - self.pos.min(axis=0))
-        center = 0.5 * (self.pos.max(axis=0) + self.pos.min(axis=0))
-        self.head_pos = {'scale': scale, 'center': center}
+    def init_from_hdf(self, fname, lazy=False):
+        """Init the class from an hdf file.
 
-        # Handling of possible channels without any known coordinates
-        no_coord_channel = False
-        try:
-            names = montage.ch_names
-            indices = self.picks
-            self.pos = self.pos[indices, :]
-        except Exception as e:
-            print(e)
-            no_coord_channel = True
-
-        # If there is not as much positions as the number of Channels
-        # we have to eliminate some channels from the data of topomaps
-        if no_coord_channel:
-            from mne.channels import read_montage
-            from numpy import array
-
-            index = 0
-            self.pos = []           # positions
-            # index in the self.data of channels with coordinates
-            self.with_coord = []
-
-            for i in self.picks:
-                ch_name = epochs.info['ch_names'][i]
-                try:
-                    ch_montage = read_montage(
-                        montage.kind, ch_names=[ch_name])
-                    coord = ch_montage.get_pos2d()
-                    self.pos.append(coord[0])
-                    self.with_coord.append(index)
-                except Exception as e:
-                    print(e)
-                index += 1
-            self.pos = array(self.pos)
+        If lazy is True, data are read from the file when they are displayed
+        (see results.LazyArray) until close is called.
+        """
+        from .results import open_results
+        from .util import channels_layout
+
+        self.close()
+        results, self.store = open_results(fname, 'raw_psd', lazy=lazy)
+        self.freqs = results['freqs']
+        self.data = results['data']
+        self.method = results['method']
+        for key, value in results['parameters'].items():
+            setattr(self, key, value)
+        names = results['ch_names']
+        self.picks = [i for i in range(len(names))]
+        self.info, self.pos, self.head_pos = channels_layout(
+            names, results['locs'])
+        self.with_coord = [i for i in range(len(self.picks))]
+        return self
 
-        else:
-            self.with_coord = [i for i in range(len(self.picks))]
+    # ------------------------------------------------------------------------
+    def close(self):
+        """Close the file of results read with init_from_hdf."""
+        store = getattr(self, 'store', None)
+        if store is not None:
+            store.close()
 
-        self.info = mne.create_info(names, 1, montage=montage,
-                                    ch_types='eeg')
+    # ------------------------------------------------------------------------
+    def __enter__(self):
         return self
 
+    # ------------------------------------------------------------------------
+    def __exit__(self, *args):
+        self.close()
+
     # --------------------------------------------------------------------------
     def plot_topomap(self, freq_index, axes=None, log_display=False):
         """
@@ -399,63 +332,32 @@ class RawPSD:
         """
         Save the entire matrix in a sef file
         """
-        import numpy as np
-        import struct
+        from ...utils.export import write_sef
 
-        n_channels = len(self.info['ch_names'])
         num_freq_frames = len(self.freqs)
         freq_step = (self.freqs[-1] - self.freqs[0]) / num_freq_frames
         sfreq = float(1 / freq_step)
 
-        f = open(path, 'wb')
-        for car in 'SE01':
-            f.write(struct.pack('c', bytes(car, 'ASCII')))
-        f.write(struct.pack('I', n_channels))
-        f.write(struct.pack('I', 0))
-        f.write(struct.pack('I', num_freq_frames))
-        f.write(struct.pack('f', sfreq))
-        f.write(struct.pack('H', 0))
-        f.write(struct.pack('H', 0))
-        f.write(struct.pack('H', 0))
-        f.write(struct.pack('H', 0))
-        f.write(struct.pack('H', 0))
-        f.write(struct.pack('H', 0))
-        f.write(struct.pack('H', 0))
-
-        for name in self.info['ch_names']:
-            n = 0
-            for car in name:
-                f.write(struct.pack('c', bytes(car, 'ASCII')))
-                n += 1
-            while n < 8:
-                f.write(struct.pack('x'))
-                n += 1
-
-        data = self.data.astype(np.float32)
-        data = np.reshape(data, n_channels * num_freq_frames, order='F')
-        data.tofile(f)
-        f.close()
+        write_sef(path, self.info['ch_names'], sfreq, num_freq_frames,
+                  lambda start, stop: self.data[:, start:stop])
 
     # ------------------------------------------------------------------------
     def save_hdf5(self, path, overwrite=True):
         """Save data as hdf5 file."""
-        from mne.externals.h5io import write_hdf5
+        from .results import write_results
 
         if self.method == 'multitaper':
             params = dict(bandwidth=self.bandwidth,
                           tmin=self.tmin, tmax=self.tmax,
                           fmin=self.fmin, fmax=self.fmax)
-        if self.method == 'welch':
+        if self.method in ('welch', 'welch_fast'):
             params = dict(n_fft=self.n_fft,
                           n_per_seg=self.n_per_seg,
                           n_overlap=self.n_overlap,
                           tmin=self.tmin, tmax=self.tmax,
                           fmin=self.fmin, fmax=self.fmax)
+            if self.method == 'welch_fast':
+                params['dtype'] = self.dtype
 
-        data = [[self.info['ch_names'][i], self.data[i, :]]
-                for i in range(len(self.info['ch_names']))]
-
-        out = dict(freqs=self.freqs, data=data,
-                   info=self.info, method=self.method,
-                   parameters=params)
-        write_hdf5(path, out, title='mnepython', overwrite=overwrite)
+        write_results(path, 'raw_psd', self.data, self.freqs, self.info,
+                      self.method, params, overwrite=overwrite)
@@ -0,0 +1,466 @@
+"""Storage of PSD and TFR results in HDF5 files.
+
+Results are stored as one chunked and compressed dataset ("data", and "itc"
+for TFR) instead of one small dataset per channel. Chunks span blocks of
+channels and frequencies, which are read by the viewers (topomaps of a band,
+time-frequency maps of a channel). Frequencies, times and channels (names as
+UTF-8 strings, types as codes of a table of type names, and positions) are
+datasets, and the method and parameters are attributes of the file.
+
+Files written by previous versions (lists of channels written with h5io) are
+read as well.
+
+Files are read through a ResultStore, which opens them for reading only, so
+that they can be shared by viewers and batch processes. Results can also be
+read lazily: data are then LazyArray objects, which read only the parts of
+the file used by the viewers (e.g. a channel or a frequency band), so that
+opening large results is immediate.
+"""
+from functools import lru_cache
+import json
+import os
+
+import h5py
+import numpy as np
+
+FORMAT = 'mnelab-results'
+VERSION = 3
+
+# maximum size of a chunk of data (in bytes)
+CHUNK_NBYTES = 1024 ** 2
+
+# size of the cache of chunks of each dataset read lazily (in bytes)
+CACHE_NBYTES = 64 * 1024 ** 2
+
+# order of the axes of the data of each kind of result
+AXES = {'epochs_psd': ('epoch', 'channel', 'frequency'),
+        'raw_psd': ('channel', 'frequency'),
+        'tfr': ('channel', 'frequency', 'time')}
+
+
+# ---------------------------------------------------------------------
+def _chunks(shape, itemsize, axes, nbytes=CHUNK_NBYTES):
+    """Return the chunk shape of data with the given axes
+
+    Chunks are split along channels first, then along frequencies, and then
+    along the other axes until they are smaller than nbytes.
+    """
+    chunks = list(shape)
+    order = ([axes.index('channel'), axes.index('frequency')]
+             + [i for i, axis in enumerate(axes)
+                if axis not in ('channel', 'frequency')])
+    for axis in order:
+        while chunks[axis] > 1 and np.prod(chunks) * itemsize > nbytes:
+            chunks[axis] = -(-chunks[axis] // 2)
+    return tuple(max(1, n) for n in chunks)
+
+
+# ---------------------------------------------------------------------
+@lru_cache(maxsize=1)
+def _channel_type_table():
+    """Return the channel types of MNE and their rules
+
+    Rules of each type (in the order of mne.io.pick.get_channel_types) are
+    pairs of a field of the channels and an array of accepted values.
+    """
+    from mne.io.pick import get_channel_types
+
+    return tuple((ch_type, tuple((key, np.atleast_1d(values))
+                                 for key, values in rules.items()))
+                 for ch_type, rules in get_channel_types().items())
+
+
+# ---------------------------------------------------------------------
+def _channel_types(fields):
+    """Return the types of channels from arrays of their fields
+
+    fields maps the fields of the rules ('kind', 'unit', 'coil_type') to
+    arrays of values of all channels (NaN if unknown). Channels which match
+    no rule are 'misc'.
+    """
+    n_channels = len(fields['kind'])
+    types = np.full(n_channels, 'misc', dtype=object)
+    unknown = np.ones(n_channels, dtype=bool)
+    for ch_type, rules in _channel_type_table():
+        match = unknown.copy()
+        for key, values in rules:
+            match &= np.isin(fields[key], values)
+        types[match] = ch_type
+        unknown &= ~match
+    return types.tolist()
+
+
+# ---------------------------------------------------------------------
+def _channels(info):
+    """Return names, types and positions of the channels of info"""
+    chs = info['chs']
+    keys = {key for _, rules in _channel_type_table() for key, _ in rules}
+    fields = {key: np.array([ch.get(key, np.nan) for ch in chs], dtype=float)
+              for key in keys}
+    locs = np.array([ch['loc'][:3] for ch in chs], dtype=float)
+    return (list(info['ch_names']), _channel_types(fields),
+            locs.reshape(len(chs), 3))
+
+
+# ---------------------------------------------------------------------
+def _encode(strings):
+    """Return strings as an array of fixed-length UTF-8 strings"""
+    return np.char.encode(np.array(strings, dtype=str).reshape(-1), 'utf-8')
+
+
+# ---------------------------------------------------------------------
+def _decode_strings(array):
+    """Return a list of strings from an array of (UTF-8) strings"""
+    array = np.asarray(array)
+    if array.dtype.kind == 'S':
+        array = np.char.decode(array, 'utf-8')
+    return array.astype(str).tolist()
+
+
+# ---------------------------------------------------------------------
+def write_results(path, kind, data, freqs, info, method, parameters=None,
+                  times=None, itc=None, avg_data=None, overwrite=True):
+    """Write PSD or TFR results to an hdf5 file
+
+    Parameters
+    ----------
+    path : str
+        The file name.
+    kind : str
+        'epochs_psd', 'raw_psd' or 'tfr' (see AXES for the shape of data).
+    data : ndarray
+        The PSD or the TFR power.
+    freqs : ndarray
+        The frequencies.
+    info : mne.Info
+        Info of the channels of data.
+    method : str
+        The method of the computation.
+    parameters : dict | None
+        The parameters of the computation (must be serializable as JSON,
+        arrays are stored as lists).
+    times : ndarray | None
+        The times (TFR).
+    itc : ndarray | None
+        The inter-trial coherence (TFR of epochs).
+    avg_data : ndarray | None
+        The PSD averaged over epochs.
+    overwrite : bool
+        If False, an existing file is not replaced.
+
+    Notes
+    -----
+    Results are written to a temporary file which then replaces path, so
+    that readers never see a partially written file. On Windows, a file
+    cannot be replaced while it is open (e.g. read lazily by a viewer or a
+    ResultStore), which raises a PermissionError.
+    """
+    if not overwrite and os.path.exists(path):
+        raise IOError('Destination file exists: {}'.format(path))
+    names, types, locs = _channels(info)
+    type_names, type_codes = np.unique(np.array(types, dtype=str),
+                                       return_inverse=True)
+    # readers of the previous file see it entirely until it is replaced
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with h5py.File(tmp, 'w') as f:
+            f.attrs['format'] = FORMAT
+            f.attrs['version'] = VERSION
+            f.attrs['kind'] = kind
+            f.attrs['method'] = method
+            f.attrs['parameters'] = json.dumps(
+                parameters or {}, default=lambda obj: obj.tolist())
+            f['ch_names'] = _encode(names)
+            f['ch_type_names'] = _encode(type_names)
+            f['ch_types'] = type_codes.astype(np.uint8)
+            f['locs'] = locs
+            f['freqs'] = np.asarray(freqs)
+            if times is not None:
+                f['times'] = np.asarray(times)
+            for name, array in (('data', data), ('itc', itc)):
+                if array is not None:
+                    array = np.asarray(array)
+                    f.create_dataset(
+                        name, data=array, compression='gzip', shuffle=True,
+                        chunks=_chunks(array.shape, array.dtype.itemsize,
+                                       AXES[kind]))
+            if avg_data is not None:
+                f['avg_data'] = np.asarray(avg_data)
+        try:
+            os.replace(tmp, path)
+        except PermissionError as e:
+            raise PermissionError(
+                'Cannot replace {}, close it if it is open (e.g. in a '
+                'viewer) and save again ({})'.format(path, e)) from e
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+# ---------------------------------------------------------------------
+class LazyArray:
+    """Array of an hdf5 dataset which is read on demand
+
+    Indexing reads only the selected part of the dataset. Indices are those of
+    numpy (integers, slices, lists or arrays of indices, which select the
+    product of all lists), and np.asarray reads the whole dataset.
+    """
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    @property
+    def shape(self):
+        return self.dataset.shape
+
+    @property
+    def ndim(self):
+        return self.dataset.ndim
+
+    @property
+    def dtype(self):
+        return self.dataset.dtype
+
+    @property
+    def size(self):
+        return self.dataset.size
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __array__(self, dtype=None):
+        array = self.dataset[()]
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        if any(item is Ellipsis for item in index):
+            i = [item is Ellipsis for item in index].index(True)
+            index = (index[:i] + (slice(None),) * (self.ndim - len(index) + 1)
+                     + index[i + 1:])
+        index = index + (slice(None),) * (self.ndim - len(index))
+
+        # h5py reads increasing slices, lists are then selected in memory
+        selection, lists = [], []
+        for item, n in zip(index, self.shape):
+            if isinstance(item, (int, np.integer)):
+                selection.append(int(item) + n if item < 0 else int(item))
+                continue
+            if isinstance(item, slice):
+                if item.step is None or item.step > 0:
+                    selection.append(item)
+                    continue
+                item = np.arange(*item.indices(n))
+            item = np.asarray(item)
+            if item.dtype == bool:
+                item = np.flatnonzero(item)
+            item = item.astype(int)
+            item = np.where(item < 0, item + n, item)
+            start = int(item.min()) if item.size else 0
+            stop = int(item.max()) + 1 if item.size else 0
+            lists.append((len(selection) - sum(isinstance(x, int)
+                                               for x in selection),
+                          item - start))
+            selection.append(slice(start, stop))
+        data = self.dataset[tuple(selection)]
+        for axis, item in lists:
+            data = np.take(data, item, axis=axis)
+        return data
+
+
+# ---------------------------------------------------------------------
+def _open(path, cache_nbytes=CACHE_NBYTES):
+    """Open an hdf5 file for reading only (SWMR, without file locking)"""
+    try:
+        return h5py.File(path, 'r', swmr=True, locking=False,
+                         rdcc_nbytes=cache_nbytes)
+    except TypeError:  # h5py < 3.5 cannot disable file locking
+        return h5py.File(path, 'r', swmr=True, rdcc_nbytes=cache_nbytes)
+
+
+# ---------------------------------------------------------------------
+class ResultStore:
+    """Read-only access to a file of PSD or TFR results
+
+    The file is opened in SWMR read mode, without write access or file lock,
+    so that the same results can be read by several viewers and batch
+    processes at the same time. Use the store as a context manager, or call
+    close once its results are no longer needed (lazy arrays cannot be read
+    after the store is closed).
+
+    Parameters
+    ----------
+    path : str
+        The file name.
+    cache_nbytes : int
+        Size of the cache of chunks of each dataset (in bytes).
+    """
+    def __init__(self, path, cache_nbytes=CACHE_NBYTES):
+        self.path = path
+        self.file = _open(path, cache_nbytes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def closed(self):
+        return not self.file
+
+    @property
+    def legacy(self):
+        """True if results are stored in the layout of previous versions"""
+        return self.file.attrs.get('format') != FORMAT
+
+    def read(self, lazy=False):
+        """Read the results (see read_results)
+
+        If lazy is True, data and itc are LazyArray objects (except for files
+        of previous versions), which read the file until the store is closed.
+        """
+        if self.closed:
+            raise ValueError('Results store of {} is closed.'
+                             .format(self.path))
+        if self.legacy:
+            return _read_legacy_results(self.file)
+        return _read_results(self.file, lazy=lazy)
+
+    def close(self):
+        """Close the file (lazy arrays can no longer be read)"""
+        if not self.closed:
+            self.file.close()
+
+
+# ---------------------------------------------------------------------
+def read_results(path):
+    """Read PSD or TFR results from an hdf5 file (any layout)
+
+    Use ResultStore to read results lazily.
+
+    Returns
+    -------
+    results : dict
+        With keys 'kind', 'method', 'parameters' (dict), 'freqs', 'times',
+        'data', 'itc', 'avg_data' (None if not stored), 'ch_names',
+        'ch_types' and 'locs' (positions of the channels).
+    """
+    with ResultStore(path) as store:
+        return store.read()
+
+
+# ---------------------------------------------------------------------
+def open_results(path, kind, lazy=False):
+    """Read results of a given kind from an hdf5 file
+
+    Returns
+    -------
+    results : dict
+        The results (see read_results).
+    store : ResultStore | None
+        The open store of results read lazily, which must be closed once the
+        results are no longer used (None if results are read in memory).
+    """
+    store = ResultStore(path)
+    try:
+        results = store.read(lazy=lazy)
+        if results['kind'] != kind:
+            raise ValueError('{} contains {} results, not {}.'
+                             .format(path, results['kind'], kind))
+    except Exception:
+        store.close()
+        raise
+    if not lazy or store.legacy:
+        store.close()
+        return results, None
+    return results, store
+
+
+# ---------------------------------------------------------------------
+def _read_results(f, lazy=False):
+    """Read results in the layout of write_results"""
+    def read(name, lazy=False):
+        if name not in f:
+            return None
+        return LazyArray(f[name]) if lazy else f[name][()]
+
+    # channels are attributes in version 2 (types as strings)
+    channels = f if 'ch_names' in f else f.attrs
+    types = channels['ch_types'][()]
+    if types.dtype.kind in 'iu':
+        type_names = np.array(_decode_strings(channels['ch_type_names'][()]),
+                              dtype=object)
+        types = type_names[types]
+    return dict(kind=f.attrs['kind'], method=f.attrs['method'],
+                parameters=json.loads(f.attrs['parameters']),
+                freqs=read('freqs'), times=read('times'),
+                data=read('data', lazy), itc=read('itc', lazy),
+                avg_data=read('avg_data'),
+                ch_names=_decode_strings(channels['ch_names'][()]),
+                ch_types=_decode_strings(types),
+                locs=np.asarray(channels['locs'][()], dtype=float))
+
+
+# ---------------------------------------------------------------------
+def _decode(dataset):
+    """Decode a string written by h5io (array of UTF-8 bytes)"""
+    return np.asarray(dataset[()], dtype=np.uint8).tobytes().decode('utf-8')
+
+
+# ---------------------------------------------------------------------
+def _sorted_items(group):
+    """Return the items of a list written by h5io in order"""
+    return [group[key] for key in
+            sorted(group.keys(), key=lambda key: int(key.split('_')[1]))]
+
+
+# ---------------------------------------------------------------------
+def _legacy_fields(chs):
+    """Return the fields of the channel type rules of channels written by h5io
+
+    Fields other than the kind are only read for channels of the kinds whose
+    rules use them (e.g. the unit of MEG channels).
+    """
+    def read(chs, key):
+        return np.array([ch['key_' + key][()][0] if 'key_' + key in ch
+                         else np.nan for ch in chs], dtype=float)
+
+    table = [dict(rules) for _, rules in _channel_type_table()]
+    fields = dict(kind=read(chs, 'kind'))
+    for key in {key for rules in table for key in rules} - {'kind'}:
+        kinds = np.concatenate([rules['kind'] for rules in table
+                                if key in rules])
+        indices = np.flatnonzero(np.isin(fields['kind'], kinds))
+        fields[key] = np.full(len(chs), np.nan)
+        fields[key][indices] = read([chs[i] for i in indices], key)
+    return fields
+
+
+# ---------------------------------------------------------------------
+def _read_legacy_results(f):
+    """Read results written by previous versions (one list per channel)"""
+    dic = f['mnepython']
+    chs = _sorted_items(dic['key_info']['key_chs'])
+    names = [_decode(ch['key_ch_name']) for ch in chs]
+    locs = [ch['key_loc'][()][0:3] for ch in chs]
+
+    times = dic['key_times'][()] if 'key_times' in dic else None
+    channels = _sorted_items(dic['key_data'])
+    if times is not None:
+        kind = 'tfr'
+        data = np.stack([ch['key_tfr'][()] for ch in channels])
+        itc = None
+        if all('key_itc' in ch for ch in channels):
+            itc = np.stack([ch['key_itc'][()] for ch in channels])
+    else:
+        # channel data are stored as [name, data] lists
+        data = np.stack([ch['idx_1'][()] for ch in channels], axis=-2)
+        kind = 'epochs_psd' if data.ndim == 3 else 'raw_psd'
+        itc = None
+    avg_data = dic['key_avg_data'][()] if 'key_avg_data' in dic else None
+    return dict(kind=kind, method=_decode(dic['key_method']), parameters={},
+                freqs=dic['key_freqs'][()], times=times, data=data, itc=itc,
+                avg_data=avg_data, ch_names=names,
+                ch_types=_channel_types(_legacy_fields(chs)),
+                locs=np.array(locs, dtype=float).reshape(len(names), 3))
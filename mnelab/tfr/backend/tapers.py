@@ -0,0 +1,180 @@
+"""Cache of DPSS tapers shared by multitaper PSD and TFR computations.
+
+MNE computes the tapers (an eigenvalue problem) for each call of
+psd_multitaper, and for each frequency and taper of tfr_multitaper. The
+multitaper PSD and TFR of MNELAB use the tapers of dpss_windows instead,
+which are computed once for each combination of length (number of time
+points, which depends on the sampling frequency and the number of cycles),
+bandwidth and number of tapers, and then reused by all computations of the
+process (MNE itself is not modified).
+"""
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+try:
+    from scipy.fft import rfft, rfftfreq
+except ImportError:  # scipy < 1.4
+    from numpy.fft import rfft, rfftfreq
+
+# maximum size of all cached tapers (least recently used tapers are removed)
+MAX_NBYTES = 64 * 1024 ** 2
+
+# maximum size of the tapered segments of signals transformed at once
+BLOCK_SIZE = 64 * 1024 ** 2
+
+_cache = OrderedDict()
+_lock = threading.RLock()
+
+
+# ---------------------------------------------------------------------
+def dpss_windows(N, half_nbw, Kmax, low_bias=True, interp_from=None,
+                 interp_kind='linear'):
+    """Return DPSS tapers and eigenvalues (cached)
+
+    Parameters are those of mne.time_frequency.multitaper.dpss_windows. The
+    returned arrays are read-only, since they are shared.
+    """
+    key = (int(N), float(half_nbw), int(Kmax), bool(low_bias), interp_from,
+           interp_kind)
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    from mne.time_frequency import multitaper
+
+    tapers, eigvals = multitaper.dpss_windows(
+        N, half_nbw, Kmax, low_bias=low_bias, interp_from=interp_from,
+        interp_kind=interp_kind)
+    tapers.flags.writeable = False
+    eigvals.flags.writeable = False
+    with _lock:
+        _cache[key] = tapers, eigvals
+        nbytes = sum(t.nbytes + e.nbytes for t, e in _cache.values())
+        while nbytes > MAX_NBYTES and len(_cache) > 1:
+            old_tapers, old_eigvals = _cache.popitem(last=False)[1]
+            nbytes -= old_tapers.nbytes + old_eigvals.nbytes
+    return tapers, eigvals
+
+
+# ---------------------------------------------------------------------
+def multitaper_wavelets(sfreq, freqs, n_cycles, time_bandwidth=4.,
+                        zero_mean=True):
+    """Return the wavelets of tfr_multitaper (with cached tapers)
+
+    Returns
+    -------
+    Ws : list of list of ndarray
+        The wavelets of each taper and frequency.
+    """
+    from scipy import linalg
+
+    if time_bandwidth < 2.0:
+        raise ValueError("time_bandwidth should be >= 2.0 for good tapers")
+    n_taps = int(np.floor(time_bandwidth - 1))
+    n_cycles = np.broadcast_to(np.atleast_1d(n_cycles), (len(freqs),))
+    Ws = [[] for _ in range(n_taps)]
+    for f, cycles in zip(freqs, n_cycles):
+        t_win = cycles / float(f)
+        t = np.arange(0., t_win, 1.0 / sfreq)
+        # wavelets are centered before tapering
+        oscillation = np.exp(2.0 * 1j * np.pi * f * (t - t_win / 2.))
+        tapers, _ = dpss_windows(t.shape[0], time_bandwidth / 2., n_taps)
+        for m in range(n_taps):
+            Wk = oscillation * tapers[m]
+            if zero_mean:
+                Wk -= Wk.mean()
+            Wk /= np.sqrt(0.5) * linalg.norm(Wk.ravel())
+            Ws[m].append(Wk)
+    return Ws
+
+
+# ---------------------------------------------------------------------
+def psd_array_multitaper(x, sfreq, fmin=0, fmax=np.inf, bandwidth=None,
+                         normalization='length', block_size=BLOCK_SIZE):
+    """Compute the PSD of an array with DPSS tapers (cached)
+
+    Results are those of mne.time_frequency.psd_array_multitaper with
+    adaptive=False and low_bias=True. Signals are transformed in blocks of
+    at most block_size bytes of tapered segments.
+
+    Returns
+    -------
+    psds : ndarray, shape (..., n_freqs)
+        The power spectral densities.
+    freqs : ndarray, shape (n_freqs,)
+        The frequencies.
+    """
+    if normalization not in ('length', 'full'):
+        raise ValueError("normalization must be 'length' or 'full', got {}"
+                         .format(normalization))
+    shape, n_times = x.shape[:-1], x.shape[-1]
+    x = x.reshape(-1, n_times)
+    half_nbw = 4.
+    if bandwidth is not None:
+        half_nbw = float(bandwidth) * n_times / (2. * sfreq)
+    if half_nbw < 0.5:
+        raise ValueError('bandwidth value {} yields a normalized bandwidth of '
+                         '{} < 0.5, use a value of at least {}'
+                         .format(bandwidth, half_nbw, sfreq / n_times))
+    tapers, eigvals = dpss_windows(n_times, half_nbw, int(2 * half_nbw))
+
+    freqs = rfftfreq(n_times, 1. / sfreq)
+    freq_mask = (freqs >= fmin) & (freqs <= fmax)
+    # one-sided density, all frequencies except 0 and Nyquist count twice
+    scale = np.full(len(freqs), 2. / eigvals.sum())
+    scale[0] /= 2
+    if n_times % 2 == 0:
+        scale[-1] /= 2
+    if normalization == 'full':
+        scale /= sfreq
+    scale = scale[freq_mask]
+    weights = np.sqrt(eigvals)[:, np.newaxis]
+
+    psds = np.empty((len(x), freq_mask.sum()))
+    n_block = max(1, block_size // (len(tapers) * n_times * 16))
+    for start in range(0, len(x), n_block):
+        block = x[start:start + n_block]
+        block = block - block.mean(axis=-1, keepdims=True)
+        spectra = rfft(block[:, np.newaxis] * tapers, axis=-1)[..., freq_mask]
+        psds[start:start + n_block] = ((np.abs(weights * spectra) ** 2)
+                                       .sum(axis=1) * scale)
+    return psds.reshape(shape + (-1,)), freqs[freq_mask]
+
+
+# ---------------------------------------------------------------------
+def psd_multitaper(inst, fmin=0, fmax=np.inf, tmin=None, tmax=None,
+                   bandwidth=None, picks=None, normalization='length'):
+    """Compute the PSD of raw, epochs or evoked data with DPSS tapers
+
+    Results are those of mne.time_frequency.psd_multitaper with
+    adaptive=False and low_bias=True, but the tapers are cached.
+    """
+    import mne
+    from mne.io.pick import _picks_to_idx
+
+    picks = _picks_to_idx(inst.info, picks, 'data', with_ref_meg=False)
+    times = inst.times
+    mask = np.ones(len(times), dtype=bool)
+    if tmin is not None:
+        mask &= times >= tmin - 0.5 / inst.info['sfreq']
+    if tmax is not None:
+        mask &= times <= tmax + 0.5 / inst.info['sfreq']
+    start, stop = np.where(mask)[0][[0, -1]]
+    if isinstance(inst, mne.io.BaseRaw):
+        data = inst.get_data(picks, start, stop + 1)
+    elif isinstance(inst, mne.BaseEpochs):
+        data = inst.get_data()[:, picks, start:stop + 1]
+    else:
+        data = inst.data[picks, start:stop + 1]
+    return psd_array_multitaper(data, inst.info['sfreq'], fmin=fmin,
+                                fmax=fmax, bandwidth=bandwidth,
+                                normalization=normalization)
+
+
+# ---------------------------------------------------------------------
+def clear_taper_cache():
+    """Remove all cached tapers"""
+    with _lock:
+        _cache.clear()
@@ -1,9 +1,13 @@
+from os import cpu_count
+
 from PyQt5.QtWidgets import (QLineEdit, QLabel, QComboBox)
-from PyQt5.QtCore import Qt
-import multiprocessing as mp
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtGui import QIntValidator
 
 from ..app.error import show_error
 from ...dialogs.calcdialog import CalcDialog
+from ...utils.pool import apply_async, restart_pool
+from ...utils.shared import SharedProgress
 
 
 # Miscellaneous functions for reading, saving and initializing parameters
@@ -45,7 +49,7 @@ def _init_psd_parameters(self):
     self.tmin.setText('{:2.1f}'.format(self.data.times[0]))
     self.tmax.setText('{:2.1f}'.format(self.data.times[-1]))
 
-    if self.ui.psdMethod.currentText() == 'welch':
+    if self.ui.psdMethod.currentText() in ('welch', 'welch_fast'):
         self.ui.labels.addWidget(QLabel('FFT points'))
         self.ui.labels.addWidget(QLabel('Length of segments (points)'))
         self.ui.labels.addWidget(QLabel('Overlapping of segments (points)'))
@@ -58,6 +62,12 @@ def _init_psd_parameters(self):
         self.n_fft.setText(str(min(len(self.data.times), 2048)))
         self.n_per_seg.setText(str(int(int(self.n_fft.text()) / 2)))
         self.n_overlap.setText(str(int(int(self.n_fft.text()) / 4)))
+    if self.ui.psdMethod.currentText() == 'welch_fast':
+        self.ui.labels.addWidget(QLabel('Precision'))
+        self.dtype = QComboBox()
+        self.dtype.addItem('float64')
+        self.dtype.addItem('float32')
+        self.ui.lines.addWidget(self.dtype)
     if self.ui.psdMethod.currentText() == 'multitaper':
         self.ui.labels.addWidget(QLabel('Bandwidth (Hz)'))
         self.bandwidth = QLineEdit()
@@ -125,6 +135,11 @@ def _init_tfr_parameters(self):
         self.ui.lines.addWidget(self.n_fft)
         self.width.setText('1')
         self.n_fft.setText(str(min(len(self.data.times), 2048)))
+    self.ui.labels.addWidget(QLabel('Parallel jobs (channels)'))
+    self.n_jobs = QLineEdit()
+    self.n_jobs.setValidator(QIntValidator(1, cpu_count() or 1))
+    self.ui.lines.addWidget(self.n_jobs)
+    self.n_jobs.setText('1')
 
 
 # ---------------------------------------------------------------------
@@ -175,10 +190,12 @@ def _read_psd_parameters(self):
         self.params['tmax'] = float(self.tmax.text())
         if self.ui.psdMethod.currentText() == 'multitaper':
             self.params['bandwidth'] = float(self.bandwidth.text())
-        if self.ui.psdMethod.currentText() == 'welch':
+        if self.ui.psdMethod.currentText() in ('welch', 'welch_fast'):
             self.params['n_fft'] = int(self.n_fft.text())
             self.params['n_per_seg'] = int(self.n_per_seg.text())
             self.params['n_overlap'] = int(self.n_overlap.text())
+        if self.ui.psdMethod.currentText() == 'welch_fast':
+            self.params['dtype'] = self.dtype.currentText()
 
     except Exception as e:  # Print exception for parameters
         print(e)
@@ -214,6 +231,7 @@ def _read_tfr_parameters(self):
             self.params['n_fft'] = int(self.n_fft.text())
             self.params['time_window'] = None
             self.params['n_cycles'] = None
+        self.params['n_jobs'] = max(1, int(self.n_jobs.text() or 1))
 
     except Exception as e:  # Print exception for parameters
         print(e)
@@ -224,17 +242,18 @@ def _init_epochs_psd(self):
     """Initialize the instance of EpochsPSD."""
     from .epochs_psd import EpochsPSD
 
-    if self.ui.psdMethod.currentText() == 'welch':
+    if self.ui.psdMethod.currentText() in ('welch', 'welch_fast'):
         n_fft = self.params['n_fft']
         kwds = dict(epochs=self.data,
                     fmin=self.params['fmin'],
                     fmax=self.params['fmax'],
                     tmin=self.params['tmin'],
                     tmax=self.params['tmax'],
-                    method='welch',
+                    method=self.ui.psdMethod.currentText(),
                     n_fft=n_fft,
                     n_per_seg=self.params.get('n_per_seg', n_fft),
                     n_overlap=self.params.get('n_overlap', 0),
+                    dtype=self.params.get('dtype', 'float64'),
                     type=self.ui.typeBox.currentText())
 
     if self.ui.psdMethod.currentText() == 'multitaper':
@@ -251,14 +270,13 @@ def _init_epochs_psd(self):
                       "Computing Power Spectrum Density...")
     calc.resize(300, 100)
     calc.setWindowFlags(Qt.Dialog | Qt.FramelessWindowHint)
-    pool = mp.Pool(1)
     psd = EpochsPSD()
-    res = pool.apply_async(func=psd.init,
-                           kwds=kwds,
-                           callback=lambda x: calc.accept())
+    res = apply_async(func=psd.init,
+                      kwds=kwds,
+                      callback=lambda x: calc.accept())
 
     if not calc.exec_():
-        pool.terminate()
+        restart_pool()
 
     self.psd = res.get(timeout=1)
 
@@ -268,16 +286,17 @@ def _init_raw_psd(self):
     """Initialize the instance of RawPSD."""
     from .raw_psd import RawPSD
 
-    if self.ui.psdMethod.currentText() == 'welch':
+    if self.ui.psdMethod.currentText() in ('welch', 'welch_fast'):
         kwds = dict(raw=self.data,
                     fmin=self.params['fmin'],
                     fmax=self.params['fmax'],
                     tmin=self.params['tmin'],
                     tmax=self.params['tmax'],
-                    method='welch',
+                    method=self.ui.psdMethod.currentText(),
                     n_fft=self.params.get('n_fft', 2048),
                     n_per_seg=self.params.get('n_per_seg', 2048),
                     n_overlap=self.params.get('n_overlap', 0),
+                    dtype=self.params.get('dtype', 'float64'),
                     type=self.ui.typeBox.currentText())
 
     if self.ui.psdMethod.currentText() == 'multitaper':
@@ -294,14 +313,13 @@ def _init_raw_psd(self):
                       "Computing Power Spectrum Density...")
     calc.resize(300, 100)
     calc.setWindowFlags(Qt.Dialog | Qt.FramelessWindowHint)
-    pool = mp.Pool(1)
     psd = RawPSD()
-    res = pool.apply_async(func=psd.init,
-                           kwds=kwds,
-                           callback=lambda x: calc.accept())
+    res = apply_async(func=psd.init,
+                      kwds=kwds,
+                      callback=lambda x: calc.accept())
 
     if not calc.exec_():
-        pool.terminate()
+        restart_pool()
 
     self.psd = res.get(timeout=1)
 
@@ -355,24 +373,37 @@ def _init_avg_tfr(self):
                       "Computing Time-Frequency...")
     calc.resize(300, 100)
     calc.setWindowFlags(Qt.Dialog | Qt.FramelessWindowHint)
-    pool = mp.Pool(1)
+
+    # count of computed channels (of each block of epochs), updated while the
+    # worker is running
+    progress = SharedProgress()
+    timer = QTimer(calc)
+    timer.timeout.connect(lambda: calc.label.setText(
+        'Computing Time-Frequency... ({}%)'
+        .format(100 * progress.done // max(progress.total, 1))))
+    timer.start(200)
 
     avgTFR = AvgEpochsTFR()
     args = (self.data, freqs, n_cycles)
     kwds = dict(method=self.ui.tfrMethodBox.currentText(),
                 time_bandwidth=self.params.get('time_bandwidth', 4),
                 width=self.params.get('width', 1),
-                n_fft=n_fft, type=self.ui.typeBox.currentText())
+                n_fft=n_fft, type=self.ui.typeBox.currentText(),
+                n_jobs=self.params.get('n_jobs', 1), progress=progress)
 
-    res = pool.apply_async(func=avgTFR.init,
-                           args=args,
-                           kwds=kwds,
-                           callback=lambda x: calc.accept())
+    res = apply_async(func=avgTFR.init,
+                      args=args,
+                      kwds=kwds,
+                      callback=lambda x: calc.accept())
 
-    if not calc.exec_():
-        pool.terminate()
+    try:
+        if not calc.exec_():
+            restart_pool()
 
-    self.avgTFR = res.get(timeout=1)
+        self.avgTFR = res.get(timeout=1)
+    finally:
+        timer.stop()
+        progress.unlink()
 
 
 # ---------------------------------------------------------------------
@@ -15,6 +15,30 @@ def eeg_to_montage(eeg):
         return None
 
 
+# ---------------------------------------------------------------------
+def channels_layout(names, locs):
+    """Returns the info, 2D positions and head_pos of EEG channels at locs
+
+    Positions are those of the montage of locs. Locations are set in the
+    channels of info directly, which is much faster for many channels than
+    applying the montage with mne.create_info.
+    """
+    from numpy import arange, zeros
+    from mne import create_info
+    from mne.channels import Montage
+
+    pos = Montage(locs, names, 'custom', arange(len(names))).get_pos2d()
+    scale = 1 / (pos.max(axis=0) - pos.min(axis=0))
+    center = 0.5 * (pos.max(axis=0) + pos.min(axis=0))
+
+    info = create_info(list(names), 1, ch_types='eeg')
+    ch_locs = zeros((len(names), 12))
+    ch_locs[:, :3] = locs
+    for ch, loc in zip(info['chs'], ch_locs):
+        ch['loc'] = loc
+    return info, pos, {'scale': scale, 'center': center}
+
+
 # ---------------------------------------------------------------------
 def float_(value):
     """float with handle of none values
@@ -62,3 +86,75 @@ def _annot(win, click, annot):
                 click.mouseevent.ydata)
     annot.set_visible(True)
     win.ui.canvas.draw_idle()
+
+
+# ---------------------------------------------------------------------
+def compute_psd(inst, method, fmin, fmax, tmin, tmax, picks, bandwidth=4.,
+                n_fft=256, n_per_seg=None, n_overlap=0, dtype='float64'):
+    """Compute the PSD of raw or epochs data with multitaper or welch
+    (welch_fast uses the Welch implementation of welch.py, with the precision
+    given by dtype)
+
+    Results are kept per channel in a disk cache, with a key computed from
+    the data of the channel and all parameters. When the same data is
+    analyzed again, only the spectra of channels which were not picked before
+    (or whose data have changed) are computed.
+    """
+    from numpy import ndarray, concatenate
+    from mne.time_frequency import psd_welch
+    from .tapers import psd_multitaper
+    from .welch import psd_welch_fast
+    from ...utils.cache import fingerprint, get_psd_cache
+
+    if method == 'multitaper':
+        params = dict(bandwidth=bandwidth)
+        psd_func = psd_multitaper
+        params_func = dict(params, normalization='full')
+    elif method in ('welch', 'welch_fast'):
+        params = dict(n_fft=n_fft, n_per_seg=n_per_seg, n_overlap=n_overlap)
+        psd_func = psd_welch
+        if method == 'welch_fast':
+            params['dtype'] = str(dtype)
+            psd_func = psd_welch_fast
+        params_func = params
+    else:
+        raise ValueError('Unknown PSD method: {}'.format(method))
+
+    def compute(picks):
+        return psd_func(inst, fmin=fmin, fmax=fmax, tmin=tmin, tmax=tmax,
+                        picks=picks, **params_func)
+
+    data = getattr(inst, '_data', None)
+    picks = list(picks)
+    if not isinstance(data, ndarray) or not picks:  # data not loaded
+        return compute(picks)
+
+    annotations = getattr(inst, 'annotations', None)
+    if annotations is not None:
+        annotations = (list(annotations.onset), list(annotations.duration),
+                       list(annotations.description))
+    common = fingerprint(type(inst).__name__, inst.info['sfreq'],
+                         float(inst.times[0]), getattr(inst, 'first_samp', 0),
+                         annotations, method, fmin, fmax, tmin, tmax,
+                         sorted(params.items()))
+    keys = [fingerprint(common, inst.ch_names[pick], data[..., pick, :])
+            for pick in picks]
+
+    # channel-indexed results: spectra of shape (..., n_freqs)
+    cache = get_psd_cache()
+    rows, freqs = {}, None
+    for key in keys:
+        cached = cache.get(key)
+        if cached is not None:
+            rows[key], freqs = cached['data'], cached['freqs']
+    missing = [pick for pick, key in zip(picks, keys) if key not in rows]
+    if missing:
+        psds, freqs = compute(missing)
+        computed = {}
+        for index, pick in enumerate(missing):
+            key = keys[picks.index(pick)]
+            rows[key] = psds[..., index, :]
+            computed[key] = dict(data=rows[key], freqs=freqs)
+        cache.put_many(computed)
+    psds = concatenate([rows[key][..., None, :] for key in keys], axis=-2)
+    return psds, freqs
@@ -97,26 +97,18 @@ def _plot_time_ch(self):
 # ---------------------------------------------------------------------
 def _plot_topomap_tfr(self):
     """Plot topomap for TFR window."""
-    from matplotlib.ticker import FormatStrFormatter
-
     try:
         self.ui.figure.clear()
-        ax = self.ui.figure.add_subplot(1, 1, 1)
+        gs = self.ui.figure.add_gridspec(10, 30)
+        ax = self.ui.figure.add_subplot(gs[:, :25])
         tmin, tmax = _find_values(self.avg.tfr.times, self.tmin, self.tmax)
         fmin, fmax = _find_values(self.avg.tfr.freqs, self.fmin, self.fmax)
-        fig = self.avg.tfr.plot_topomap(
-            tmin=tmin, tmax=tmax,
-            fmin=fmin, fmax=fmax,
-            vmin=self.vmin, vmax=self.vmax,
-            axes=ax, mode='logratio',
-            cmap=self.avg.cmap, show=False,
-            colorbar=True, outlines='skirt',
-            contours=3)
-        ax = fig.get_axes()[1]
-        ax.yaxis.set_major_formatter(FormatStrFormatter('%6.1e'))
-        ax.tick_params(axis='both', labelsize=10)
-        ax.set_xlabel('Power (Log Ratio)', fontsize=10)
-        ax.get_xaxis().labelpad = 15
+        self.cbar_image, _ = self.avg.plot_topomap(
+            tmin, tmax, fmin, fmax, axes=ax, vmin=self.vmin, vmax=self.vmax)
+        cax = self.ui.figure.add_subplot(gs[2:, 27])
+        cbar = plt.colorbar(self.cbar_image, cax=cax, format='%6.1e')
+        cbar.ax.tick_params(axis='both', labelsize=10)
+        cbar.ax.set_xlabel('Power', labelpad=15)
         self.ui.canvas.draw()
 
     except ValueError:
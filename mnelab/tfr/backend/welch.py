@@ -0,0 +1,174 @@
+"""Welch power spectral density of many channels at once.
+
+All channels (and epochs) are transformed together with one real FFT over
+blocks of overlapping segments, taken from strided views of the data (each
+block is copied once to be detrended and windowed). Results are the same as
+those of
+mne.time_frequency.psd_welch (Hamming window, constant detrending, segments
+with NaN values are ignored).
+"""
+from functools import lru_cache
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+try:
+    from scipy.fft import rfft
+except ImportError:  # scipy < 1.4
+    from numpy.fft import rfft
+
+# maximum size of a block of segments transformed at once (in bytes)
+BLOCK_SIZE = 64 * 1024 ** 2
+
+
+# ---------------------------------------------------------------------
+@lru_cache(maxsize=32)
+def _plan(n_fft, n_per_seg, dtype):
+    """Return the window and the scaling of the periodograms
+
+    Windows are cached for each combination of segment and FFT length and
+    precision.
+    """
+    from scipy.signal import get_window
+
+    window = get_window('hamming', n_per_seg).astype(dtype)
+    window.flags.writeable = False
+    # one-sided density, all frequencies except 0 and Nyquist count twice
+    scale = np.full(n_fft // 2 + 1, 2. / (window ** 2).sum(), dtype=dtype)
+    scale[0] /= 2
+    if n_fft % 2 == 0:
+        scale[-1] /= 2
+    scale.flags.writeable = False
+    return window, scale
+
+
+# ---------------------------------------------------------------------
+def _check_nfft(n_times, n_fft, n_per_seg, n_overlap):
+    """Check segment and FFT lengths (as mne.time_frequency.psd_welch)"""
+    if n_per_seg is None and n_fft > n_times:
+        raise ValueError('If n_per_seg is None n_fft is not allowed to be > '
+                         'n_times. Got n_fft of {} while signal length is {}.'
+                         .format(n_fft, n_times))
+    if n_per_seg is None or n_per_seg > n_fft:
+        n_per_seg = n_fft
+    n_per_seg = min(n_per_seg, n_times)
+    if n_overlap >= n_per_seg:
+        raise ValueError('n_overlap cannot be greater than n_per_seg (or '
+                         'n_fft). Got n_overlap of {} while n_per_seg is {}.'
+                         .format(n_overlap, n_per_seg))
+    return n_fft, n_per_seg, n_overlap
+
+
+# ---------------------------------------------------------------------
+def psd_array_welch_fast(x, sfreq, fmin=0, fmax=np.inf, n_fft=256,
+                         n_overlap=0, n_per_seg=None, dtype=np.float64,
+                         block_size=BLOCK_SIZE):
+    """Compute the PSD of an array with Welch's method
+
+    Parameters
+    ----------
+    x : ndarray, shape (..., n_times)
+        The data.
+    sfreq : float
+        The sampling frequency.
+    fmin, fmax : float
+        The frequency range.
+    n_fft : int
+        The length of the FFT (segments are zero-padded).
+    n_overlap : int
+        The number of points of overlap between segments.
+    n_per_seg : int | None
+        The length of the segments (defaults to n_fft).
+    dtype : dtype
+        The precision of the computation (float32 is faster and uses half
+        the memory).
+    block_size : int
+        Maximum memory (in bytes) used for the segments transformed at once.
+        Longer recordings are processed in blocks of segments.
+
+    Returns
+    -------
+    psds : ndarray, shape (..., n_freqs)
+        The power spectral densities.
+    freqs : ndarray, shape (n_freqs,)
+        The frequencies.
+    """
+    dtype = np.dtype(dtype)
+    shape, n_times = x.shape[:-1], x.shape[-1]
+    x = x.reshape(-1, n_times)
+    n_fft, n_per_seg, n_overlap = _check_nfft(n_times, n_fft, n_per_seg,
+                                              n_overlap)
+    freqs = np.arange(n_fft // 2 + 1, dtype=float) * (sfreq / n_fft)
+    freq_mask = (freqs >= fmin) & (freqs <= fmax)
+    window, scale = _plan(n_fft, n_per_seg, dtype)
+    scale = scale[freq_mask] / sfreq
+
+    # strided view of overlapping segments, shape (n_signals, n_seg, n_per_seg)
+    step = n_per_seg - n_overlap
+    n_segments = (n_times - n_overlap) // step
+    segments = as_strided(x, shape=(len(x), n_segments, n_per_seg),
+                          strides=(x.strides[0], step * x.strides[1],
+                                   x.strides[1]),
+                          writeable=False)
+
+    psds = np.zeros((len(x), freq_mask.sum()), dtype=dtype)
+    counts = np.zeros((len(x), 1))
+    per_segment = max(len(x), 1) * n_fft * dtype.itemsize * 2
+    n_block = max(1, block_size // per_segment)
+    for start in range(0, n_segments, n_block):
+        block = segments[:, start:start + n_block].astype(dtype)
+        block -= block.mean(axis=-1, keepdims=True)  # constant detrending
+        block *= window
+        spectra = np.abs(rfft(block, n=n_fft, axis=-1)[..., freq_mask]) ** 2
+        valid = np.isfinite(spectra).all(axis=-1, keepdims=True)
+        psds += np.where(valid, spectra, 0).sum(axis=1)
+        counts += valid.sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        psds = (psds * scale / counts).astype(dtype, copy=False)
+    return psds.reshape(shape + (-1,)), freqs[freq_mask]
+
+
+# ---------------------------------------------------------------------
+def psd_welch_fast(inst, fmin=0, fmax=np.inf, tmin=None, tmax=None,
+                   n_fft=256, n_overlap=0, n_per_seg=None, picks=None,
+                   dtype=np.float64, block_size=BLOCK_SIZE):
+    """Compute the PSD of raw, epochs or evoked data with Welch's method
+
+    Segments of raw data overlapping bad annotations are ignored. Epochs are
+    read and transformed in blocks of at most block_size bytes.
+    """
+    import mne
+    from mne.io.pick import _picks_to_idx
+
+    picks = _picks_to_idx(inst.info, picks, 'data', with_ref_meg=False)
+    times = inst.times
+    mask = np.ones(len(times), dtype=bool)
+    if tmin is not None:
+        mask &= times >= tmin - 0.5 / inst.info['sfreq']
+    if tmax is not None:
+        mask &= times <= tmax + 0.5 / inst.info['sfreq']
+    start, stop = np.where(mask)[0][[0, -1]]
+    params = dict(fmin=fmin, fmax=fmax, n_fft=n_fft, n_overlap=n_overlap,
+                  n_per_seg=n_per_seg, dtype=dtype, block_size=block_size)
+    sfreq = inst.info['sfreq']
+    if isinstance(inst, mne.io.BaseRaw):
+        data = inst.get_data(picks, start, stop + 1,
+                             reject_by_annotation='NaN')
+    elif isinstance(inst, mne.BaseEpochs):
+        n_epochs = len(inst.events)
+        per_epoch = len(picks) * (stop + 1 - start) * 8
+        n_block = max(1, block_size // max(per_epoch, 1))
+        psds = []
+        for first in range(0, n_epochs, n_block):
+            if inst.preload:
+                data = inst._data[first:first + n_block]
+            else:
+                data = inst[first:first + n_block].get_data()
+            data = data[:, picks, start:stop + 1]
+            block, freqs = psd_array_welch_fast(data, sfreq, **params)
+            psds.append(block)
+        return np.concatenate(psds), freqs
+    else:
+        data = inst.data[picks, start:stop + 1]
+    return psd_array_welch_fast(data, sfreq, **params)
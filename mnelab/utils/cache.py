@@ -0,0 +1,148 @@
+"""Disk cache of computed results (e.g. power spectra).
+
+Results are stored under a key computed from the data and the parameters of
+the computation, so that a result is found again whenever the same data is
+analyzed with the same parameters (even in another session). Arrays are
+identified by their shape, type and all of their values, so that a result is
+never used for data which have been modified (in place or not, in the GUI or
+in a worker process). Keys also contain the versions of the cache and of the
+libraries computing the results, so that results of previous versions are not
+used.
+"""
+from functools import lru_cache
+import hashlib
+import os
+
+import numpy as np
+
+# version of cached results, to be changed when they are computed differently
+CACHE_VERSION = 2
+
+# maximum size of the PSD cache (least recently used results are removed)
+PSD_CACHE_SIZE = 512 * 1024 ** 2
+
+_psd_cache = None
+
+
+def cache_dir():
+    """Return the folder of MNELAB caches (e.g. ~/.cache/mnelab)."""
+    base = os.environ.get('XDG_CACHE_HOME')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'mnelab')
+
+
+@lru_cache(maxsize=1)
+def _salt():
+    """Return the versions of the cache and of the libraries."""
+    import mne
+    import scipy
+
+    return 'mnelab-cache-{}-mne-{}-numpy-{}-scipy-{}'.format(
+        CACHE_VERSION, mne.__version__, np.__version__, scipy.__version__)
+
+
+def fingerprint(*items):
+    """Return a key for arrays and parameters.
+
+    Arrays are hashed (with BLAKE2b) by type, shape and values, all other
+    items by their representation.
+    """
+    key = hashlib.blake2b(digest_size=20)
+    key.update(_salt().encode())
+    for item in items:
+        if isinstance(item, np.ndarray):
+            key.update('{}{}'.format(item.dtype.str, item.shape).encode())
+            key.update(memoryview(np.ascontiguousarray(item).reshape(-1))
+                       .cast('B'))
+        else:
+            key.update(repr(item).encode())
+        key.update(b'\0')
+    return key.hexdigest()
+
+
+class DiskCache:
+    """Folder of results (sets of arrays) with a size limit.
+
+    Parameters
+    ----------
+    path : str
+        Folder of the cache (created when the first result is stored).
+    max_size : int
+        Maximum size (in bytes). When it is exceeded, the least recently used
+        results are removed.
+    """
+    def __init__(self, path, max_size=PSD_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+
+    def _fname(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def get(self, key):
+        """Return the arrays stored under key (None if not cached)."""
+        fname = self._fname(key)
+        try:
+            with np.load(fname) as npz:
+                arrays = {name: npz[name] for name in npz.files}
+            os.utime(fname)  # mark as recently used
+        except (OSError, ValueError):
+            return None
+        return arrays
+
+    def put(self, key, **arrays):
+        """Store arrays under key."""
+        self.put_many({key: arrays})
+
+    def put_many(self, results):
+        """Store several results (a dict of arrays for each key)."""
+        try:
+            os.makedirs(self.path, exist_ok=True)
+        except OSError:  # cache is not writable, results are not kept
+            return
+        for key, arrays in results.items():
+            fname = self._fname(key)
+            tmp = '{}.{}.tmp'.format(fname, os.getpid())
+            try:
+                with open(tmp, 'wb') as f:
+                    np.savez(f, **arrays)
+                os.replace(tmp, fname)
+            except OSError:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used results above the size limit."""
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.path, name))
+                except OSError:  # removed by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        size = sum(entry[1] for entry in entries)
+        for _, nbytes, name in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            size -= nbytes
+
+    def clear(self):
+        """Remove all results."""
+        if os.path.isdir(self.path):
+            for name in os.listdir(self.path):
+                if name.endswith('.npz'):
+                    os.remove(os.path.join(self.path, name))
+
+
+def get_psd_cache():
+    """Return the cache of power spectra."""
+    global _psd_cache
+    if _psd_cache is None:
+        _psd_cache = DiskCache(os.path.join(cache_dir(), 'psd'))
+    return _psd_cache
@@ -1,36 +1,62 @@
+import struct
+
+import numpy as np
+
+# number of time frames written at once by write_sef
+SEF_BLOCK_SIZE = 65536
+
+
+def write_sef(path, ch_names, sfreq, n_frames, get_block, n_aux=0,
+              block_size=SEF_BLOCK_SIZE):
+    """Write a sef file block by block.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file to write.
+    ch_names : list of str
+        Channel names (truncated to 8 characters).
+    sfreq : float
+        Sampling frequency.
+    n_frames : int
+        Total number of time frames.
+    get_block : callable
+        Called as get_block(start, stop), must return an array of shape
+        (n_channels, stop - start) with the data of these time frames.
+    n_aux : int
+        Number of auxiliary electrodes.
+    block_size : int
+        Number of time frames requested and written at once, which bounds
+        the memory used independently of n_frames.
+    """
+    n_channels = len(ch_names)
+    with open(path, 'wb') as f:
+        f.write("SE01".encode('utf-8'))
+        f.write(struct.pack('I', n_channels))
+        f.write(struct.pack('I', n_aux))
+        f.write(struct.pack('I', n_frames))
+        f.write(struct.pack('f', sfreq))
+        for k in range(7):  # date and time of the recording are not known
+            f.write(struct.pack('H', 0))
+        for name in ch_names:
+            f.write(name.encode('utf-8')[:8].ljust(8, b'\x00'))
+
+        # time frames are interleaved (one frame = one value per channel)
+        for start in range(0, n_frames, block_size):
+            stop = min(start + block_size, n_frames)
+            block = np.asarray(get_block(start, stop))
+            block.T.astype('<f4', order='C').tofile(f)
+
 
 def export_sef(path, raw):
     """Export a raw mne file to a sef file."""
-    import struct
-    import numpy as np
     import mne
 
-    n_channels = len(raw.info['ch_names'])
-    num_freq_frames = raw.n_times
     info = raw.info
-    sfreq = info['sfreq']
-    num_aux_electrodes = n_channels - len(mne.pick_types(info, meg=False, eeg=True, exclude=[""]))
-    f = open(path, 'wb')
-    f.write("SE01".encode('utf-8'))
-    f.write(struct.pack('I', n_channels))
-    f.write(struct.pack('I', num_aux_electrodes))
-    f.write(struct.pack('I', num_freq_frames))
-    f.write(struct.pack('f', sfreq))
-    f.write(struct.pack('H', 0))
-    f.write(struct.pack('H', 0))
-    f.write(struct.pack('H', 0))
-    f.write(struct.pack('H', 0))
-    f.write(struct.pack('H', 0))
-    f.write(struct.pack('H', 0))
-    f.write(struct.pack('H', 0))
-
-    ch_names = info["ch_names"]
-    for k in range(n_channels):
-        ch_name = ch_names[k]
-        ch_name = ch_name.ljust(8)
-        f.write(ch_name.encode('utf-8'))
-
-    data = raw.get_data().astype(np.float32)
-    data = np.reshape(data, n_channels * num_freq_frames, order='F')
-    data.tofile(f)
-    f.close()
+    n_channels = len(info['ch_names'])
+    num_aux_electrodes = n_channels - len(mne.pick_types(info, meg=False,
+                                                         eeg=True,
+                                                         exclude=[""]))
+    write_sef(path, info['ch_names'], info['sfreq'], raw.n_times,
+              lambda start, stop: raw.get_data(start=start, stop=stop),
+              n_aux=num_aux_electrodes)
@@ -0,0 +1,140 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
+
+
+class Job:
+    """Operation submitted to a JobExecutor.
+
+    Parameters
+    ----------
+    description : str
+        Description shown while the job is running.
+    func : callable
+        Function to run.
+    args, kwargs
+        Arguments passed to func.
+    depends_on : Job | None
+        Job which must succeed before this job runs.
+    """
+    def __init__(self, description, func, args=(), kwargs=None,
+                 depends_on=None):
+        self.description = description
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.depends_on = depends_on
+        self.result = None
+        self.error = None
+        self.cancelled = False
+        self.skipped = False
+        self.future = None
+
+
+class JobExecutor(QObject):
+    """Run jobs one after another in a background thread.
+
+    Jobs run in the order in which they were submitted, so operations which
+    depend on the results of previous ones can be queued right away (such
+    jobs are skipped if the job they depend on has failed, has been cancelled
+    or has been skipped). All signals are delivered in the thread of the
+    executor (the GUI thread).
+
+    Signals
+    -------
+    started(job)
+        A job has started.
+    finished(job)
+        A job has finished (job.result contains the return value).
+    failed(job, error)
+        A job has raised an exception.
+    progress(done, total)
+        Number of finished jobs and number of all jobs since the executor was
+        last idle.
+    """
+    started = pyqtSignal(object)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(object, object)
+    progress = pyqtSignal(int, int)
+    _done = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._jobs = []  # queued and running jobs
+        self._n_done = 0
+        self._done.connect(self._on_done)
+
+    @property
+    def busy(self):
+        """Return True if jobs are queued or running."""
+        return len(self._jobs) > 0
+
+    def submit(self, description, func, *args, depends_on=None, **kwargs):
+        """Queue a job.
+
+        If depends_on is a job which fails, is cancelled or is skipped, the
+        new job does not run (it is skipped and neither finished nor failed
+        is emitted).
+
+        Returns
+        -------
+        job : Job
+            The queued job.
+        """
+        job = Job(description, func, args, kwargs, depends_on)
+        self._jobs.append(job)
+        job.future = self._executor.submit(self._run, job)
+        self._emit_progress()
+        return job
+
+    def cancel(self):
+        """Cancel all queued jobs.
+
+        Jobs which have not started yet are removed from the queue. The running
+        job cannot be interrupted, but it is marked as cancelled.
+        """
+        for job in list(self._jobs):
+            job.cancelled = True
+            if job.future.cancel():
+                self._jobs.remove(job)
+        self._emit_progress()
+
+    def shutdown(self):
+        """Cancel queued jobs and wait for the running job to finish."""
+        self.cancel()
+        self._executor.shutdown(wait=True)
+
+    def _run(self, job):
+        """Run a job (in the background thread)."""
+        # jobs run one after another, so a dependency has run or was cancelled
+        dependency = job.depends_on
+        if dependency is not None and (dependency.error is not None or
+                                       dependency.cancelled or
+                                       dependency.skipped):
+            job.skipped = True
+            self._done.emit(job)
+            return
+        self.started.emit(job)
+        try:
+            job.result = job.func(*job.args, **job.kwargs)
+        except Exception as e:
+            job.error = e
+        self._done.emit(job)
+
+    @pyqtSlot(object)
+    def _on_done(self, job):
+        if job in self._jobs:
+            self._jobs.remove(job)
+        self._n_done += 1
+        if job.error is not None:
+            self.failed.emit(job, job.error)
+        elif not job.skipped:
+            self.finished.emit(job)
+        self._emit_progress()
+
+    def _emit_progress(self):
+        total = self._n_done + len(self._jobs)
+        self.progress.emit(self._n_done, total)
+        if not self._jobs:
+            self._n_done = 0
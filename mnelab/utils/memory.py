@@ -0,0 +1,56 @@
+"""Memory accounting of data sets from array metadata (without copies)."""
+
+import numpy as np
+
+# objects stored in a data set which can hold large arrays
+DATA_KEYS = ("raw", "epochs", "evoked", "ica", "psd", "tfr")
+
+
+def _root(array):
+    """Return the array which owns the memory of array."""
+    while isinstance(array.base, np.ndarray):
+        array = array.base
+    return array
+
+
+def buffers(obj, depth=2):
+    """Find the memory buffers held by an object.
+
+    Arrays are found among the attributes of obj and (up to depth levels) of
+    the objects it holds, e.g. the AverageTFR objects of a TFR result. Only
+    the sizes of the arrays are accessed, their data is never read.
+
+    Parameters
+    ----------
+    obj : object
+        Any object (e.g. Raw, Epochs, Evoked, ICA, PSD or TFR objects).
+    depth : int
+        How many levels of attributes are searched.
+
+    Returns
+    -------
+    buffers : dict
+        Arrays owning each buffer, keyed by their id. Views of the same array
+        are counted once, memory-mapped arrays are ignored.
+    """
+    found = {}
+    if isinstance(obj, np.ndarray):
+        root = _root(obj)
+        if not isinstance(root, np.memmap):
+            found[id(root)] = root
+    elif depth > 0 and hasattr(obj, "__dict__"):
+        for value in vars(obj).values():
+            if isinstance(value, np.ndarray):
+                found.update(buffers(value, depth))
+            elif hasattr(value, "__dict__") and not isinstance(value, type):
+                found.update(buffers(value, depth - 1))
+    return found
+
+
+def dataset_buffers(dataset):
+    """Find the memory buffers held by all objects of a data set."""
+    found = {}
+    for key in DATA_KEYS:
+        if dataset[key] is not None:
+            found.update(buffers(dataset[key]))
+    return found
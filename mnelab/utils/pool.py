@@ -0,0 +1,137 @@
+import multiprocessing as mp
+
+from .shared import share, attach, release_attached
+
+_pool = None  # worker pool of the session
+_pending = []  # results of submitted tasks (in the main process)
+_results = []  # shared arrays of the last result (in the worker process)
+
+
+def _init_worker():
+    """Import heavy modules once when a worker process starts."""
+    import numpy  # noqa: F401
+    import scipy.signal  # noqa: F401
+    import mne  # noqa: F401
+
+
+def get_pool():
+    """Return the worker pool used for computations (e.g. ICA, TFR, PSD).
+
+    The pool is started on first use and then reused for the whole session,
+    so that worker processes (and the modules they import) do not have to be
+    started again for each computation.
+
+    Returns
+    -------
+    pool : multiprocessing.pool.Pool
+        Pool with one worker process (spawned).
+    """
+    global _pool
+    if _pool is None:
+        _pool = mp.get_context("spawn").Pool(1, initializer=_init_worker)
+    return _pool
+
+
+def restart_pool():
+    """Stop running computations and start a new pool.
+
+    This is used to cancel a computation, since a task cannot be stopped
+    without terminating its worker process. The shared memory of the
+    arguments and of the results of all tasks which have not been fetched
+    with get is freed.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.terminate()
+        _pool = None
+    while _pending:
+        _pending[-1].discard()
+    return get_pool()
+
+
+def shutdown_pool():
+    """Stop the worker pool (e.g. when the application is closed)."""
+    global _pool
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+        _pool = None
+    while _pending:
+        _pending[-1].discard()
+
+
+def _call(func, args, kwds):
+    """Run a task in the worker process (see apply_async)."""
+    # results of the previous task have been attached by now
+    while _results:
+        _results.pop().close()
+    args, kwds = attach(args), attach(kwds)
+    result = func(*args, **kwds)
+    del args, kwds
+    release_attached()
+    return share(result, _results)
+
+
+class SharedResult:
+    """Result of a task submitted with apply_async."""
+    def __init__(self, result, inputs):
+        self._result = result
+        self._inputs = inputs
+        self._discarded = False
+
+    def ready(self):
+        return self._result.ready()
+
+    def get(self, timeout=None):
+        """Return the result (arrays are mapped from shared memory).
+
+        Raises multiprocessing.TimeoutError if the result is not ready after
+        timeout seconds, or if the task has been dropped by restart_pool.
+        """
+        if self._discarded:
+            raise mp.TimeoutError("The task has been cancelled")
+        try:
+            result = self._result.get(timeout)
+        finally:
+            if self._result.ready():  # arguments are no longer used
+                self.release()
+        return attach(result, unlink=True)
+
+    def discard(self):
+        """Free the shared memory of the arguments and of the result.
+
+        This is used for tasks whose result is not needed (their worker
+        process must have been terminated, see restart_pool).
+        """
+        if self._result.ready() and self._result.successful():
+            attach(self._result.get(), unlink=True)
+        self._discarded = True
+        self.release()
+
+    def release(self):
+        """Free the shared memory of the arguments."""
+        while self._inputs:
+            self._inputs.pop().unlink()
+        if self in _pending:
+            _pending.remove(self)
+
+
+def apply_async(func, args=(), kwds=None, callback=None):
+    """Run func(*args, **kwds) in the worker pool.
+
+    Large arrays in the arguments (e.g. the data of Raw or Epochs objects) and
+    in the result are passed in shared memory instead of being pickled.
+
+    Returns
+    -------
+    result : SharedResult
+        Use its get method to obtain the result.
+    """
+    inputs = []
+    args = share(tuple(args), inputs)
+    kwds = share(dict(kwds or {}), inputs)
+    result = SharedResult(
+        get_pool().apply_async(_call, (func, args, kwds), callback=callback),
+        inputs)
+    _pending.append(result)
+    return result
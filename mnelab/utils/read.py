@@ -1,47 +1,98 @@
+import struct
+
 import numpy as np
+from mne import create_info
+from mne.io import BaseRaw
+from mne.io.utils import _mult_cal_one
+
 
+def _read_sef_header(path):
+    """Read the header of a .sef file.
 
-def read_sef(path):
+    Returns
+    -------
+    header : dict
+        Number of channels, number of time frames, sampling frequency, channel
+        names and byte offset of the data block.
+    """
+    with open(path, 'rb') as f:
+        #   Read fixed part of the header
+        version = f.read(4).decode('utf-8')
+        n_channels,         = struct.unpack('I', f.read(4))
+        num_aux_electrodes, = struct.unpack('I', f.read(4))
+        num_time_frames,    = struct.unpack('I', f.read(4))
+        sfreq,              = struct.unpack('f', f.read(4))
+        # date and time of the recording (year, month, day, hour, minute,
+        # second, millisecond) are not used
+        f.read(2 * 7)
+
+        #   Read variable part of the header
+        ch_names = []
+        for k in range(n_channels):
+            name = [char for char in f.read(8).split(b'\x00')
+                    if char != b''][0]
+            ch_names.append(name.decode('utf-8').strip())
+        offset = f.tell()
+
+    return dict(version=version, n_channels=n_channels,
+                num_aux_electrodes=num_aux_electrodes,
+                num_time_frames=num_time_frames, sfreq=sfreq,
+                ch_names=ch_names, offset=offset)
+
+
+class RawSEF(BaseRaw):
+    """Raw object from a Cartool .sef file.
+
+    The data block is memory-mapped, so that only the samples that are
+    actually requested are read from disk.
+
+    Parameters
+    ----------
+    path : str
+        Path to the .sef file.
+    preload : bool | str
+        Preload data into memory (see mne.io.Raw).
+    """
+    def __init__(self, path, preload=False, verbose=None):
+        header = _read_sef_header(path)
+        n_channels = header['n_channels']
+        info = create_info(ch_names=header['ch_names'], sfreq=header['sfreq'],
+                           ch_types=['eeg' for i in range(n_channels)])
+        raw_extras = dict(n_channels=n_channels,
+                          n_times=header['num_time_frames'],
+                          offset=header['offset'])
+        super(RawSEF, self).__init__(
+            info, preload, last_samps=[header['num_time_frames'] - 1],
+            filenames=[path], raw_extras=[raw_extras], orig_format='single',
+            verbose=verbose)
+
+    def _read_segment_file(self, data, idx, fi, start, stop, cals, mult):
+        """Read a chunk of raw data."""
+        extras = self._raw_extras[fi]
+        # time frames are stored one after the other (multiplexed), the
+        # memory map is only created here so that it is never pickled
+        block = np.memmap(self._filenames[fi], dtype='<f4', mode='r',
+                          offset=extras['offset'],
+                          shape=(extras['n_times'], extras['n_channels']))
+        _mult_cal_one(data, block[start:stop].T, idx, cals, mult)
+
+
+def read_sef(path, preload=False):
     """
     Reads file with format .sef, and returns a mne.io.Raw object containing
     the data.
+
+    Parameters
+    ----------
+    path : str
+        Path to the .sef file.
+    preload : bool | str
+        If False (default), data is read from a memory-mapped view of the file
+        when needed. If True, data is loaded into memory.
+
+    Returns
+    -------
+    raw : instance of RawSEF
+        The raw data.
     """
-    from mne.io import RawArray
-    from mne import create_info
-    import struct
-    import re
-
-    f = open(path, 'rb')
-    #   Read fixed part of the headerà
-    version = f.read(4).decode('utf-8')
-    n_channels,         = struct.unpack('I', f.read(4))
-    num_aux_electrodes, = struct.unpack('I', f.read(4))
-    num_time_frames,    = struct.unpack('I', f.read(4))
-    sfreq,              = struct.unpack('f', f.read(4))
-    year,               = struct.unpack('H', f.read(2))
-    month,              = struct.unpack('H', f.read(2))
-    day,                = struct.unpack('H', f.read(2))
-    hour,               = struct.unpack('H', f.read(2))
-    minute,             = struct.unpack('H', f.read(2))
-    second,             = struct.unpack('H', f.read(2))
-    millisecond,        = struct.unpack('H', f.read(2))
-
-    #   Read variable part of the header
-    ch_names = []
-    for k in range(n_channels):
-        name = [char for char in f.read(8).split(b'\x00')
-                if char != b''][0]
-        ch_names.append(name.decode('utf-8'))
-
-    # Read data
-    buffer = np.frombuffer(
-        f.read(n_channels * num_time_frames * 8),
-        dtype=np.float32,
-        count=n_channels * num_time_frames)
-    data = np.reshape(buffer, (num_time_frames, n_channels))
-
-    ch_types = ['eeg' for i in range(n_channels)]
-    infos = create_info(
-        ch_names=ch_names, sfreq=sfreq,
-        ch_types=ch_types)
-    return RawArray(np.transpose(data), infos)
+    return RawSEF(path, preload=preload)
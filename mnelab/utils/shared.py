@@ -0,0 +1,230 @@
+"""Transport of large arrays to and from worker processes in shared memory.
+
+Arrays held by the arguments of a task (e.g. the data of Raw or Epochs
+objects) and by its result (e.g. the power of a TFR) are replaced by
+SharedArray references before pickling. The receiving process maps the same
+memory instead of unpickling a copy of the data.
+"""
+from copy import copy
+import struct
+import threading
+import weakref
+
+import numpy as np
+
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:  # Python < 3.8, arrays are pickled
+    have_shared_memory = False
+else:
+    have_shared_memory = True
+
+# smaller arrays are pickled
+MIN_NBYTES = 1024 ** 2
+
+_attached = []  # (array reference, shared memory) attached in this process
+
+
+class SharedArray:
+    """Picklable reference to a copy of an array in shared memory.
+
+    Parameters
+    ----------
+    array : ndarray
+        The array to copy into shared memory.
+    """
+    def __init__(self, array):
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self._shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.name = self._shm.name
+        view = np.ndarray(self.shape, self.dtype, buffer=self._shm.buf)
+        view[...] = array
+        del view
+
+    def __getstate__(self):
+        return dict(shape=self.shape, dtype=self.dtype, name=self.name)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = None
+
+    def attach(self, unlink=False):
+        """Map the shared memory as an array.
+
+        The memory is released when the array is no longer used (see
+        release_attached). If unlink is True, the shared memory is freed as
+        soon as it is no longer mapped by any process.
+        """
+        release_attached()
+        shm = SharedMemory(name=self.name)
+        if unlink:
+            shm.unlink()
+        array = np.ndarray(self.shape, self.dtype, buffer=shm.buf)
+        _attached.append((weakref.ref(array), shm))
+        return array
+
+    def close(self):
+        """Close the shared memory in the process which created it."""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def unlink(self):
+        """Free the shared memory in the process which created it."""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+
+class SharedProgress:
+    """Progress of a task (steps done and total) shared with worker processes.
+
+    The task (which may run in a worker process and update the progress from
+    several threads) calls start and update, while the process which created
+    the object reads done and total (e.g. to show a progress count). Without
+    shared memory (Python < 3.8), the progress is not seen by other
+    processes.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = [0, 0]
+        self._shm = None
+        self.name = None
+        if have_shared_memory:
+            self._shm = SharedMemory(create=True, size=16)
+            self.name = self._shm.name
+            self._write(0, 0)
+
+    def __getstate__(self):
+        return dict(name=self.name, _values=self._read())
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._shm = None
+        if self.name is not None:
+            self._shm = SharedMemory(name=self.name)
+
+    def _read(self):
+        if self._shm is None:
+            return list(self._values)
+        return list(struct.unpack_from('qq', self._shm.buf))
+
+    def _write(self, done, total):
+        if self._shm is None:
+            self._values = [done, total]
+        else:
+            struct.pack_into('qq', self._shm.buf, 0, done, total)
+
+    @property
+    def done(self):
+        return self._read()[0]
+
+    @property
+    def total(self):
+        return self._read()[1]
+
+    def start(self, total):
+        """Set the number of steps and reset the number of steps done."""
+        with self._lock:
+            self._write(0, total)
+
+    def update(self, n=1):
+        """Add n steps done."""
+        with self._lock:
+            done, total = self._read()
+            self._write(done + n, total)
+
+    def unlink(self):
+        """Free the shared memory in the process which created it."""
+        if self._shm is not None:
+            self._values = self._read()
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+
+def release_attached():
+    """Close shared memory of attached arrays which are no longer used."""
+    for item in list(_attached):
+        ref, shm = item
+        if ref() is None:
+            shm.close()
+            _attached.remove(item)
+
+
+def share(obj, created=None, depth=2):
+    """Move large arrays of an object to shared memory.
+
+    Parameters
+    ----------
+    obj : object
+        An array, or an object (e.g. Raw, Epochs, AvgEpochsTFR) whose
+        attributes (up to depth levels) are searched for arrays.
+    created : list | None
+        If a list, all created SharedArray objects are appended.
+    depth : int
+        How many levels of attributes are searched.
+
+    Returns
+    -------
+    obj : object
+        A shallow copy of obj with SharedArray references instead of large
+        arrays (or obj itself if no arrays have been replaced).
+    """
+    if isinstance(obj, np.ndarray):
+        if (have_shared_memory and obj.nbytes >= MIN_NBYTES
+                and obj.dtype != object):
+            obj = SharedArray(obj)
+            if created is not None:
+                created.append(obj)
+        return obj
+    if depth > 0 and hasattr(obj, "__dict__") and not isinstance(obj, type):
+        replaced = {}
+        for key, value in vars(obj).items():
+            new = share(value, created, depth - 1)
+            if new is not value:
+                replaced[key] = new
+        if replaced:
+            obj = copy(obj)
+            obj.__dict__.update(replaced)
+    elif type(obj) in (tuple, list):
+        items = [share(item, created, depth) for item in obj]
+        if any(new is not item for new, item in zip(items, obj)):
+            obj = type(obj)(items)
+    elif type(obj) is dict:
+        items = {key: share(value, created, depth)
+                 for key, value in obj.items()}
+        if any(items[key] is not obj[key] for key in obj):
+            obj = items
+    return obj
+
+
+def attach(obj, unlink=False, depth=2):
+    """Replace SharedArray references of an object by arrays (in place).
+
+    Parameters
+    ----------
+    obj : object
+        An object returned by share (after pickling).
+    unlink : bool
+        Free the shared memory once it is no longer mapped (used for arrays
+        which are not needed by any other process).
+    depth : int
+        How many levels of attributes are searched.
+    """
+    if isinstance(obj, SharedArray):
+        return obj.attach(unlink)
+    if depth > 0 and hasattr(obj, "__dict__") and not isinstance(obj, type):
+        for key, value in vars(obj).items():
+            new = attach(value, unlink, depth - 1)
+            if new is not value:
+                obj.__dict__[key] = new
+    elif type(obj) in (tuple, list):
+        obj = type(obj)(attach(item, unlink, depth) for item in obj)
+    elif type(obj) is dict:
+        obj = {key: attach(value, unlink, depth)
+               for key, value in obj.items()}
+    return obj
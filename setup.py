@@ -40,10 +40,14 @@ setup(
     install_requires=['mne', 'numpy', 'scipy', 'matplotlib', 'PyQt5'],
     extras_require={"EDF export": ["pyedflib"],
                     "PICARD": ["python-picard"],
-                    "FastICA": ["scikit-learn"]},
+                    "FastICA": ["scikit-learn"],
+                    "YAML batch pipelines": ["pyyaml"]},
     entry_points={  # TODO: this won't work yet!
         'gui_scripts': [
             'mnelab=mnelab:main',
         ],
+        'console_scripts': [
+            'mnelab-batch=mnelab.batch.cli:main',
+        ],
     }
 )